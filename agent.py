@@ -0,0 +1,196 @@
+"""
+Remote probe agent
+Stands in for the database manager on sites without a database: results are
+buffered, cut into compressed batches and pushed to a central collector, which
+acks each batch once written. Unacked batches are resent after a reconnect.
+"""
+import time
+import uuid
+import select
+import socket
+import logging
+from collections import deque
+from threading import Thread, Event, Lock
+from ingest_protocol import PROTOCOL_VERSION, encode_frame, read_frame
+
+logger = logging.getLogger(__name__)
+
+
+class AgentDatabaseManager:
+    """
+    Database manager of an agent. insert_* calls are queued and sent by a
+    background thread; get_last_* lookups have no database to ask and return
+    None, as on a fresh database. At most max_pending_batches unacked batches
+    are kept in memory, the oldest are dropped beyond that.
+    """
+    def __init__(self, config):
+        self.agent_id = config.get('agent_id') or socket.gethostname()
+        self.host = config.get('collector_host', '127.0.0.1')
+        self.port = config.get('collector_port', 9555)
+        self.token = config.get('token')
+        self.batch_size = config.get('batch_size', 500)
+        self.flush_interval = config.get('flush_interval_seconds', 2)
+        self.max_pending_batches = config.get('max_pending_batches', 1000)
+        self.retry_delay = config.get('retry_delay_seconds', 5)
+        self.timeout = config.get('timeout_seconds', 10)
+        # New on every start, so the collector can tell a restarted agent from a resend
+        self.session = uuid.uuid4().hex
+        self.spool = None
+        self.lock = Lock()
+        self.wakeup = Event()
+        self.stop_event = Event()
+        self.thread = None
+        self.sock = None
+        self.records = []
+        self.first_record_at = None
+        self.next_seq = 1
+        # (seq, frame, record count) waiting for their ack, in order
+        self.unacked = deque()
+        self.sent_seq = 0
+        
+        self.batches_sent = 0
+        self.batches_acked = 0
+        self.records_acked = 0
+        self.records_dropped = 0
+        self.bytes_sent = 0
+        self.connections = 0
+    
+    def connect(self):
+        """Start the sender; the collector does not have to be reachable yet"""
+        self.stop_event.clear()
+        self.thread = Thread(target=self.send_loop, daemon=True, name='agent-sender')
+        self.thread.start()
+        logger.info(f"Agent {self.agent_id} sending results to {self.host}:{self.port}")
+        return True
+    
+    def disconnect(self, timeout=10):
+        """Send what is still buffered, wait up to timeout seconds for the acks and stop"""
+        with self.lock:
+            self._cut_batch()
+        deadline = time.monotonic() + timeout
+        while self.unacked and self.sock and time.monotonic() < deadline:
+            self.wakeup.set()
+            time.sleep(0.1)
+        self.stop_event.set()
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join(timeout=self.timeout)
+        if self.unacked:
+            logger.warning(f"Agent stopped with {sum(count for _, _, count in self.unacked)} unacknowledged records")
+    
+    def queue_record(self, method, kwargs):
+        with self.lock:
+            if not self.records:
+                self.first_record_at = time.monotonic()
+            self.records.append((method, kwargs))
+            if len(self.records) >= self.batch_size:
+                self._cut_batch()
+                self.wakeup.set()
+        return True
+    
+    def __getattr__(self, name):
+        if name.startswith('insert_'):
+            return lambda **kwargs: self.queue_record(name, kwargs)
+        if name.startswith('get_last_'):
+            return lambda *args, **kwargs: None
+        raise AttributeError(name)
+    
+    def _cut_batch(self):
+        """Turn the buffered records into a numbered, compressed batch; called with the lock held"""
+        if not self.records:
+            return
+        seq = self.next_seq
+        self.next_seq += 1
+        frame = encode_frame({'type': 'batch', 'seq': seq, 'records': self.records})
+        self.unacked.append((seq, frame, len(self.records)))
+        self.records = []
+        while len(self.unacked) > self.max_pending_batches:
+            _, _, count = self.unacked.popleft()
+            self.records_dropped += count
+            logger.warning(f"Agent buffer full, dropped a batch of {count} records")
+    
+    def _open(self):
+        """Connect and introduce ourselves; returns True once the collector welcomed us"""
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            sock.sendall(encode_frame({
+                'type': 'hello', 'version': PROTOCOL_VERSION, 'agent': self.agent_id,
+                'session': self.session, 'token': self.token
+            }))
+            reply = read_frame(sock)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Cannot reach collector {self.host}:{self.port}: {e}")
+            return False
+        if not reply or reply.get('type') != 'welcome':
+            logger.error(f"Collector refused agent {self.agent_id}: "
+                        f"{reply.get('error') if reply else 'connection closed'}")
+            sock.close()
+            return False
+        self.sock = sock
+        # Everything not acked yet goes out again
+        self.sent_seq = 0
+        self.connections += 1
+        logger.info(f"Connected to collector {self.host}:{self.port}, "
+                   f"{len(self.unacked)} batches to (re)send")
+        return True
+    
+    def _close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+    
+    def _read_acks(self, wait):
+        """Apply the acks that arrive within wait seconds"""
+        while select.select([self.sock], [], [], wait)[0]:
+            message = read_frame(self.sock)
+            if message is None:
+                raise ConnectionError("Collector closed the connection")
+            if message.get('type') == 'ack':
+                with self.lock:
+                    while self.unacked and self.unacked[0][0] <= message['seq']:
+                        _, _, count = self.unacked.popleft()
+                        self.batches_acked += 1
+                        self.records_acked += count
+            wait = 0
+    
+    def send_loop(self):
+        """Sender thread: cut batches, send the ones not sent on this connection yet, collect acks"""
+        while not self.stop_event.is_set():
+            if self.sock is None and not self._open():
+                self.stop_event.wait(self.retry_delay)
+                continue
+            
+            with self.lock:
+                if self.records and time.monotonic() - self.first_record_at >= self.flush_interval:
+                    self._cut_batch()
+                pending = [(seq, frame) for seq, frame, _ in self.unacked if seq > self.sent_seq]
+            try:
+                for seq, frame in pending:
+                    self.sock.sendall(frame)
+                    self.sent_seq = seq
+                    self.batches_sent += 1
+                    self.bytes_sent += len(frame)
+                self._read_acks(0.2)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Lost connection to collector: {e}")
+                self._close()
+                continue
+            self.wakeup.wait(0.2)
+            self.wakeup.clear()
+        self._close()
+    
+    def get_stats(self):
+        """Return buffer and delivery counters"""
+        with self.lock:
+            return {
+                'connected': self.sock is not None,
+                'buffered_records': len(self.records),
+                'unacked_batches': len(self.unacked),
+                'unacked_records': sum(count for _, _, count in self.unacked),
+                'batches_sent': self.batches_sent,
+                'batches_acked': self.batches_acked,
+                'records_acked': self.records_acked,
+                'records_dropped': self.records_dropped,
+                'bytes_sent': self.bytes_sent,
+                'connections': self.connections
+            }
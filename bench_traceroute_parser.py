@@ -0,0 +1,133 @@
+"""
+Traceroute parser corpus check and microbenchmark
+Parses every captured output in fixtures/traceroute, compares the hops with the
+expected .json next to it, and reports lines per second and allocated blocks per line
+
+Usage:
+    python bench_traceroute_parser.py            # check corpus, then benchmark
+    python bench_traceroute_parser.py --update   # rewrite the expected .json files
+"""
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import tracemalloc
+import traceroute_parser
+from traceroute_parser import parse_traceroute
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'traceroute')
+
+
+def load_corpus():
+    """Return [(name, output)] for every captured output in the corpus"""
+    corpus = []
+    for path in sorted(glob.glob(os.path.join(CORPUS_DIR, '*.txt'))):
+        with open(path, newline='') as f:
+            corpus.append((os.path.splitext(os.path.basename(path))[0], f.read()))
+    return corpus
+
+
+def check_corpus(corpus, update=False):
+    """Compare parsed hops with the expected .json files; returns the number of mismatches"""
+    failures = 0
+    for name, output in corpus:
+        expected_path = os.path.join(CORPUS_DIR, f"{name}.json")
+        hops = parse_traceroute(output)
+        if update:
+            with open(expected_path, 'w') as f:
+                json.dump(hops, f, indent=2)
+                f.write('\n')
+            print(f"  updated {name}")
+            continue
+        
+        if not os.path.exists(expected_path):
+            print(f"  MISSING {name}.json (run with --update)")
+            failures += 1
+            continue
+        with open(expected_path) as f:
+            expected = json.load(f)
+        if hops != expected:
+            failures += 1
+            print(f"  FAIL    {name}")
+            for want, got in zip(expected, hops):
+                if want != got:
+                    print(f"    expected {want}\n    got      {got}")
+            if len(expected) != len(hops):
+                print(f"    expected {len(expected)} hops, got {len(hops)}")
+        else:
+            print(f"  ok      {name} ({len(hops)} hops)")
+    return failures
+
+
+def benchmark(corpus, iterations):
+    """Report parse throughput and allocated blocks per output line"""
+    outputs = [output for _, output in corpus]
+    lines = sum(len(output.splitlines()) for output in outputs)
+    
+    for output in outputs:
+        parse_traceroute(output)
+    
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for output in outputs:
+            parse_traceroute(output)
+    elapsed = time.perf_counter() - start
+    print(f"  {lines * iterations / elapsed:,.0f} lines/s "
+          f"({lines} lines x {iterations} iterations in {elapsed:.2f}s)")
+    
+    # Blocks allocated by the parser code, from a snapshot taken as parse_traceroute
+    # returns (its hops, lines and tokenizer state still alive) diffed with one before it
+    tracemalloc.start()
+    parser_only = [tracemalloc.Filter(True, traceroute_parser.__file__)]
+    blocks = 0
+    results = []
+    for output in outputs:
+        before = tracemalloc.take_snapshot().filter_traces(parser_only)
+        during = []
+        
+        def snapshot_on_return(frame, event, arg):
+            if event == 'return' and frame.f_code is parse_traceroute.__code__:
+                during.append(tracemalloc.take_snapshot().filter_traces(parser_only))
+        
+        sys.setprofile(snapshot_on_return)
+        try:
+            results.append(parse_traceroute(output))
+        finally:
+            sys.setprofile(None)
+        blocks += sum(stat.count_diff for stat in during[0].compare_to(before, 'lineno') if stat.count_diff > 0)
+    
+    # The peak also counts temporaries released during the parse
+    tracemalloc.reset_peak()
+    baseline, _ = tracemalloc.get_traced_memory()
+    retained = [parse_traceroute(output) for output in outputs]
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    
+    print(f"  {blocks / lines:.1f} blocks allocated per line, "
+          f"{(current - baseline) / lines:.0f} bytes retained per line, "
+          f"{(peak - baseline) / lines:.0f} bytes peak per line")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--update', action='store_true', help='rewrite the expected .json files')
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+    
+    corpus = load_corpus()
+    print(f"Corpus: {len(corpus)} outputs in {CORPUS_DIR}")
+    failures = check_corpus(corpus, update=args.update)
+    if failures:
+        print(f"{failures} corpus mismatches")
+        sys.exit(1)
+    
+    if not args.update:
+        print("Benchmark:")
+        benchmark(corpus, args.iterations)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+"""
+Central collector for remote probe agents
+Accepts agent connections, writes each received batch through the database
+manager in one go, tagged with the agent id, and acks it once written
+"""
+import sys
+import hmac
+import time
+import signal
+import socket
+import logging
+import socketserver
+from threading import Thread, Lock
+from config_loader import load_config
+from db_utils import create_database_manager
+from retention import RetentionManager
+from metrics_exporter import MetricsExporter
+from ingest_protocol import PROTOCOL_VERSION, encode_frame, read_frame
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+logger = logging.getLogger(__name__)
+
+
+# Last applied batch per agent, written in the same transaction as the batch's rows
+AGENT_BATCH_QUERY = """
+    INSERT INTO agent_batches (agent, session, last_seq)
+    VALUES (%s, %s, %s)
+    ON DUPLICATE KEY UPDATE session = VALUES(session), last_seq = VALUES(last_seq)
+"""
+
+
+class _AgentState:
+    """Delivery state of one agent: the last batch applied in its current session"""
+    def __init__(self):
+        self.lock = Lock()
+        # Loaded from agent_batches when the agent first connects
+        self.loaded = False
+        self.session = None
+        self.last_seq = 0
+        self.address = None
+        self.last_seen = None
+        self.batches = 0
+        self.records = 0
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.server.collector.serve_connection(self.request, self.client_address)
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class Collector:
+    """
+    TCP server for agent batches. A batch is acked only after its rows were
+    written (or queued by write-behind / the spool); a batch the agent resends
+    after a lost ack is recognized by its sequence number and acked again
+    without writing it twice. The last sequence number is stored in
+    agent_batches along with the rows, so this holds across collector restarts.
+    """
+    def __init__(self, config, db_manager):
+        self.db_manager = db_manager
+        self.host = config.get('host', '0.0.0.0')
+        self.port = config.get('port', 9555)
+        self.token = config.get('token')
+        self.idle_timeout = config.get('idle_timeout_seconds', 300)
+        self.lock = Lock()
+        self.agents = {}
+        # Open agent connections, closed on stop
+        self.sockets = set()
+        self.server = None
+        self.thread = None
+        self.connections = 0
+        self.duplicates = 0
+        self.failed_batches = 0
+    
+    def _agent_state(self, agent):
+        with self.lock:
+            state = self.agents.get(agent)
+            if state is None:
+                state = self.agents[agent] = _AgentState()
+            return state
+    
+    def _load_state(self, agent, state):
+        """Continue from the last batch a previous collector run wrote for agent; called with state.lock held"""
+        try:
+            rows = self.db_manager.fetch_all(
+                "SELECT session, last_seq FROM agent_batches WHERE agent = %s", (agent,))
+        except self.db_manager.unavailable_errors + self.db_manager.database_errors as e:
+            logger.warning(f"Could not look up the last batch of agent {agent}: {e}")
+            return
+        if rows:
+            state.session = rows[0]['session']
+            state.last_seq = rows[0]['last_seq']
+        state.loaded = True
+    
+    def apply_batch(self, agent, session, seq, records):
+        """Write one batch unless it was applied before; returns whether it may be acked"""
+        state = self._agent_state(agent)
+        with state.lock:
+            if not state.loaded:
+                self._load_state(agent, state)
+            if state.session == session and seq <= state.last_seq:
+                self.duplicates += 1
+                return True
+            
+            self.db_manager.collect_writes()
+            try:
+                for method, kwargs in records:
+                    if not method.startswith('insert_'):
+                        logger.warning(f"Agent {agent} sent unknown call {method}")
+                        continue
+                    try:
+                        getattr(self.db_manager, method)(**kwargs, agent=agent)
+                    except (AttributeError, TypeError) as e:
+                        logger.error(f"Agent {agent} sent an invalid {method} record: {e}")
+                self.db_manager.write([(AGENT_BATCH_QUERY, [(agent, session, seq)])])
+            finally:
+                success = self.db_manager.write_collected()
+            if not success:
+                self.failed_batches += 1
+                return False
+            
+            state.session = session
+            state.last_seq = seq
+            state.batches += 1
+            state.records += len(records)
+            return True
+    
+    def serve_connection(self, sock, address):
+        """Handle one agent connection: hello, then batches until it disconnects"""
+        sock.settimeout(self.idle_timeout)
+        with self.lock:
+            self.sockets.add(sock)
+        try:
+            hello = read_frame(sock)
+            if not hello or hello.get('type') != 'hello' or not hello.get('agent'):
+                return
+            agent = str(hello['agent'])
+            if hello.get('version') != PROTOCOL_VERSION:
+                sock.sendall(encode_frame({'type': 'error', 'error': 'unsupported protocol version'}))
+                return
+            if self.token and not hmac.compare_digest(str(hello.get('token') or ''), self.token):
+                logger.warning(f"Rejected agent {agent} from {address[0]}: bad token")
+                sock.sendall(encode_frame({'type': 'error', 'error': 'bad token'}))
+                return
+            sock.sendall(encode_frame({'type': 'welcome'}))
+            self.connections += 1
+            state = self._agent_state(agent)
+            state.address = address[0]
+            logger.info(f"Agent {agent} connected from {address[0]}")
+            
+            while True:
+                message = read_frame(sock)
+                if message is None:
+                    break
+                if message.get('type') != 'batch':
+                    continue
+                state.last_seen = time.time()
+                if not self.apply_batch(agent, hello.get('session'), message['seq'], message['records']):
+                    # Dropping the connection makes the agent resend everything unacked
+                    logger.error(f"Could not write batch {message['seq']} of agent {agent}, disconnecting it")
+                    break
+                sock.sendall(encode_frame({'type': 'ack', 'seq': message['seq']}))
+            logger.info(f"Agent {agent} disconnected")
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Connection from {address[0]} failed: {e}")
+        finally:
+            with self.lock:
+                self.sockets.discard(sock)
+    
+    def get_stats(self):
+        """Return per-agent delivery counters"""
+        with self.lock:
+            agents = dict(self.agents)
+        return {
+            'connections': self.connections,
+            'duplicate_batches': self.duplicates,
+            'failed_batches': self.failed_batches,
+            'agents': {
+                agent: {
+                    'address': state.address,
+                    'last_seen': state.last_seen,
+                    'batches': state.batches,
+                    'records': state.records
+                }
+                for agent, state in agents.items()
+            }
+        }
+    
+    def start(self):
+        """Start listening for agents"""
+        self.server = _Server((self.host, self.port), _Handler)
+        self.server.collector = self
+        self.port = self.server.server_address[1]
+        self.thread = Thread(target=self.server.serve_forever, daemon=True, name='collector')
+        self.thread.start()
+        logger.info(f"Collector listening on {self.host}:{self.port}")
+    
+    def stop(self):
+        """Stop accepting agents and close their connections; unacked batches are resent to the next collector"""
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+        with self.lock:
+            sockets = list(self.sockets)
+        for sock in sockets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        logger.info(f"Collector stopped ({self.connections} agent connections, "
+                   f"{self.duplicates} duplicate batches)")
+
+
+def main():
+    """Run a standalone collector writing to the database in config.yaml"""
+    config = load_config('config.yaml')
+    if not config:
+        sys.exit(1)
+    
+    db_manager = create_database_manager(config['database'])
+    if not db_manager.connect():
+        if not db_manager.spool:
+            logger.error("Failed to connect to database")
+            sys.exit(1)
+        logger.warning("Failed to connect to database, batches will be spooled until it is reachable")
+        db_manager.spool.mark_outage()
+    
+    retention_manager = RetentionManager(db_manager, config.get('retention', {'enabled': False}))
+    collector = Collector(config.get('collector', {}), db_manager)
+    metrics_exporter = None
+    if config.get('metrics', {}).get('enabled', False):
+        metrics_exporter = MetricsExporter(config['metrics'], db_manager, collector=collector)
+    collector.start()
+    retention_manager.start()
+    if metrics_exporter:
+        metrics_exporter.start()
+    
+    running = True
+    
+    def request_stop(signum, frame):
+        nonlocal running
+        running = False
+    
+    signal.signal(signal.SIGINT, request_stop)
+    if hasattr(signal, 'SIGTERM'):
+        signal.signal(signal.SIGTERM, request_stop)
+    while running:
+        time.sleep(1)
+    
+    if metrics_exporter:
+        metrics_exporter.stop()
+    collector.stop()
+    retention_manager.stop()
+    db_manager.disconnect()
+
+
+if __name__ == '__main__':
+    main()
@@ -34,9 +34,21 @@ def validate_config(config):
             logger.error(f"Missing required configuration section: {section}")
             return False
     
+    # Agents send their results to a collector and need no database settings
+    if config.get('agent', {}).get('enabled', False):
+        logger.info("Configuration validation passed")
+        return True
+    
     # Validate database config
     db_config = config['database']
-    required_db_fields = ['host', 'user', 'password', 'database']
+    backend = db_config.get('backend', 'mysql')
+    if backend == 'sqlite':
+        required_db_fields = []
+    elif backend == 'mysql':
+        required_db_fields = ['host', 'user', 'password', 'database']
+    else:
+        logger.error(f"Unknown database backend: {backend}")
+        return False
     for field in required_db_fields:
         if field not in db_config:
             logger.error(f"Missing required database field: {field}")
@@ -1,21 +1,644 @@
 """
-Database utility module for MySQL operations
+Database utility module
+Storage interface shared by all backends plus the MySQL implementation
 """
-import mysql.connector
-from mysql.connector import Error, pooling
+import time
+import json
+import hashlib
 import logging
+from queue import Queue, Empty, Full
+from threading import Thread, Event, Lock, local
+import mysql.connector
+from mysql.connector import Error, InterfaceError, OperationalError, pooling
+from spool import LocalSpool
+from rollups import RollupAggregator
+from state_store import StateStore
+from dimensions import DimensionCache
 
 logger = logging.getLogger(__name__)
 
 
-class DatabaseManager:
+class DatabaseUnavailableError(Exception):
+    """Raised when no database connection can be obtained"""
+    pass
+
+
+def content_id(text):
+    """
+    Content address of a canonical string: 63 bits of its SHA-1
+    Identical content maps to the same id without a database round trip.
+    """
+    return int.from_bytes(hashlib.sha1(text.encode()).digest()[:8], 'big') >> 1
+
+
+def traceroute_path_signature(hops):
+    """Ordered hop IPs of a traceroute, '*' for hops that timed out"""
+    return '>'.join(hop['hop_ip'] or '*' for hop in hops)
+
+
+def traceroute_path_id(hops):
+    """Content address of a traceroute path"""
+    return content_id(traceroute_path_signature(hops))
+
+
+def dns_answer_signature(answers):
+    """Canonical form of a DNS answer set: sorted, de-duplicated, comma separated"""
+    return ','.join(sorted(set(answers)))
+
+
+def dns_answer_set_id(answers):
+    """Content address of a DNS answer set, independent of answer order"""
+    return content_id(dns_answer_signature(answers))
+
+
+class WriteBehindQueue:
+    """
+    Bounded in-memory queue of pending writes, flushed by a background thread.
+    Each item is a list of (query, params_list) statements that must land together.
+    """
+    def __init__(self, db_manager, config):
+        self.db_manager = db_manager
+        self.max_queue_size = config.get('max_queue_size', 10000)
+        self.batch_size = config.get('batch_size', 500)
+        self.flush_interval = config.get('flush_interval_seconds', 2)
+        self.enqueue_timeout = config.get('enqueue_timeout_seconds', 1)
+        self.stats_interval = config.get('stats_log_interval_seconds', 60)
+        self.queue = Queue(maxsize=self.max_queue_size)
+        self.stop_event = Event()
+        self.thread = None
+        
+        # Tuning statistics
+        self.stats_lock = Lock()
+        self.flush_count = 0
+        self.rows_flushed = 0
+        self.rows_failed = 0
+        self.sync_fallbacks = 0
+        self.last_flush_rows = 0
+        self.last_flush_latency_ms = None
+        self.max_flush_latency_ms = 0.0
+        self.total_flush_latency_ms = 0.0
+    
+    def put(self, statements):
+        """Queue statements for the flusher, writing synchronously if the queue stays full"""
+        try:
+            self.queue.put(statements, timeout=self.enqueue_timeout)
+            return True
+        except Full:
+            with self.stats_lock:
+                self.sync_fallbacks += 1
+            if self.db_manager.spool:
+                logger.warning("Write-behind queue full, spooling locally")
+                return self.db_manager.spool.append(statements)
+            logger.warning("Write-behind queue full, writing synchronously")
+            return self.db_manager.write_now(statements)
+    
+    def _collect_batch(self, first_wait):
+        """Collect queued items until batch_size rows are pending or flush_interval elapses"""
+        items = []
+        rows = 0
+        deadline = None
+        while rows < self.batch_size:
+            if deadline is None:
+                wait = first_wait
+            else:
+                wait = deadline - time.monotonic()
+                if wait <= 0:
+                    break
+            try:
+                item = self.queue.get(timeout=wait) if wait > 0 else self.queue.get_nowait()
+            except Empty:
+                break
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+            items.append(item)
+            rows += sum(len(params_list) for _, params_list in item)
+        return items, rows
+    
+    def _flush(self, items, rows):
+        """Write collected items grouped by statement in a single transaction"""
+        grouped = {}
+        for statements in items:
+            for query, params_list in statements:
+                grouped.setdefault(query, []).extend(params_list)
+        
+        start_time = time.monotonic()
+        try:
+            failed_rows = 0 if self.db_manager.write_now(list(grouped.items()), raise_rejected=True) else rows
+        except self.db_manager.database_errors as e:
+            # Something in the batch is rejected by the database, write items one by one
+            logger.warning(f"Write-behind batch rejected ({e}), writing items individually")
+            failed_rows = self._flush_individually(items)
+        latency_ms = (time.monotonic() - start_time) * 1000
+        written_rows = rows - failed_rows
+        
+        with self.stats_lock:
+            self.last_flush_latency_ms = latency_ms
+            self.max_flush_latency_ms = max(self.max_flush_latency_ms, latency_ms)
+            if written_rows:
+                self.flush_count += 1
+                self.rows_flushed += written_rows
+                self.last_flush_rows = written_rows
+                self.total_flush_latency_ms += latency_ms
+            self.rows_failed += failed_rows
+        
+        if failed_rows:
+            logger.error(f"Write-behind flush: {failed_rows} of {rows} rows failed")
+    
+    def _flush_individually(self, items):
+        """Write items one at a time so only the rejected ones are dropped, return the failed row count"""
+        failed_rows = 0
+        for statements in items:
+            if not self.db_manager.write_now(statements):
+                failed_rows += sum(len(params_list) for _, params_list in statements)
+        return failed_rows
+    
+    def flush_loop(self):
+        """Background flusher loop"""
+        last_stats_log = time.monotonic()
+        while not self.stop_event.is_set():
+            items, rows = self._collect_batch(self.flush_interval)
+            if items:
+                self._flush(items, rows)
+            
+            if self.stats_interval and time.monotonic() - last_stats_log >= self.stats_interval:
+                last_stats_log = time.monotonic()
+                self.log_stats()
+        
+        # Drain whatever is left on shutdown
+        while True:
+            items, rows = self._collect_batch(0)
+            if not items:
+                break
+            self._flush(items, rows)
+    
+    def get_stats(self):
+        """Return queue depth, flush latency and rows per flush"""
+        with self.stats_lock:
+            return {
+                'queue_depth': self.queue.qsize(),
+                'max_queue_size': self.max_queue_size,
+                'flush_count': self.flush_count,
+                'rows_flushed': self.rows_flushed,
+                'rows_failed': self.rows_failed,
+                'sync_fallbacks': self.sync_fallbacks,
+                'last_flush_rows': self.last_flush_rows,
+                'avg_rows_per_flush': (self.rows_flushed / self.flush_count) if self.flush_count else None,
+                'last_flush_latency_ms': self.last_flush_latency_ms,
+                'avg_flush_latency_ms': (self.total_flush_latency_ms / self.flush_count) if self.flush_count else None,
+                'max_flush_latency_ms': self.max_flush_latency_ms
+            }
+    
+    def log_stats(self):
+        """Log write-behind statistics"""
+        stats = self.get_stats()
+        avg_rows = stats['avg_rows_per_flush']
+        avg_latency = stats['avg_flush_latency_ms']
+        logger.info(f"Write-behind: queue depth {stats['queue_depth']}/{stats['max_queue_size']}, "
+                   f"{stats['flush_count']} flushes, "
+                   f"avg {avg_rows or 0:.1f} rows/flush, "
+                   f"avg latency {avg_latency or 0:.1f}ms (max {stats['max_flush_latency_ms']:.1f}ms), "
+                   f"failed rows: {stats['rows_failed']}")
+    
+    def start(self):
+        """Start the flusher thread"""
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = Thread(target=self.flush_loop, daemon=True)
+        self.thread.start()
+        logger.info(f"Write-behind flusher started (batch size: {self.batch_size}, "
+                   f"flush interval: {self.flush_interval}s)")
+    
+    def stop(self):
+        """Stop the flusher thread after draining the queue"""
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=self.flush_interval + 10)
+        self.log_stats()
+
+
+class BaseDatabaseManager:
+    """
+    Storage interface used by the monitors.
+    Backends implement connect, disconnect, execute_statements and fetch_all;
+    write-behind batching, spooling and the insert_* API are shared.
+    """
+    backend_name = None
+    # Errors that mean the database could not be reached (as opposed to a rejected statement)
+    unavailable_errors = (DatabaseUnavailableError,)
+    # Errors raised by the driver when a statement fails
+    database_errors = ()
+    # Whether raw tables use RANGE partitions that retention maintenance can drop
+    supports_partitions = False
+    
     def __init__(self, config):
         self.config = config
+        self.write_behind = None
+        self.spool = None
+        self.rollups = None
+        self.state_store = None
+        # Name -> id cache for the target/domain/nameserver/url/server dimension tables
+        self.dimensions = DimensionCache(self)
+        # Per-thread statement and side effect lists while collect_writes() is active
+        self.collecting = local()
+        
+        write_behind_config = config.get('write_behind', {})
+        if write_behind_config.get('enabled', False):
+            self.write_behind = WriteBehindQueue(self, write_behind_config)
+        
+        spool_config = config.get('spool', {})
+        if spool_config.get('enabled', False):
+            self.spool = LocalSpool(self, spool_config)
+        
+        rollup_config = config.get('rollups', {})
+        if rollup_config.get('enabled', False):
+            self.rollups = RollupAggregator(self, rollup_config)
+        
+        state_config = config.get('state_store', {})
+        if state_config.get('enabled', False):
+            self.state_store = StateStore(state_config)
+    
+    def connect(self):
+        """Connect to the database, returns True on success"""
+        raise NotImplementedError
+    
+    def disconnect(self):
+        """Flush pending writes and close the database"""
+        raise NotImplementedError
+    
+    def execute_statements(self, statements):
+        """
+        Execute (query, params_list) statements in a single transaction
+        Raises one of unavailable_errors if the database cannot be reached.
+        """
+        raise NotImplementedError
+    
+    def fetch_all(self, query, params=None):
+        """Run a read query and return rows as dictionaries"""
+        raise NotImplementedError
+    
+    def _start_spool(self):
+        if self.spool and self.spool.conn is None:
+            # Start spooling before the first connection attempt so an outage at startup loses nothing
+            self.spool.start()
+    
+    def _start_background(self):
+        if self.write_behind:
+            self.write_behind.start()
+        if self.rollups:
+            self.rollups.start()
+    
+    def _stop_background(self):
+        """Flush the rollups, drain the write-behind queue and stop the spool replayer"""
+        if self.rollups:
+            self.rollups.stop()
+        if self.write_behind:
+            self.write_behind.stop()
+        if self.spool:
+            self.spool.stop()
+    
+    def execute_query(self, query, params=None):
+        """Execute a query (INSERT, UPDATE, DELETE) with automatic reconnection"""
+        try:
+            self.execute_statements([(query, [params or ()])])
+            return True
+        except self.unavailable_errors + self.database_errors as e:
+            logger.error(f"Error executing query: {e}")
+            return False
+    
+    def execute_batch(self, statements):
+        """
+        Execute multi-row statements in a single transaction
+        statements: list of (query, params_list) tuples, each run with executemany
+        """
+        try:
+            self.execute_statements(statements)
+            return True
+        except self.unavailable_errors + self.database_errors as e:
+            logger.error(f"Error executing batch: {e}")
+            return False
+    
+    def write_now(self, statements, raise_rejected=False):
+        """
+        Write statements immediately, spooling them locally if the database is unreachable
+        raise_rejected: raise the database error of statements the database rejects
+        instead of returning False
+        """
+        if self.spool and self.spool.outage.is_set():
+            return self.spool.append(statements)
+        
+        try:
+            self.execute_statements(statements)
+            return True
+        except self.unavailable_errors as e:
+            if self.spool:
+                logger.warning(f"Database write failed ({e}), spooling locally")
+                spooled = self.spool.append(statements)
+                self.spool.mark_outage()
+                return spooled
+            logger.error(f"Error executing batch: {e}")
+            return False
+        except self.database_errors as e:
+            if raise_rejected:
+                raise
+            logger.error(f"Error executing batch: {e}")
+            return False
+    
+    def write(self, statements):
+        """Write statements now, or hand them to the write-behind queue when enabled"""
+        collected = getattr(self.collecting, 'statements', None)
+        if collected is not None:
+            collected.extend(statements)
+            return True
+        if self.write_behind:
+            return self.write_behind.put(statements)
+        return self.write_now(statements)
+    
+    def collect_writes(self):
+        """
+        Hold back this thread's writes until write_collected(), along with the
+        rollup and state store updates of the rows, which are only applied once
+        the write succeeded (a failed batch is resent and must not count twice)
+        """
+        self.collecting.statements = []
+        self.collecting.effects = []
+    
+    def write_collected(self):
+        """Write the statements held back since collect_writes() as one batch, grouped by statement"""
+        statements = self.collecting.statements
+        effects = self.collecting.effects
+        self.collecting.statements = None
+        self.collecting.effects = None
+        grouped = {}
+        for query, params_list in statements:
+            grouped.setdefault(query, []).extend(params_list)
+        success = self.write(list(grouped.items())) if grouped else True
+        if success:
+            for func, args in effects:
+                func(*args)
+        return success
+    
+    def _apply(self, func, *args):
+        """Update an in-memory aggregate for a row, or hold the update back while collecting"""
+        effects = getattr(self.collecting, 'effects', None)
+        if effects is not None:
+            effects.append((func, args))
+        else:
+            func(*args)
+    
+    def flush_rollups(self):
+        """Write pending rollup deltas now"""
+        if self.rollups:
+            return self.rollups.flush()
+        return True
+    
+    def get_spool_stats(self):
+        """Return local spool statistics, or None when the spool is disabled"""
+        if self.spool:
+            return self.spool.get_stats()
+        return None
+    
+    def get_write_behind_stats(self):
+        """Return write-behind queue statistics, or None when write-behind is disabled"""
+        if self.write_behind:
+            return self.write_behind.get_stats()
+        return None
+    
+    def get_state_stats(self):
+        """Return latest-state store statistics, or None when it is disabled"""
+        if self.state_store:
+            return self.state_store.get_stats()
+        return None
+    
+    def _record_state(self, kind, row):
+        if self.state_store:
+            self._apply(self.state_store.add, kind, row)
+    
+    def insert_ping_result(self, timestamp, unix_timestamp, target, ip_address, 
+                          ping_ms, min_ping_ms, max_ping_ms, jitter_ms, packet_loss, is_reachable, connection_status,
+                          delta_ms=None, ewma_jitter_ms=None, agent=None):
+        """Insert ping result into database (agent: remote agent id, None for local results)"""
+        row = {
+            'timestamp': timestamp, 'unix_timestamp': unix_timestamp, 'target': target,
+            'ip_address': ip_address, 'ping_ms': ping_ms, 'min_ping_ms': min_ping_ms,
+            'max_ping_ms': max_ping_ms, 'jitter_ms': jitter_ms, 'delta_ms': delta_ms,
+            'ewma_jitter_ms': ewma_jitter_ms, 'packet_loss': packet_loss,
+            'is_reachable': is_reachable, 'connection_status': connection_status, 'agent': agent
+        }
+        self._record_state('ping', row)
+        statements = self.dimensions.fact_statements('ping', row)
+        success = self.write(statements)
+        if self.rollups:
+            self._apply(self.rollups.add_ping, timestamp, target, ping_ms, packet_loss, is_reachable,
+                        connection_status, agent)
+        return success
+    
+    def get_last_ping_sample(self, target):
+        """(ping_ms, ewma_jitter_ms) of the most recent reachable ping to target, or None"""
+        try:
+            rows = self.fetch_all("""
+                SELECT ping_ms, ewma_jitter_ms FROM ping
+                WHERE target = %s AND ping_ms IS NOT NULL
+                ORDER BY unix_timestamp DESC
+                LIMIT 1
+            """, (target,))
+        except self.unavailable_errors + self.database_errors as e:
+            logger.warning(f"Could not look up last ping sample for {target}: {e}")
+            return None
+        return (rows[0]['ping_ms'], rows[0]['ewma_jitter_ms']) if rows else None
+    
+    def insert_traceroute_run(self, trace_id, timestamp, unix_timestamp, target,
+                              path_id, hops, previous_path_id=None, new_path=True, agent=None):
+        """
+        Insert one traceroute run as a row referencing its content-addressed path
+        Hop rows are only written for paths not seen before (INSERT IGNORE makes a
+        repeated new_path write harmless). Everything is one atomic write.
+        """
+        statements = []
+        if new_path:
+            statements.append(("""
+                INSERT IGNORE INTO traceroute_paths (path_id, hop_count, hop_ips,
+                                                   first_seen, first_unix_timestamp)
+                VALUES (%s, %s, %s, %s, %s)
+            """, [(path_id, len(hops), traceroute_path_signature(hops), timestamp, unix_timestamp)]))
+            statements.append(("""
+                INSERT IGNORE INTO traceroute_path_hops (path_id, hop_index, hop_number,
+                                                       hop_ip, hop_hostname)
+                VALUES (%s, %s, %s, %s, %s)
+            """, [(path_id, index, hop['hop_number'], hop['hop_ip'], hop['hop_hostname'])
+                  for index, hop in enumerate(hops, 1)]))
+        
+        rtt_vector = json.dumps([round(hop['rtt_ms'], 3) if hop['rtt_ms'] is not None else None
+                                 for hop in hops], separators=(',', ':'))
+        route_changed = previous_path_id is not None and previous_path_id != path_id
+        row = {
+            'trace_id': trace_id, 'timestamp': timestamp, 'unix_timestamp': unix_timestamp,
+            'target': target, 'path_id': path_id, 'previous_path_id': previous_path_id,
+            'route_changed': route_changed, 'hop_count': len(hops),
+            'timeout_count': sum(1 for hop in hops if hop['is_timeout']), 'rtt_ms': rtt_vector,
+            'agent': agent
+        }
+        self._record_state('traceroute_runs', row)
+        statements.extend(self.dimensions.fact_statements('traceroute_runs', row))
+        return self.write(statements)
+    
+    def get_last_traceroute_path(self, target):
+        """Path id of the most recent traceroute run to target, or None"""
+        try:
+            rows = self.fetch_all("""
+                SELECT path_id FROM traceroute_runs
+                WHERE target = %s
+                ORDER BY unix_timestamp DESC
+                LIMIT 1
+            """, (target,))
+        except self.unavailable_errors + self.database_errors as e:
+            logger.warning(f"Could not look up last traceroute path for {target}: {e}")
+            return None
+        return rows[0]['path_id'] if rows else None
+    
+    def insert_speedtest_result(self, timestamp, unix_timestamp, server_name,
+                                server_location, server_country, download_mbps,
+                                upload_mbps, ping_ms, jitter_ms, packet_loss,
+                                isp, external_ip, idle_latency_ms, download_latency_ms,
+                                upload_latency_ms, bufferbloat_rating, test_duration_seconds,
+                                is_successful, error_message=None, discovery_seconds=None,
+                                measurement_seconds=None, latency_phases=None, agent=None):
+        """
+        Insert speed test result into database
+        latency_phases: per-phase latency stats ({'idle': {...}, 'download': ...}), stored as JSON
+        """
+        row = {
+            'timestamp': timestamp, 'unix_timestamp': unix_timestamp, 'server_name': server_name,
+            'server_location': server_location, 'server_country': server_country,
+            'download_mbps': download_mbps, 'upload_mbps': upload_mbps, 'ping_ms': ping_ms,
+            'jitter_ms': jitter_ms, 'packet_loss': packet_loss, 'isp': isp,
+            'external_ip': external_ip, 'idle_latency_ms': idle_latency_ms,
+            'download_latency_ms': download_latency_ms, 'upload_latency_ms': upload_latency_ms,
+            'bufferbloat_rating': bufferbloat_rating, 'test_duration_seconds': test_duration_seconds,
+            'discovery_seconds': discovery_seconds, 'measurement_seconds': measurement_seconds,
+            'latency_phases': json.dumps(latency_phases) if latency_phases else None,
+            'is_successful': is_successful, 'error_message': error_message, 'agent': agent
+        }
+        self._record_state('speedtest', row)
+        return self.write(self.dimensions.fact_statements('speedtest', row))
+    
+    def insert_dns_result(self, timestamp, unix_timestamp, domain, nameserver,
+                         record_type, resolution_time_ms, answers,
+                         is_successful, error_message=None, answer_set_id=None,
+                         previous_answer_set_id=None, new_answer_set=True, agent=None):
+        """
+        Insert DNS query result into database
+        The answers are interned in dns_answer_sets (written only for sets not seen
+        before) and the query row references them by id. A change from
+        previous_answer_set_id is recorded in dns_answer_changes.
+        """
+        statements = []
+        if answers and answer_set_id is None:
+            answer_set_id = dns_answer_set_id(answers)
+        if answer_set_id is not None and new_answer_set:
+            statements.append(("""
+                INSERT IGNORE INTO dns_answer_sets (answer_set_id, answer_count, answers, first_seen)
+                VALUES (%s, %s, %s, %s)
+            """, [(answer_set_id, len(set(answers)), dns_answer_signature(answers), timestamp)]))
+        
+        row = {
+            'timestamp': timestamp, 'unix_timestamp': unix_timestamp, 'domain': domain,
+            'nameserver': nameserver, 'record_type': record_type,
+            'resolution_time_ms': resolution_time_ms, 'answer_set_id': answer_set_id,
+            'is_successful': is_successful, 'error_message': error_message, 'agent': agent
+        }
+        self._record_state('dns_queries', row)
+        statements.extend(self.dimensions.fact_statements('dns_queries', row))
+        
+        if (answer_set_id is not None and previous_answer_set_id is not None
+                and answer_set_id != previous_answer_set_id):
+            statements.append(("""
+                INSERT INTO dns_answer_changes (timestamp, unix_timestamp, domain, nameserver,
+                                              record_type, previous_answer_set_id, answer_set_id)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+            """, [(timestamp, unix_timestamp, domain, nameserver, record_type,
+                   previous_answer_set_id, answer_set_id)]))
+        
+        success = self.write(statements)
+        if self.rollups:
+            self._apply(self.rollups.add_dns, timestamp, domain, nameserver, record_type,
+                        resolution_time_ms, is_successful, agent)
+        return success
+    
+    def get_last_dns_answer_set(self, domain, nameserver, record_type):
+        """Answer set id of the most recent successful query, or None"""
+        try:
+            rows = self.fetch_all("""
+                SELECT answer_set_id FROM dns_queries
+                WHERE domain = %s AND nameserver = %s AND record_type = %s
+                  AND answer_set_id IS NOT NULL
+                ORDER BY unix_timestamp DESC
+                LIMIT 1
+            """, (domain, nameserver, record_type))
+        except self.unavailable_errors + self.database_errors as e:
+            logger.warning(f"Could not look up last DNS answer set for {domain} via {nameserver}: {e}")
+            return None
+        return rows[0]['answer_set_id'] if rows else None
+    
+    def insert_address_change(self, timestamp, unix_timestamp, name, previous_address, address, agent=None):
+        """Record the address a monitored name resolves to (previous_address is None the first time)"""
+        return self.write([("""
+            INSERT INTO address_changes (timestamp, unix_timestamp, name, previous_address, address, agent)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """, [(timestamp, unix_timestamp, name, previous_address, address, agent)])])
+    
+    def get_last_address(self, name):
+        """Most recently recorded address of a name, or None"""
+        try:
+            rows = self.fetch_all("""
+                SELECT address FROM address_changes
+                WHERE name = %s
+                ORDER BY unix_timestamp DESC
+                LIMIT 1
+            """, (name,))
+        except self.unavailable_errors + self.database_errors as e:
+            logger.warning(f"Could not look up last address of {name}: {e}")
+            return None
+        return rows[0]['address'] if rows else None
+    
+    def insert_http_result(self, timestamp, unix_timestamp, url, dns_time_ms,
+                          connect_time_ms, tls_time_ms, ttfb_ms, total_time_ms,
+                          status_code, response_size, tls_version,
+                          is_successful, error_message=None, measurement_mode='cold', agent=None):
+        """Insert HTTP request result into database (measurement_mode: 'cold' or 'warm')"""
+        row = {
+            'timestamp': timestamp, 'unix_timestamp': unix_timestamp, 'url': url,
+            'dns_time_ms': dns_time_ms, 'connect_time_ms': connect_time_ms,
+            'tls_time_ms': tls_time_ms, 'ttfb_ms': ttfb_ms, 'total_time_ms': total_time_ms,
+            'status_code': status_code, 'response_size': response_size,
+            'tls_version': tls_version, 'is_successful': is_successful,
+            'error_message': error_message, 'measurement_mode': measurement_mode, 'agent': agent
+        }
+        self._record_state('http_requests', row)
+        statements = self.dimensions.fact_statements('http_requests', row)
+        success = self.write(statements)
+        if self.rollups:
+            self._apply(self.rollups.add_http, timestamp, url, total_time_ms, ttfb_ms, status_code,
+                        is_successful, agent)
+        return success
+
+
+class DatabaseManager(BaseDatabaseManager):
+    """MySQL storage backend using a mysql.connector connection pool"""
+    backend_name = 'mysql'
+    unavailable_errors = (DatabaseUnavailableError, InterfaceError, OperationalError)
+    database_errors = (Error,)
+    supports_partitions = True
+    
+    def __init__(self, config):
+        super().__init__(config)
         self.connection = None
         self.pool = None
     
     def connect(self):
         """Establish connection pool to MySQL database"""
+        self._start_spool()
+        
         try:
             # Create a connection pool
             self.pool = pooling.MySQLConnectionPool(
@@ -35,6 +658,7 @@ class DatabaseManager:
             if conn.is_connected():
                 logger.info("Successfully connected to MySQL database with connection pool")
                 conn.close()
+                self._start_background()
                 return True
         except Error as e:
             logger.error(f"Error connecting to MySQL: {e}")
@@ -43,6 +667,7 @@ class DatabaseManager:
     
     def disconnect(self):
         """Close database connection pool"""
+        self._stop_background()
         if self.pool:
             logger.info("MySQL connection pool closed")
             self.pool = None
@@ -55,6 +680,8 @@ class DatabaseManager:
                 if self.pool is None:
                     logger.warning("Connection pool not initialized, attempting to reconnect...")
                     self.connect()
+                    if self.pool is None:
+                        continue
                 
                 conn = self.pool.get_connection()
                 if conn.is_connected():
@@ -66,113 +693,74 @@ class DatabaseManager:
                     return None
         return None
     
-    def execute_query(self, query, params=None):
-        """Execute a query (INSERT, UPDATE, DELETE) with automatic reconnection"""
-        conn = None
+    def execute_statements(self, statements):
+        """
+        Execute (query, params_list) statements on one pooled connection
+        Multi-row writes run with executemany in a single transaction.
+        Raises DatabaseUnavailableError if no connection could be obtained.
+        """
+        conn = self._get_connection()
+        if not conn:
+            raise DatabaseUnavailableError("No database connection available")
+        
         cursor = None
         try:
-            conn = self._get_connection()
-            if not conn:
-                return False
-            
             cursor = conn.cursor()
-            cursor.execute(query, params or ())
+            if len(statements) == 1 and len(statements[0][1]) == 1:
+                query, params_list = statements[0]
+                cursor.execute(query, params_list[0])
+            else:
+                conn.start_transaction()
+                for query, params_list in statements:
+                    if params_list:
+                        cursor.executemany(query, params_list)
             conn.commit()
-            cursor.close()
-            conn.close()
-            return True
-        except Error as e:
-            logger.error(f"Error executing query: {e}")
-            return False
+        except Error:
+            try:
+                conn.rollback()
+            except:
+                pass
+            raise
         finally:
             if cursor:
                 try:
                     cursor.close()
                 except:
                     pass
-            if conn:
+            try:
+                conn.close()
+            except:
+                pass
+    
+    def fetch_all(self, query, params=None):
+        """Run a read query and return rows as dictionaries"""
+        conn = self._get_connection()
+        if not conn:
+            raise DatabaseUnavailableError("No database connection available")
+        
+        cursor = None
+        try:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(query, params or ())
+            return cursor.fetchall()
+        finally:
+            if cursor:
                 try:
-                    conn.close()
+                    cursor.close()
                 except:
                     pass
-    
-    def insert_ping_result(self, timestamp, unix_timestamp, target, ip_address, 
-                          ping_ms, min_ping_ms, max_ping_ms, jitter_ms, packet_loss, is_reachable, connection_status):
-        """Insert ping result into database"""
-        query = """
-            INSERT INTO ping (timestamp, unix_timestamp, target, ip_address, 
-                            ping_ms, min_ping_ms, max_ping_ms, jitter_ms, packet_loss, is_reachable, connection_status)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """
-        params = (timestamp, unix_timestamp, target, ip_address, 
-                 ping_ms, min_ping_ms, max_ping_ms, jitter_ms, packet_loss, is_reachable, connection_status)
-        return self.execute_query(query, params)
-    
-    def insert_traceroute_hop(self, trace_id, timestamp, unix_timestamp, target,
-                             hop_number, hop_ip, hop_hostname, rtt_ms,
-                             packets_sent, packets_received, is_timeout):
-        """Insert traceroute hop into database"""
-        query = """
-            INSERT INTO traceroute (trace_id, timestamp, unix_timestamp, target,
-                                  hop_number, hop_ip, hop_hostname, rtt_ms,
-                                  packets_sent, packets_received, is_timeout)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """
-        params = (trace_id, timestamp, unix_timestamp, target, hop_number,
-                 hop_ip, hop_hostname, rtt_ms, packets_sent, 
-                 packets_received, is_timeout)
-        return self.execute_query(query, params)
-    
-    def insert_speedtest_result(self, timestamp, unix_timestamp, server_name,
-                                server_location, server_country, download_mbps,
-                                upload_mbps, ping_ms, jitter_ms, packet_loss,
-                                isp, external_ip, idle_latency_ms, download_latency_ms,
-                                upload_latency_ms, bufferbloat_rating, test_duration_seconds,
-                                is_successful, error_message=None):
-        """Insert speed test result into database"""
-        query = """
-            INSERT INTO speedtest (timestamp, unix_timestamp, server_name,
-                                 server_location, server_country, download_mbps,
-                                 upload_mbps, ping_ms, jitter_ms, packet_loss,
-                                 isp, external_ip, idle_latency_ms, download_latency_ms,
-                                 upload_latency_ms, bufferbloat_rating, test_duration_seconds,
-                                 is_successful, error_message)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """
-        params = (timestamp, unix_timestamp, server_name, server_location,
-                 server_country, download_mbps, upload_mbps, ping_ms, jitter_ms,
-                 packet_loss, isp, external_ip, idle_latency_ms, download_latency_ms,
-                 upload_latency_ms, bufferbloat_rating, test_duration_seconds,
-                 is_successful, error_message)
-        return self.execute_query(query, params)
-    
-    def insert_dns_result(self, timestamp, unix_timestamp, domain, nameserver,
-                         record_type, resolution_time_ms, resolved_ips,
-                         is_successful, error_message=None):
-        """Insert DNS query result into database"""
-        query = """
-            INSERT INTO dns_queries (timestamp, unix_timestamp, domain, nameserver,
-                                   record_type, resolution_time_ms, resolved_ips,
-                                   is_successful, error_message)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """
-        params = (timestamp, unix_timestamp, domain, nameserver, record_type,
-                 resolution_time_ms, resolved_ips, is_successful, error_message)
-        return self.execute_query(query, params)
-    
-    def insert_http_result(self, timestamp, unix_timestamp, url, dns_time_ms,
-                          connect_time_ms, tls_time_ms, ttfb_ms, total_time_ms,
-                          status_code, response_size, tls_version,
-                          is_successful, error_message=None):
-        """Insert HTTP request result into database"""
-        query = """
-            INSERT INTO http_requests (timestamp, unix_timestamp, url, dns_time_ms,
-                                     connect_time_ms, tls_time_ms, ttfb_ms, total_time_ms,
-                                     status_code, response_size, tls_version,
-                                     is_successful, error_message)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """
-        params = (timestamp, unix_timestamp, url, dns_time_ms, connect_time_ms,
-                 tls_time_ms, ttfb_ms, total_time_ms, status_code, response_size,
-                 tls_version, is_successful, error_message)
-        return self.execute_query(query, params)
+            try:
+                conn.close()
+            except:
+                pass
+
+
+def create_database_manager(config):
+    """Create the storage backend selected by database.backend (mysql or sqlite)"""
+    backend = config.get('backend', 'mysql')
+    if backend == 'mysql':
+        return DatabaseManager(config)
+    if backend == 'sqlite':
+        from sqlite_db import SQLiteDatabaseManager
+        return SQLiteDatabaseManager(config)
+    raise ValueError(f"Unknown database backend: {backend}")
@@ -0,0 +1,166 @@
+"""
+Dimension tables for targets, domains, nameservers, URLs, speed test servers and agents
+Fact tables store small integer ids; views under the original table names join the names back
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Dimension -> (table, id column, value columns)
+DIMENSIONS = {
+    'target': ('targets', 'target_id', ('target',)),
+    'domain': ('domains', 'domain_id', ('domain',)),
+    'nameserver': ('nameservers', 'nameserver_id', ('nameserver',)),
+    'url': ('urls', 'url_id', ('url',)),
+    'server': ('speedtest_servers', 'server_id', ('server_name', 'server_location', 'server_country')),
+    'agent': ('agents', 'agent_id', ('agent',)),
+}
+
+# Fact view name -> (storage table, dimensions referenced by it)
+# Every fact table also has a nullable agent_id: set for rows received from remote agents
+FACT_TABLES = {
+    'ping': ('ping_data', ('target',)),
+    'traceroute_runs': ('traceroute_runs_data', ('target',)),
+    'speedtest': ('speedtest_data', ('server',)),
+    'dns_queries': ('dns_queries_data', ('domain', 'nameserver')),
+    'http_requests': ('http_requests_data', ('url',)),
+}
+
+
+def storage_table(table):
+    """Physical table holding the rows of a fact view (other tables map to themselves)"""
+    return FACT_TABLES[table][0] if table in FACT_TABLES else table
+
+
+def dimension_values(dimension, row):
+    """Remove a dimension's value columns from row and return them as a key tuple"""
+    _, _, value_columns = DIMENSIONS[dimension]
+    values = tuple(row.pop(column, None) for column in value_columns)
+    # Dimension values are never NULL so the unique key and lookups stay exact
+    return tuple('' if value is None else value for value in values)
+
+
+def _value_condition(dimension, alias=''):
+    _, _, value_columns = DIMENSIONS[dimension]
+    return ' AND '.join(f"{alias}{column} = %s" for column in value_columns)
+
+
+def dimension_insert_query(dimension):
+    """
+    Insert one dimension value unless it exists (params: the values twice)
+    The NOT EXISTS guard keeps duplicates from consuming AUTO_INCREMENT ids,
+    IGNORE covers two writers racing to add the same value.
+    """
+    table, _, value_columns = DIMENSIONS[dimension]
+    return (f"INSERT IGNORE INTO {table} ({', '.join(value_columns)}) "
+            f"SELECT {', '.join(['%s'] * len(value_columns))} FROM DUAL "
+            f"WHERE NOT EXISTS (SELECT 1 FROM {table} WHERE {_value_condition(dimension)})")
+
+
+def dimension_lookup_sql(dimension):
+    """Subselect resolving a dimension id from its values"""
+    table, id_column, _ = DIMENSIONS[dimension]
+    return f"(SELECT {id_column} FROM {table} WHERE {_value_condition(dimension)})"
+
+
+def conversion_statements(fact, legacy_table, data_columns, legacy_columns):
+    """
+    Statements copying a pre-dimension fact table into its storage table
+    Fills the dimension tables from the legacy rows, then copies the rows with
+    names replaced by ids. Columns the legacy table lacks are left NULL.
+    """
+    table, dimensions = FACT_TABLES[fact]
+    statements = []
+    expressions = {}
+    for dimension in dimensions:
+        dimension_table, id_column, value_columns = DIMENSIONS[dimension]
+        values = [f"COALESCE(l.{column}, '')" if column in legacy_columns else "''"
+                  for column in value_columns]
+        condition = ' AND '.join(f"d.{column} = {value}" for column, value in zip(value_columns, values))
+        statements.append(
+            f"INSERT INTO {dimension_table} ({', '.join(value_columns)}) "
+            f"SELECT DISTINCT {', '.join(values)} FROM {legacy_table} l "
+            f"WHERE NOT EXISTS (SELECT 1 FROM {dimension_table} d WHERE {condition})"
+        )
+        expressions[id_column] = f"(SELECT d.{id_column} FROM {dimension_table} d WHERE {condition})"
+    
+    columns = [column for column in data_columns if column in expressions or column in legacy_columns]
+    statements.append(
+        f"INSERT INTO {table} ({', '.join(columns)}) "
+        f"SELECT {', '.join(expressions.get(column, f'l.{column}') for column in columns)} "
+        f"FROM {legacy_table} l"
+    )
+    return statements
+
+
+class DimensionCache:
+    """
+    In-process name -> id cache for the dimension tables.
+    Misses are resolved with a synchronous get-or-create; while the database is
+    unreachable get_id returns None and writers fall back to a subselect.
+    """
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+        self.ids = {}
+    
+    def get_id(self, dimension, values):
+        """Return the id for a dimension value tuple, or None if it cannot be resolved now"""
+        key = (dimension, values)
+        dimension_id = self.ids.get(key)
+        if dimension_id is not None:
+            return dimension_id
+        
+        spool = self.db_manager.spool
+        if spool and spool.outage.is_set():
+            return None
+        
+        table, id_column, _ = DIMENSIONS[dimension]
+        try:
+            self.db_manager.execute_statements([(dimension_insert_query(dimension), [values + values])])
+            rows = self.db_manager.fetch_all(
+                f"SELECT {id_column} FROM {table} WHERE {_value_condition(dimension)}", values
+            )
+        except self.db_manager.unavailable_errors + self.db_manager.database_errors as e:
+            logger.warning(f"Could not resolve {dimension} id for {values}: {e}")
+            return None
+        
+        if not rows:
+            return None
+        dimension_id = self.ids[key] = rows[0][id_column]
+        return dimension_id
+    
+    def fact_statements(self, fact, row):
+        """
+        Statements inserting one fact row given with its original column names
+        Dimension values are replaced by cached ids, or by a get-or-create
+        subselect when the id is not known yet. An 'agent' value becomes agent_id.
+        """
+        table, dimensions = FACT_TABLES[fact]
+        row = dict(row)
+        if row.get('agent') is not None:
+            dimensions += ('agent',)
+        else:
+            row.pop('agent', None)
+        statements = []
+        columns, placeholders, params = [], [], []
+        for dimension in dimensions:
+            _, id_column, _ = DIMENSIONS[dimension]
+            values = dimension_values(dimension, row)
+            dimension_id = self.get_id(dimension, values)
+            columns.append(id_column)
+            if dimension_id is None:
+                statements.append((dimension_insert_query(dimension), [values + values]))
+                placeholders.append(dimension_lookup_sql(dimension))
+                params.extend(values)
+            else:
+                placeholders.append('%s')
+                params.append(dimension_id)
+        
+        columns.extend(row)
+        placeholders.extend(['%s'] * len(row))
+        params.extend(row.values())
+        statements.append((
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(placeholders)})",
+            [tuple(params)]
+        ))
+        return statements
@@ -3,21 +3,59 @@ DNS monitoring module
 """
 import time
 import socket
+import asyncio
 import logging
+from functools import partial
 from datetime import datetime
-from threading import Thread, Event
+from threading import Event
 import dns.resolver
+import dns.asyncresolver
 import dns.exception
+from db_utils import dns_answer_set_id
+from scheduler import target_entries
 
 logger = logging.getLogger(__name__)
 
 
+def query_error(error):
+    """Error message stored for a failed DNS query"""
+    if isinstance(error, dns.exception.Timeout):
+        return "DNS query timeout"
+    if isinstance(error, dns.resolver.NXDOMAIN):
+        return "Domain does not exist (NXDOMAIN)"
+    if isinstance(error, dns.resolver.NoAnswer):
+        return "No answer from DNS server"
+    if isinstance(error, dns.resolver.NoNameservers):
+        return "No nameservers available"
+    return str(error)
+
+
 class DNSMonitor:
-    def __init__(self, db_manager, config):
+    def __init__(self, db_manager, config, scheduler):
         self.db_manager = db_manager
         self.config = config
+        self.scheduler = scheduler
         self.stop_event = Event()
-        self.thread = None
+        # Answer sets already interned, and the last answer set per (domain, nameserver, record_type)
+        self.known_answer_sets = set()
+        self.last_answer_set = {}
+        # One long-lived resolver per nameserver (sync and async engines)
+        self.resolvers = {}
+        self.async_resolvers = {}
+        # Limits queries in flight (async engine); created on the execution engine's event loop
+        self.semaphore = None
+    
+    def get_resolver(self, nameserver, timeout, resolvers=None, resolver_class=dns.resolver.Resolver):
+        """Return the resolver for a nameserver, creating it on first use"""
+        resolvers = self.resolvers if resolvers is None else resolvers
+        resolver = resolvers.get(nameserver)
+        if resolver is None:
+            resolver = resolver_class(configure=False)
+            resolver.nameservers = [nameserver]
+            resolver.timeout = timeout
+            resolver.lifetime = timeout
+            resolvers[nameserver] = resolver
+        return resolver
     
     def perform_dns_query(self, domain, nameserver, record_type='A', timeout=5):
         """
@@ -25,41 +63,62 @@ class DNSMonitor:
         Returns: (resolution_time_ms, resolved_ips, is_successful, error_message)
         """
         try:
-            # Create resolver
-            resolver = dns.resolver.Resolver()
-            resolver.nameservers = [nameserver]
-            resolver.timeout = timeout
-            resolver.lifetime = timeout
+            resolver = self.get_resolver(nameserver, timeout)
             
             # Measure resolution time
-            start_time = time.time()
+            start_time = time.perf_counter()
             answers = resolver.resolve(domain, record_type)
-            resolution_time = (time.time() - start_time) * 1000  # Convert to ms
+            resolution_time = (time.perf_counter() - start_time) * 1000  # Convert to ms
             
             # Extract resolved IPs/values
             resolved_values = [str(rdata) for rdata in answers]
             
             return resolution_time, resolved_values, True, None
-            
-        except dns.exception.Timeout:
-            return None, None, False, "DNS query timeout"
-        except dns.resolver.NXDOMAIN:
-            return None, None, False, "Domain does not exist (NXDOMAIN)"
-        except dns.resolver.NoAnswer:
-            return None, None, False, "No answer from DNS server"
-        except dns.resolver.NoNameservers:
-            return None, None, False, "No nameservers available"
+        
         except Exception as e:
-            return None, None, False, str(e)
+            return None, None, False, query_error(e)
+    
+    async def perform_dns_query_async(self, domain, nameserver, record_type='A', timeout=5):
+        """
+        Asyncio version of perform_dns_query, bounded by the concurrency semaphore
+        Returns: (timestamp, unix_timestamp, resolution_time_ms, resolved_ips, is_successful, error_message)
+        with the timestamps taken when the query is sent
+        """
+        async with self.semaphore:
+            timestamp = datetime.now()
+            unix_timestamp = int(time.time() * 1000)
+            try:
+                resolver = self.get_resolver(nameserver, timeout, self.async_resolvers,
+                                             dns.asyncresolver.Resolver)
+                start_time = time.perf_counter()
+                answers = await resolver.resolve(domain, record_type)
+                resolution_time = (time.perf_counter() - start_time) * 1000
+                return (timestamp, unix_timestamp, resolution_time,
+                        [str(rdata) for rdata in answers], True, None)
+            except Exception as e:
+                return timestamp, unix_timestamp, None, None, False, query_error(e)
+    
+    async def query_all(self, queries, timeout):
+        """Run every (domain, nameserver, record_type) query concurrently"""
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.config.get('concurrency', 50))
+        return await asyncio.gather(*(
+            self.perform_dns_query_async(domain, nameserver, record_type, timeout)
+            for domain, nameserver, record_type in queries
+        ))
     
     def store_dns_result(self, domain, nameserver, record_type, resolution_time_ms, 
-                        resolved_ips, is_successful, error_message):
-        """Store DNS query result in database"""
-        now = datetime.now()
-        unix_timestamp = int(time.time() * 1000)
+                        resolved_ips, is_successful, error_message,
+                        timestamp=None, unix_timestamp=None):
+        """Store DNS query result in database, timestamped when the query was sent"""
+        now = timestamp or datetime.now()
+        unix_timestamp = unix_timestamp or int(now.timestamp() * 1000)
         
-        # Join resolved IPs into comma-separated string
-        resolved_ips_str = ','.join(resolved_ips) if resolved_ips else None
+        answer_set_id = dns_answer_set_id(resolved_ips) if resolved_ips else None
+        key = (domain, nameserver, record_type)
+        if answer_set_id is not None and key not in self.last_answer_set:
+            self.last_answer_set[key] = self.db_manager.get_last_dns_answer_set(*key)
+        previous_answer_set_id = self.last_answer_set.get(key)
         
         success = self.db_manager.insert_dns_result(
             timestamp=now,
@@ -68,59 +127,100 @@ class DNSMonitor:
             nameserver=nameserver,
             record_type=record_type,
             resolution_time_ms=resolution_time_ms,
-            resolved_ips=resolved_ips_str,
+            answers=resolved_ips,
             is_successful=is_successful,
-            error_message=error_message
+            error_message=error_message,
+            answer_set_id=answer_set_id,
+            previous_answer_set_id=previous_answer_set_id,
+            new_answer_set=answer_set_id not in self.known_answer_sets
         )
         
+        if success and answer_set_id is not None:
+            self.known_answer_sets.add(answer_set_id)
+            self.last_answer_set[key] = answer_set_id
+            if previous_answer_set_id is not None and previous_answer_set_id != answer_set_id:
+                logger.warning(f"DNS answer for {domain} via {nameserver} changed: {','.join(resolved_ips)}")
+        
         if success and is_successful:
-            logger.info(f"DNS {domain} via {nameserver}: {resolution_time_ms:.2f}ms -> {resolved_ips_str}")
+            logger.info(f"DNS {domain} {record_type} via {nameserver}: "
+                       f"{resolution_time_ms:.2f}ms -> {','.join(resolved_ips)}")
         elif success:
-            logger.warning(f"DNS {domain} via {nameserver} failed: {error_message}")
+            logger.warning(f"DNS {domain} {record_type} via {nameserver} failed: {error_message}")
         else:
             logger.error(f"Failed to store DNS result for {domain}")
     
-    def monitor_loop(self):
-        """Main monitoring loop"""
-        interval = self.config.get('interval_seconds', 60)
-        domains = self.config.get('domains', ['google.com', 'cloudflare.com'])
-        nameservers = self.config.get('nameservers', ['8.8.8.8', '1.1.1.1', '8.8.4.4'])
-        record_type = self.config.get('record_type', 'A')
-        timeout = self.config.get('timeout_seconds', 5)
-        
-        logger.info(f"Starting DNS monitor with {len(domains)} domains, "
-                   f"{len(nameservers)} nameservers, interval: {interval}s")
-        
-        while not self.stop_event.is_set():
-            for domain in domains:
-                for nameserver in nameservers:
-                    if self.stop_event.is_set():
-                        break
-                    
-                    resolution_time_ms, resolved_ips, is_successful, error_message = \
-                        self.perform_dns_query(domain, nameserver, record_type, timeout)
-                    
-                    self.store_dns_result(domain, nameserver, record_type, 
-                                        resolution_time_ms, resolved_ips, 
-                                        is_successful, error_message)
+    def dns_job(self, domain, nameserver, record_types, timeout):
+        """Scheduled job (sync engine): query one domain at one nameserver and store the results"""
+        for record_type in record_types:
+            timestamp = datetime.now()
+            unix_timestamp = int(time.time() * 1000)
+            resolution_time_ms, resolved_ips, is_successful, error_message = \
+                self.perform_dns_query(domain, nameserver, record_type, timeout)
             
-            # Wait for next interval
-            self.stop_event.wait(interval)
+            self.store_dns_result(domain, nameserver, record_type, 
+                                resolution_time_ms, resolved_ips, 
+                                is_successful, error_message,
+                                timestamp, unix_timestamp)
+    
+    def store_results(self, queries, results):
+        """Store the results of a batch of async queries"""
+        for (domain, nameserver, record_type), result in zip(queries, results):
+            timestamp, unix_timestamp, resolution_time_ms, resolved_ips, is_successful, error_message = result
+            self.store_dns_result(domain, nameserver, record_type,
+                                resolution_time_ms, resolved_ips,
+                                is_successful, error_message,
+                                timestamp, unix_timestamp)
+    
+    async def fan_out_job(self, queries, timeout):
+        """
+        Scheduled job (async engine): run a whole batch of queries at once on the
+        event loop, then store the results on a worker so database calls never block the loop
+        """
+        results = await self.query_all(queries, timeout)
+        await asyncio.wrap_future(
+            self.scheduler.execution_engine.submit('dns', self.store_results, queries, results))
     
     def start(self):
-        """Start monitoring in a separate thread"""
+        """Register the DNS jobs with the scheduler"""
         if not self.config.get('enabled', True):
             logger.info("DNS monitor is disabled")
             return
         
-        self.thread = Thread(target=self.monitor_loop, daemon=True)
-        self.thread.start()
-        logger.info("DNS monitor started")
+        interval = self.config.get('interval_seconds', 60)
+        domains = target_entries(self.config.get('domains', ['google.com', 'cloudflare.com']), 'domain', interval)
+        nameservers = self.config.get('nameservers', ['8.8.8.8', '1.1.1.1', '8.8.4.4'])
+        record_types = self.config.get('record_types') or [self.config.get('record_type', 'A')]
+        timeout = self.config.get('timeout_seconds', 5)
+        engine = self.config.get('engine', 'async')
+        
+        self.scheduler.configure_monitor('dns', self.config.get('workers', 2 if engine == 'async' else 4),
+                                         self.config.get('priority', 1))
+        if engine == 'async':
+            # One job per interval fans out every domain x nameserver x record type query
+            by_interval = {}
+            for domain, domain_interval in domains:
+                by_interval.setdefault(domain_interval, []).extend(
+                    (domain, nameserver, record_type)
+                    for nameserver in nameservers
+                    for record_type in record_types
+                )
+            self.scheduler.add_jobs('dns', [
+                (f"every-{domain_interval}s", domain_interval, partial(self.fan_out_job, queries, timeout))
+                for domain_interval, queries in by_interval.items()
+            ])
+        else:
+            self.scheduler.add_jobs('dns', [
+                (f"{domain}@{nameserver}", domain_interval,
+                 lambda domain=domain, nameserver=nameserver: self.dns_job(domain, nameserver, record_types, timeout))
+                for domain, domain_interval in domains
+                for nameserver in nameservers
+            ])
+        logger.info(f"DNS monitor started ({engine}) with {len(domains)} domains, "
+                   f"{len(nameservers)} nameservers, record types: {', '.join(record_types)}")
     
     def stop(self):
         """Stop monitoring"""
         logger.info("Stopping DNS monitor...")
         self.stop_event.set()
-        if self.thread:
-            self.thread.join(timeout=5)
+        self.scheduler.remove_jobs('dns')
         logger.info("DNS monitor stopped")
@@ -0,0 +1,184 @@
+"""
+Shared execution engine
+One bounded worker pool runs the blocking jobs of every monitor, picking work
+by monitor priority within per-monitor concurrency limits, and one asyncio
+event loop thread runs socket-based coroutine jobs
+"""
+import time
+import asyncio
+import logging
+import itertools
+from collections import deque
+from concurrent.futures import Future
+from threading import Thread, Condition
+
+logger = logging.getLogger(__name__)
+
+
+class _MonitorQueue:
+    """Pending work and counters of one monitor"""
+    def __init__(self, limit, priority):
+        self.limit = limit
+        self.priority = priority
+        # (sequence, enqueued at, func, args, future)
+        self.pending = deque()
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.max_wait = 0.0
+        self.total_wait = 0.0
+
+
+class ExecutionEngine:
+    """
+    Work from all monitors waits in per-monitor queues. A free worker takes the
+    oldest item of the highest priority monitor (lowest number) that is below its
+    concurrency limit. reserved_workers are kept for priority 0 work, so bulk jobs
+    (traceroute, speed test) can never occupy the whole pool and delay pings.
+    """
+    def __init__(self, config=None):
+        config = config or {}
+        self.workers = max(1, config.get('workers', 16))
+        self.reserved = min(config.get('reserved_workers', 2), self.workers - 1)
+        self.condition = Condition()
+        self.queues = {}
+        self.sequence = itertools.count()
+        self.running = 0
+        self.stopping = False
+        self.threads = []
+        self.loop = None
+        self.loop_thread = None
+    
+    def configure(self, monitor, limit=1, priority=1):
+        """Set how many of a monitor's jobs may run at once and its priority (0 = most urgent)"""
+        with self.condition:
+            queue = self.queues.get(monitor)
+            if queue is None:
+                self.queues[monitor] = _MonitorQueue(max(1, limit), priority)
+            else:
+                queue.limit = max(1, limit)
+                queue.priority = priority
+            self.condition.notify_all()
+    
+    def submit(self, monitor, func, *args):
+        """Queue func(*args) to run on the worker pool; returns a concurrent.futures.Future"""
+        future = Future()
+        with self.condition:
+            if self.stopping:
+                future.cancel()
+                return future
+            if monitor not in self.queues:
+                self.queues[monitor] = _MonitorQueue(1, 1)
+            self.queues[monitor].pending.append((next(self.sequence), time.monotonic(), func, args, future))
+            self.condition.notify()
+        return future
+    
+    def run_coroutine(self, coroutine):
+        """Schedule a coroutine on the event loop thread; returns a concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+    
+    def _next_item(self):
+        """Pick the next runnable item; called with the condition held"""
+        best = None
+        for queue in self.queues.values():
+            if not queue.pending or queue.running >= queue.limit:
+                continue
+            if queue.priority > 0 and self.running >= self.workers - self.reserved:
+                continue
+            key = (queue.priority, queue.pending[0][0])
+            if best is None or key < best[0]:
+                best = (key, queue)
+        if best is None:
+            return None, None
+        queue = best[1]
+        queue.running += 1
+        self.running += 1
+        return queue, queue.pending.popleft()
+    
+    def worker_loop(self):
+        """Pool worker: run queued items until stopped and drained"""
+        while True:
+            with self.condition:
+                queue, item = self._next_item()
+                while item is None:
+                    if self.stopping and not any(q.pending for q in self.queues.values()):
+                        return
+                    self.condition.wait()
+                    queue, item = self._next_item()
+            
+            _, enqueued, func, args, future = item
+            wait = time.monotonic() - enqueued
+            queue.max_wait = max(queue.max_wait, wait)
+            queue.total_wait += wait
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(func(*args))
+                except BaseException as e:
+                    queue.failed += 1
+                    future.set_exception(e)
+            
+            with self.condition:
+                queue.running -= 1
+                queue.completed += 1
+                self.running -= 1
+                self.condition.notify_all()
+    
+    def run_loop(self):
+        """Event loop thread"""
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+        self.loop.close()
+    
+    async def shutdown_loop(self):
+        """Cancel running coroutines and stop the event loop"""
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        asyncio.get_running_loop().stop()
+    
+    def get_stats(self):
+        """Return queue depth, running and completed counts and queue wait per monitor"""
+        with self.condition:
+            return {
+                monitor: {
+                    'priority': queue.priority,
+                    'limit': queue.limit,
+                    'queued': len(queue.pending),
+                    'running': queue.running,
+                    'completed': queue.completed,
+                    'failed': queue.failed,
+                    'max_wait_seconds': queue.max_wait,
+                    'avg_wait_seconds': queue.total_wait / queue.completed if queue.completed else None
+                }
+                for monitor, queue in self.queues.items()
+            }
+    
+    def start(self):
+        """Start the worker pool and the event loop thread"""
+        self.stopping = False
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = Thread(target=self.run_loop, daemon=True, name='engine-loop')
+        self.loop_thread.start()
+        self.threads = [Thread(target=self.worker_loop, daemon=True, name=f"engine-worker-{i}")
+                        for i in range(self.workers)]
+        for thread in self.threads:
+            thread.start()
+        logger.info(f"Execution engine started with {self.workers} workers "
+                   f"({self.reserved} reserved for priority 0)")
+    
+    def stop(self, timeout=10):
+        """Drop queued work, let running items finish and stop the event loop"""
+        logger.info("Stopping execution engine...")
+        with self.condition:
+            self.stopping = True
+            for queue in self.queues.values():
+                while queue.pending:
+                    queue.pending.popleft()[4].cancel()
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join(timeout=timeout)
+        if self.loop and self.loop.is_running():
+            asyncio.run_coroutine_threadsafe(self.shutdown_loop(), self.loop)
+            self.loop_thread.join(timeout=timeout)
+        logger.info("Execution engine stopped")
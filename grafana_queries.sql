@@ -158,22 +158,15 @@ ORDER BY timestamp DESC;
 
 -- 12. JITTER CALCULATION (Time Series)
 -- Shows network stability (variation in ping times)
+-- delta_ms is computed by the monitor at insert time, so this is a plain range read
 SELECT 
-    p1.timestamp as time,
-    p1.target as metric,
-    ABS(p1.ping_ms - p2.ping_ms) as value
-FROM ping p1
-JOIN ping p2 ON p1.target = p2.target 
-    AND p2.timestamp = (
-        SELECT MAX(timestamp) 
-        FROM ping 
-        WHERE target = p1.target 
-        AND timestamp < p1.timestamp
-    )
-WHERE $__timeFilter(p1.timestamp)
-  AND p1.is_reachable = 1
-  AND p2.is_reachable = 1
-ORDER BY p1.timestamp;
+    timestamp as time,
+    target as metric,
+    delta_ms as value
+FROM ping
+WHERE $__timeFilter(timestamp)
+  AND delta_ms IS NOT NULL
+ORDER BY timestamp;
 
 -- 13. HOURLY UPTIME REPORT (Table)
 SELECT 
@@ -207,41 +200,33 @@ GROUP BY DATE_FORMAT(timestamp, '%Y-%m-%d'), HOUR(timestamp)
 ORDER BY time, hour;
 
 -- 15. TRACEROUTE HOP LATENCY (Time Series)
--- Shows latency at each hop over time
+-- Shows latency at each hop over time (per-hop RTTs are stored as a JSON vector per run)
 SELECT 
-    t.timestamp as time,
-    CONCAT(t.target, ' - Hop ', t.hop_number, ' (', COALESCE(t.hop_hostname, t.hop_ip), ')') as metric,
-    t.rtt_ms as value
-FROM traceroute t
-WHERE $__timeFilter(t.timestamp)
-  AND t.is_timeout = 0
-  AND t.target = '$target'
-ORDER BY t.timestamp, t.hop_number;
+    r.timestamp as time,
+    CONCAT(r.target, ' - Hop ', h.hop_number, ' (', COALESCE(h.hop_hostname, h.hop_ip), ')') as metric,
+    j.rtt_ms as value
+FROM traceroute_runs r
+JOIN JSON_TABLE(r.rtt_ms, '$[*]' COLUMNS (hop_index FOR ORDINALITY, rtt_ms FLOAT PATH '$')) j
+JOIN traceroute_path_hops h ON h.path_id = r.path_id AND h.hop_index = j.hop_index
+WHERE $__timeFilter(r.timestamp)
+  AND j.rtt_ms IS NOT NULL
+  AND r.target = '$target'
+ORDER BY r.timestamp, h.hop_number;
 
 -- 16. ROUTE STABILITY (Table)
 -- Detect if network route changes
 SELECT 
-    t1.timestamp,
-    t1.target,
-    t1.hop_number,
-    t1.hop_ip as current_hop_ip,
-    t2.hop_ip as previous_hop_ip,
-    CASE WHEN t1.hop_ip != t2.hop_ip THEN 'Route Changed' ELSE 'Stable' END as status
-FROM traceroute t1
-LEFT JOIN traceroute t2 ON 
-    t1.target = t2.target 
-    AND t1.hop_number = t2.hop_number
-    AND t2.trace_id = (
-        SELECT trace_id 
-        FROM traceroute 
-        WHERE target = t1.target 
-        AND timestamp < t1.timestamp
-        ORDER BY timestamp DESC 
-        LIMIT 1
-    )
-WHERE $__timeFilter(t1.timestamp)
-  AND t1.hop_ip != t2.hop_ip
-ORDER BY t1.timestamp DESC;
+    r.timestamp,
+    r.target,
+    p.hop_ips as current_path,
+    prev.hop_ips as previous_path,
+    'Route Changed' as status
+FROM traceroute_runs r
+JOIN traceroute_paths p ON p.path_id = r.path_id
+LEFT JOIN traceroute_paths prev ON prev.path_id = r.previous_path_id
+WHERE $__timeFilter(r.timestamp)
+  AND r.route_changed = 1
+ORDER BY r.timestamp DESC;
 
 -- 17. CONNECTION QUALITY SCORE (Gauge)
 -- Overall connection quality score (0-100)
@@ -413,3 +398,175 @@ WHERE $__timeFilter(timestamp)
   AND is_successful = 1
 GROUP BY DATE_FORMAT(timestamp, '%Y-%m-%d %H:00:00')
 ORDER BY time;
+
+-- =====================================================
+-- ROLLUP QUERIES
+-- =====================================================
+-- Read the incrementally maintained ping_rollup, dns_rollup and http_rollup
+-- tables instead of re-aggregating raw rows. Pick the granularity to match
+-- the dashboard range: '1m' for a few hours, '1h' for days, '1d' for months.
+-- Buckets are kept per agent (agent_id 0: local results); these queries add
+-- them up; filter on agent_id to show one site.
+
+-- 31. UPTIME PERCENTAGE FROM ROLLUPS (Stat Panel, replaces #4)
+SELECT 
+    target,
+    (SUM(reachable_count) / SUM(sample_count)) * 100 as uptime_percentage
+FROM ping_rollup
+WHERE granularity = '1h'
+  AND $__timeFilter(bucket_start)
+GROUP BY target;
+
+-- 32. AVERAGE LATENCY BY TARGET FROM ROLLUPS (Stat Panel, replaces #5)
+SELECT 
+    target,
+    SUM(latency_sum) / SUM(latency_count) as avg_latency_ms,
+    MIN(latency_min) as min_latency_ms,
+    MAX(latency_max) as max_latency_ms
+FROM ping_rollup
+WHERE granularity = '1h'
+  AND $__timeFilter(bucket_start)
+GROUP BY target;
+
+-- 33. HOURLY UPTIME REPORT FROM ROLLUPS (Table, replaces #13)
+SELECT 
+    target,
+    bucket_start as hour,
+    SUM(sample_count) as total_checks,
+    SUM(reachable_count) as successful_checks,
+    (SUM(reachable_count) / SUM(sample_count)) * 100 as uptime_percentage,
+    SUM(latency_sum) / SUM(latency_count) as avg_ping_ms,
+    SUM(packet_loss_sum) / SUM(sample_count) as avg_packet_loss
+FROM ping_rollup
+WHERE granularity = '1h'
+  AND $__timeFilter(bucket_start)
+GROUP BY target, bucket_start
+ORDER BY hour DESC;
+
+-- 34. CONNECTION QUALITY SCORE FROM ROLLUPS (Gauge, replaces #17)
+SELECT 
+    target,
+    (
+        (SUM(reachable_count) / SUM(sample_count)) * 50 + -- 50% weight for uptime
+        ((100 - SUM(packet_loss_sum) / SUM(sample_count)) / 100) * 30 + -- 30% weight for packet loss
+        (CASE 
+            WHEN SUM(latency_sum) / SUM(latency_count) < 20 THEN 20
+            WHEN SUM(latency_sum) / SUM(latency_count) < 50 THEN 15
+            WHEN SUM(latency_sum) / SUM(latency_count) < 100 THEN 10
+            WHEN SUM(latency_sum) / SUM(latency_count) < 200 THEN 5
+            ELSE 0
+        END) -- 20% weight for latency
+    ) as quality_score
+FROM ping_rollup
+WHERE granularity = '1h'
+  AND $__timeFilter(bucket_start)
+GROUP BY target;
+
+-- 35. CONNECTION STATUS DISTRIBUTION FROM ROLLUPS (Pie Chart, replaces #6)
+SELECT 'excellent' as connection_status, SUM(status_excellent) as count
+FROM ping_rollup WHERE granularity = '1h' AND $__timeFilter(bucket_start) AND target = '$target'
+UNION ALL
+SELECT 'good', SUM(status_good)
+FROM ping_rollup WHERE granularity = '1h' AND $__timeFilter(bucket_start) AND target = '$target'
+UNION ALL
+SELECT 'fair', SUM(status_fair)
+FROM ping_rollup WHERE granularity = '1h' AND $__timeFilter(bucket_start) AND target = '$target'
+UNION ALL
+SELECT 'poor', SUM(status_poor)
+FROM ping_rollup WHERE granularity = '1h' AND $__timeFilter(bucket_start) AND target = '$target'
+UNION ALL
+SELECT 'down', SUM(status_down)
+FROM ping_rollup WHERE granularity = '1h' AND $__timeFilter(bucket_start) AND target = '$target';
+
+-- 36. AVERAGE LATENCY OVER TIME FROM ROLLUPS (Time Series)
+SELECT 
+    bucket_start as time,
+    target as metric,
+    SUM(latency_sum) / SUM(latency_count) as value
+FROM ping_rollup
+WHERE granularity = '1m'
+  AND $__timeFilter(bucket_start)
+  AND latency_count > 0
+GROUP BY bucket_start, target
+ORDER BY bucket_start;
+
+-- 37. DNS RESOLUTION TIME FROM ROLLUPS (Time Series)
+SELECT 
+    bucket_start as time,
+    CONCAT(domain, ' via ', nameserver) as metric,
+    SUM(resolution_sum) / SUM(success_count) as value
+FROM dns_rollup
+WHERE granularity = '1h'
+  AND $__timeFilter(bucket_start)
+  AND success_count > 0
+GROUP BY bucket_start, domain, nameserver
+ORDER BY bucket_start;
+
+-- 38. DNS SUCCESS RATE FROM ROLLUPS (Stat Panel)
+SELECT 
+    domain,
+    nameserver,
+    (SUM(success_count) / SUM(query_count)) * 100 as success_rate
+FROM dns_rollup
+WHERE granularity = '1h'
+  AND $__timeFilter(bucket_start)
+GROUP BY domain, nameserver;
+
+-- 39. HTTP RESPONSE TIME FROM ROLLUPS (Time Series)
+SELECT 
+    bucket_start as time,
+    url as metric,
+    SUM(total_time_sum) / SUM(success_count) as value
+FROM http_rollup
+WHERE granularity = '1h'
+  AND $__timeFilter(bucket_start)
+  AND success_count > 0
+GROUP BY bucket_start, url
+ORDER BY bucket_start;
+
+-- 40. HTTP AVAILABILITY AND STATUS CLASSES FROM ROLLUPS (Table)
+SELECT 
+    url,
+    SUM(request_count) as total_requests,
+    (SUM(success_count) / SUM(request_count)) * 100 as success_rate,
+    SUM(total_time_sum) / SUM(success_count) as avg_total_time_ms,
+    MAX(total_time_max) as max_total_time_ms,
+    SUM(status_2xx) as status_2xx,
+    SUM(status_3xx) as status_3xx,
+    SUM(status_4xx) as status_4xx,
+    SUM(status_5xx) as status_5xx,
+    SUM(status_error) as errors
+FROM http_rollup
+WHERE granularity = '1h'
+  AND $__timeFilter(bucket_start)
+GROUP BY url;
+
+-- =====================================================
+-- DNS ANSWER CHANGES
+-- =====================================================
+
+-- 41. DNS ANSWER CHANGES (Table)
+-- When did a record flip, and to what
+SELECT 
+    c.timestamp,
+    c.domain,
+    c.nameserver,
+    c.record_type,
+    prev.answers as previous_answers,
+    cur.answers as current_answers
+FROM dns_answer_changes c
+JOIN dns_answer_sets cur ON cur.answer_set_id = c.answer_set_id
+LEFT JOIN dns_answer_sets prev ON prev.answer_set_id = c.previous_answer_set_id
+WHERE $__timeFilter(c.timestamp)
+ORDER BY c.timestamp DESC;
+
+-- 42. SMOOTHED JITTER (Time Series)
+-- RFC 3550 style jitter estimate maintained by the ping monitor
+SELECT 
+    timestamp as time,
+    target as metric,
+    ewma_jitter_ms as value
+FROM ping
+WHERE $__timeFilter(timestamp)
+  AND ewma_jitter_ms IS NOT NULL
+ORDER BY timestamp;
@@ -0,0 +1,504 @@
+-- =====================================================
+-- GRAFANA QUERIES FOR NETWORK MONITOR (SQLITE BACKEND)
+-- =====================================================
+-- SQLite versions of grafana_queries.sql for the embedded backend
+-- (database.backend: "sqlite"), for use with the frser-sqlite-datasource plugin.
+-- Time filtering uses the indexed unix_timestamp column (milliseconds):
+--   unix_timestamp BETWEEN $__unixEpochFrom() * 1000 AND $__unixEpochTo() * 1000
+-- Query numbers match grafana_queries.sql.
+
+-- 1. CONNECTION STATUS OVER TIME (Time Series)
+SELECT 
+    unix_timestamp / 1000.0 as time,
+    target as metric,
+    CASE connection_status
+        WHEN 'excellent' THEN 5
+        WHEN 'good' THEN 4
+        WHEN 'fair' THEN 3
+        WHEN 'poor' THEN 2
+        WHEN 'down' THEN 1
+    END as value
+FROM ping
+WHERE unix_timestamp BETWEEN $__unixEpochFrom() * 1000 AND $__unixEpochTo() * 1000
+ORDER BY unix_timestamp;
+
+-- 2. PING LATENCY GRAPH (Time Series)
+SELECT 
+    unix_timestamp / 1000.0 as time,
+    target as metric,
+    ping_ms as value
+FROM ping
+WHERE unix_timestamp BETWEEN $__unixEpochFrom() * 1000 AND $__unixEpochTo() * 1000
+  AND is_reachable = 1
+ORDER BY unix_timestamp;
+
+-- 3. PACKET LOSS PERCENTAGE (Time Series)
+SELECT 
+    unix_timestamp / 1000.0 as time,
+    target as metric,
+    packet_loss as value
+FROM ping
+WHERE unix_timestamp BETWEEN $__unixEpochFrom() * 1000 AND $__unixEpochTo() * 1000
+ORDER BY unix_timestamp;
+
+-- 4. UPTIME PERCENTAGE (Stat Panel)
+SELECT 
+    target,
+    SUM(is_reachable) * 100.0 / COUNT(*) as uptime_percentage
+FROM ping
+WHERE unix_timestamp BETWEEN $__unixEpochFrom() * 1000 AND $__unixEpochTo() * 1000
+GROUP BY target;
+
+-- 5. AVERAGE LATENCY BY TARGET (Stat Panel)
+SELECT 
+    target,
+    AVG(ping_ms) as avg_latency_ms,
+    MIN(ping_ms) as min_latency_ms,
+    MAX(ping_ms) as max_latency_ms
+FROM ping
+WHERE unix_timestamp BETWEEN $__unixEpochFrom() * 1000 AND $__unixEpochTo() * 1000
+  AND is_reachable = 1
+GROUP BY target;
+
+-- 6. CONNECTION STATUS DISTRIBUTION (Pie Chart)
+SELECT 
+    connection_status,
+    COUNT(*) as count
+FROM ping
+WHERE unix_timestamp BETWEEN $__unixEpochFrom() * 1000 AND $__unixEpochTo() * 1000
+  AND target = '$target'
+GROUP BY connection_status;
+
+-- 7. ANOMALIES TIMELINE (Table)
+SELECT 
+    timestamp,
+    target,
+    anomaly_type,
+    severity,
+    metric_value
+FROM (
+    SELECT timestamp, unix_timestamp, target, ping_ms as metric_value, 'high_latency' as anomaly_type,
+           CASE WHEN ping_ms > 500 THEN 'critical' 
+                WHEN ping_ms > 200 THEN 'high' 
+                WHEN ping_ms > 100 THEN 'medium' END as severity
+    FROM ping WHERE ping_ms > 100
+    UNION ALL
+    SELECT timestamp, unix_timestamp, target, packet_loss, 'packet_loss',
+           CASE WHEN packet_loss >= 50 THEN 'critical' 
+                WHEN packet_loss >= 10 THEN 'high' 
+                WHEN packet_loss >= 5 THEN 'medium' 
+                ELSE 'low' END
+    FROM ping WHERE packet_loss > 0
+    UNION ALL
+    SELECT timestamp, unix_timestamp, target, 0, 'connection_lost', 'critical'
+    FROM ping WHERE is_reachable = 0
+) anomalies
+WHERE unix_timestamp BETWEEN $__unixEpochFrom() * 1000 AND $__unixEpochTo() * 1000
+ORDER BY unix_timestamp DESC;
+
+-- 8. ANOMALY COUNT BY TYPE (Bar Gauge)
+SELECT 
+    anomaly_type as metric,
+    COUNT(*) as value
+FROM (
+    SELECT 'high_latency' as anomaly_type FROM ping WHERE unix_timestamp BETWEEN $__unixEpochFrom() * 1000 AND $__unixEpochTo() * 1000 AND ping_ms > 100
+    UNION ALL
+    SELECT 'packet_loss' FROM ping WHERE unix_timestamp BETWEEN $__unixEpochFrom() * 1000 AND $__unixEpochTo() * 1000 AND packet_loss > 0
+    UNION ALL
+    SELECT 'connection_lost' FROM ping WHERE unix_timestamp BETWEEN $__unixEpochFrom() * 1000 AND $__unixEpochTo() * 1000 AND is_reachable = 0
+) anomalies
+GROUP BY anomaly_type;
+
+-- 9. ANOMALY COUNT BY SEVERITY (Stat Panel)
+SELECT 
+    severity,
+    COUNT(*) as count
+FROM (
+    SELECT CASE WHEN ping_ms > 500 THEN 'critical' 
+                WHEN ping_ms > 200 THEN 'high' 
+                WHEN ping_ms > 100 THEN 'medium' END as severity
+    FROM ping WHERE unix_timestamp BETWEEN $__unixEpochFrom() * 1000 AND $__unixEpochTo() * 1000 AND ping_ms > 100
+    UNION ALL
+    SELECT CASE WHEN packet_loss >= 50 THEN 'critical' 
+                WHEN packet_loss >= 10 THEN 'high' 
+                WHEN packet_loss >= 5 THEN 'medium' 
+                ELSE 'low' END
+    FROM ping WHERE unix_timestamp BETWEEN $__unixEpochFrom() * 1000 AND $__unixEpochTo() * 1000 AND packet_loss > 0
+    UNION ALL
+    SELECT 'critical' FROM ping WHERE unix_timestamp BETWEEN $__unixEpochFrom() * 1000 AND $__unixEpochTo() * 1000 AND is_reachable = 0
+) anomalies
+GROUP BY severity
+ORDER BY CASE severity WHEN 'critical' THEN 1 WHEN 'high' THEN 2 WHEN 'medium' THEN 3 ELSE 4 END;
+
+-- 10. CURRENT CONNECTION STATUS (Stat Panel with Threshold Colors)
+SELECT 
+    target,
+    connection_status,
+    ping_ms,
+    packet_loss,
+    timestamp
+FROM ping
+WHERE (target, unix_timestamp) IN (
+    SELECT target, MAX(unix_timestamp)
+    FROM ping
+    GROUP BY target
+);
+
+-- 11. DOWNTIME EVENTS (Table)
+SELECT 
+    target,
+    timestamp as down_time,
+    LEAD(timestamp) OVER (PARTITION BY target ORDER BY unix_timestamp) as up_time,
+    (LEAD(unix_timestamp) OVER (PARTITION BY target ORDER BY unix_timestamp) - unix_timestamp) / 1000 as downtime_seconds
+FROM ping
+WHERE is_reachable = 0
+  AND unix_timestamp BETWEEN $__unixEpochFrom() * 1000 AND $__unixEpochTo() * 1000
+ORDER BY unix_timestamp DESC;
+
+-- 12. JITTER CALCULATION (Time Series)
+SELECT 
+    unix_timestamp / 1000.0 as time,
+    target as metric,
+    delta_ms as value
+FROM ping
+WHERE unix_timestamp BETWEEN $__unixEpochFrom() * 1000 AND $__unixEpochTo() * 1000
+  AND delta_ms IS NOT NULL
+ORDER BY unix_timestamp;
+
+-- 13. HOURLY UPTIME REPORT (Table)
+SELECT 
+    target,
+    strftime('%Y-%m-%d %H:00:00', timestamp) as hour,
+    COUNT(*) as total_checks,
+    SUM(is_reachable) as successful_checks,
+    SUM(is_reachable) * 100.0 / COUNT(*) as uptime_percentage,
+    AVG(ping_ms) as avg_ping_ms,
+    AVG(packet_loss) as avg_packet_loss
+FROM ping
+WHERE unix_timestamp BETWEEN $__unixEpochFrom() * 1000 AND $__unixEpochTo() * 1000
+GROUP BY target, strftime('%Y-%m-%d %H:00:00', timestamp)
+ORDER BY hour DESC;
+
+-- 14. ANOMALY HEATMAP (Heatmap)
+SELECT 
+    strftime('%Y-%m-%d', timestamp) as time,
+    CAST(strftime('%H', timestamp) AS INTEGER) as hour,
+    COUNT(*) as value
+FROM (
+    SELECT timestamp, unix_timestamp FROM ping WHERE ping_ms > 100
+    UNION ALL
+    SELECT timestamp, unix_timestamp FROM ping WHERE packet_loss > 0
+    UNION ALL
+    SELECT timestamp, unix_timestamp FROM ping WHERE is_reachable = 0
+) anomalies
+WHERE unix_timestamp BETWEEN $__unixEpochFrom() * 1000 AND $__unixEpochTo() * 1000
+GROUP BY strftime('%Y-%m-%d', timestamp), strftime('%H', timestamp)
+ORDER BY time, hour;
+
+-- 15. TRACEROUTE HOP LATENCY (Time Series)
+SELECT 
+    r.unix_timestamp / 1000.0 as time,
+    r.target || ' - Hop ' || h.hop_number || ' (' || COALESCE(h.hop_hostname, h.hop_ip) || ')' as metric,
+    j.value as value
+FROM traceroute_runs r
+JOIN json_each(r.rtt_ms) j
+JOIN traceroute_path_hops h ON h.path_id = r.path_id AND h.hop_index = j.key + 1
+WHERE r.unix_timestamp BETWEEN $__unixEpochFrom() * 1000 AND $__unixEpochTo() * 1000
+  AND j.value IS NOT NULL
+  AND r.target = '$target'
+ORDER BY r.unix_timestamp, h.hop_number;
+
+-- 16. ROUTE STABILITY (Table)
+SELECT 
+    r.timestamp,
+    r.target,
+    p.hop_ips as current_path,
+    prev.hop_ips as previous_path,
+    'Route Changed' as status
+FROM traceroute_runs r
+JOIN traceroute_paths p ON p.path_id = r.path_id
+LEFT JOIN traceroute_paths prev ON prev.path_id = r.previous_path_id
+WHERE r.unix_timestamp BETWEEN $__unixEpochFrom() * 1000 AND $__unixEpochTo() * 1000
+  AND r.route_changed = 1
+ORDER BY r.unix_timestamp DESC;
+
+-- 17. CONNECTION QUALITY SCORE (Gauge)
+SELECT 
+    target,
+    (
+        SUM(is_reachable) * 50.0 / COUNT(*) + -- 50% weight for uptime
+        ((100 - AVG(packet_loss)) / 100) * 30 + -- 30% weight for packet loss
+        (CASE 
+            WHEN AVG(ping_ms) < 20 THEN 20
+            WHEN AVG(ping_ms) < 50 THEN 15
+            WHEN AVG(ping_ms) < 100 THEN 10
+            WHEN AVG(ping_ms) < 200 THEN 5
+            ELSE 0
+        END) -- 20% weight for latency
+    ) as quality_score
+FROM ping
+WHERE unix_timestamp BETWEEN $__unixEpochFrom() * 1000 AND $__unixEpochTo() * 1000
+GROUP BY target;
+
+-- 18. ALERT SUMMARY (Stat Panel)
+SELECT 
+    target,
+    COUNT(*) as alert_count
+FROM ping
+WHERE unix_timestamp BETWEEN $__unixEpochFrom() * 1000 AND $__unixEpochTo() * 1000
+  AND (ping_ms > 200 OR packet_loss >= 10 OR is_reachable = 0)
+GROUP BY target;
+
+-- =====================================================
+-- SPEED TEST QUERIES
+-- =====================================================
+
+-- 19. DOWNLOAD SPEED OVER TIME (Time Series)
+SELECT 
+    unix_timestamp / 1000.0 as time,
+    'Download' as metric,
+    download_mbps as value
+FROM speedtest
+WHERE unix_timestamp BETWEEN $__unixEpochFrom() * 1000 AND $__unixEpochTo() * 1000
+  AND is_successful = 1
+ORDER BY unix_timestamp;
+
+-- 20. UPLOAD SPEED OVER TIME (Time Series)
+SELECT 
+    unix_timestamp / 1000.0 as time,
+    'Upload' as metric,
+    upload_mbps as value
+FROM speedtest
+WHERE unix_timestamp BETWEEN $__unixEpochFrom() * 1000 AND $__unixEpochTo() * 1000
+  AND is_successful = 1
+ORDER BY unix_timestamp;
+
+-- 21. DOWNLOAD & UPLOAD COMBINED (Time Series)
+SELECT 
+    unix_timestamp / 1000.0 as time,
+    metric,
+    value
+FROM (
+    SELECT unix_timestamp, 'Download' as metric, download_mbps as value
+    FROM speedtest WHERE is_successful = 1
+    UNION ALL
+    SELECT unix_timestamp, 'Upload' as metric, upload_mbps as value
+    FROM speedtest WHERE is_successful = 1
+) speeds
+WHERE unix_timestamp BETWEEN $__unixEpochFrom() * 1000 AND $__unixEpochTo() * 1000
+ORDER BY unix_timestamp;
+
+-- 22. SPEED TEST STATISTICS (Stat Panel)
+SELECT 
+    AVG(download_mbps) as avg_download_mbps,
+    AVG(upload_mbps) as avg_upload_mbps,
+    MIN(download_mbps) as min_download_mbps,
+    MIN(upload_mbps) as min_upload_mbps,
+    MAX(download_mbps) as max_download_mbps,
+    MAX(upload_mbps) as max_upload_mbps
+FROM speedtest
+WHERE unix_timestamp BETWEEN $__unixEpochFrom() * 1000 AND $__unixEpochTo() * 1000
+  AND is_successful = 1;
+
+-- 23. CURRENT SPEED TEST (Stat Panel)
+SELECT 
+    timestamp,
+    download_mbps,
+    upload_mbps,
+    ping_ms,
+    server_name,
+    server_location
+FROM speedtest
+WHERE is_successful = 1
+ORDER BY unix_timestamp DESC
+LIMIT 1;
+
+-- 24. SPEED TEST PING LATENCY (Time Series)
+SELECT 
+    unix_timestamp / 1000.0 as time,
+    'Speed Test Ping' as metric,
+    ping_ms as value
+FROM speedtest
+WHERE unix_timestamp BETWEEN $__unixEpochFrom() * 1000 AND $__unixEpochTo() * 1000
+  AND is_successful = 1
+ORDER BY unix_timestamp;
+
+-- 25. SPEED TEST SUCCESS RATE (Stat Panel)
+SELECT 
+    COUNT(*) as total_tests,
+    SUM(is_successful) as successful_tests,
+    SUM(is_successful) * 100.0 / COUNT(*) as success_rate
+FROM speedtest
+WHERE unix_timestamp BETWEEN $__unixEpochFrom() * 1000 AND $__unixEpochTo() * 1000;
+
+-- 26. SPEED TEST HISTORY TABLE (Table)
+SELECT 
+    timestamp,
+    download_mbps,
+    upload_mbps,
+    ping_ms,
+    server_name,
+    server_location,
+    isp,
+    test_duration_seconds
+FROM speedtest
+WHERE unix_timestamp BETWEEN $__unixEpochFrom() * 1000 AND $__unixEpochTo() * 1000
+  AND is_successful = 1
+ORDER BY unix_timestamp DESC;
+
+-- 27. SPEED BY ISP (Bar Chart)
+SELECT 
+    isp,
+    AVG(download_mbps) as avg_download,
+    AVG(upload_mbps) as avg_upload
+FROM speedtest
+WHERE unix_timestamp BETWEEN $__unixEpochFrom() * 1000 AND $__unixEpochTo() * 1000
+  AND is_successful = 1
+GROUP BY isp;
+
+-- 28. SPEED BY SERVER LOCATION (Table)
+SELECT 
+    server_location,
+    server_country,
+    COUNT(*) as test_count,
+    AVG(download_mbps) as avg_download,
+    AVG(upload_mbps) as avg_upload,
+    AVG(ping_ms) as avg_ping
+FROM speedtest
+WHERE unix_timestamp BETWEEN $__unixEpochFrom() * 1000 AND $__unixEpochTo() * 1000
+  AND is_successful = 1
+GROUP BY server_location, server_country
+ORDER BY test_count DESC;
+
+-- 29. SPEED TEST FAILURES (Table)
+SELECT 
+    timestamp,
+    error_message
+FROM speedtest
+WHERE unix_timestamp BETWEEN $__unixEpochFrom() * 1000 AND $__unixEpochTo() * 1000
+  AND is_successful = 0
+ORDER BY unix_timestamp DESC;
+
+-- 30. HOURLY AVERAGE SPEEDS (Time Series)
+SELECT 
+    strftime('%Y-%m-%d %H:00:00', timestamp) as time,
+    AVG(download_mbps) as avg_download,
+    AVG(upload_mbps) as avg_upload
+FROM speedtest
+WHERE unix_timestamp BETWEEN $__unixEpochFrom() * 1000 AND $__unixEpochTo() * 1000
+  AND is_successful = 1
+GROUP BY strftime('%Y-%m-%d %H:00:00', timestamp)
+ORDER BY time;
+
+-- =====================================================
+-- ROLLUP QUERIES
+-- =====================================================
+-- bucket_start is stored as local time text; filter with the same
+-- 'YYYY-MM-DD HH:MM:SS' format. Pick '1m', '1h' or '1d' to match the range.
+-- Buckets are kept per agent (agent_id 0: local results); these queries add them up.
+
+-- 31. UPTIME PERCENTAGE FROM ROLLUPS (Stat Panel, replaces #4)
+SELECT 
+    target,
+    SUM(reachable_count) * 100.0 / SUM(sample_count) as uptime_percentage
+FROM ping_rollup
+WHERE granularity = '1h'
+  AND bucket_start BETWEEN datetime($__unixEpochFrom(), 'unixepoch', 'localtime') AND datetime($__unixEpochTo(), 'unixepoch', 'localtime')
+GROUP BY target;
+
+-- 32. AVERAGE LATENCY BY TARGET FROM ROLLUPS (Stat Panel, replaces #5)
+SELECT 
+    target,
+    SUM(latency_sum) / SUM(latency_count) as avg_latency_ms,
+    MIN(latency_min) as min_latency_ms,
+    MAX(latency_max) as max_latency_ms
+FROM ping_rollup
+WHERE granularity = '1h'
+  AND bucket_start BETWEEN datetime($__unixEpochFrom(), 'unixepoch', 'localtime') AND datetime($__unixEpochTo(), 'unixepoch', 'localtime')
+GROUP BY target;
+
+-- 33. HOURLY UPTIME REPORT FROM ROLLUPS (Table, replaces #13)
+SELECT 
+    target,
+    bucket_start as hour,
+    SUM(sample_count) as total_checks,
+    SUM(reachable_count) as successful_checks,
+    SUM(reachable_count) * 100.0 / SUM(sample_count) as uptime_percentage,
+    SUM(latency_sum) / SUM(latency_count) as avg_ping_ms,
+    SUM(packet_loss_sum) / SUM(sample_count) as avg_packet_loss
+FROM ping_rollup
+WHERE granularity = '1h'
+  AND bucket_start BETWEEN datetime($__unixEpochFrom(), 'unixepoch', 'localtime') AND datetime($__unixEpochTo(), 'unixepoch', 'localtime')
+GROUP BY target, bucket_start
+ORDER BY hour DESC;
+
+-- 34. CONNECTION QUALITY SCORE FROM ROLLUPS (Gauge, replaces #17)
+SELECT 
+    target,
+    (
+        SUM(reachable_count) * 50.0 / SUM(sample_count) + -- 50% weight for uptime
+        ((100 - SUM(packet_loss_sum) / SUM(sample_count)) / 100) * 30 + -- 30% weight for packet loss
+        (CASE 
+            WHEN SUM(latency_sum) / SUM(latency_count) < 20 THEN 20
+            WHEN SUM(latency_sum) / SUM(latency_count) < 50 THEN 15
+            WHEN SUM(latency_sum) / SUM(latency_count) < 100 THEN 10
+            WHEN SUM(latency_sum) / SUM(latency_count) < 200 THEN 5
+            ELSE 0
+        END) -- 20% weight for latency
+    ) as quality_score
+FROM ping_rollup
+WHERE granularity = '1h'
+  AND bucket_start BETWEEN datetime($__unixEpochFrom(), 'unixepoch', 'localtime') AND datetime($__unixEpochTo(), 'unixepoch', 'localtime')
+GROUP BY target;
+
+-- 37. DNS RESOLUTION TIME FROM ROLLUPS (Time Series)
+SELECT 
+    (julianday(bucket_start, 'utc') - 2440587.5) * 86400 as time,
+    domain || ' via ' || nameserver as metric,
+    SUM(resolution_sum) / SUM(success_count) as value
+FROM dns_rollup
+WHERE granularity = '1h'
+  AND bucket_start BETWEEN datetime($__unixEpochFrom(), 'unixepoch', 'localtime') AND datetime($__unixEpochTo(), 'unixepoch', 'localtime')
+  AND success_count > 0
+GROUP BY bucket_start, domain, nameserver
+ORDER BY bucket_start;
+
+-- 39. HTTP RESPONSE TIME FROM ROLLUPS (Time Series)
+SELECT 
+    (julianday(bucket_start, 'utc') - 2440587.5) * 86400 as time,
+    url as metric,
+    SUM(total_time_sum) / SUM(success_count) as value
+FROM http_rollup
+WHERE granularity = '1h'
+  AND bucket_start BETWEEN datetime($__unixEpochFrom(), 'unixepoch', 'localtime') AND datetime($__unixEpochTo(), 'unixepoch', 'localtime')
+  AND success_count > 0
+GROUP BY bucket_start, url
+ORDER BY bucket_start;
+
+-- =====================================================
+-- DNS ANSWER CHANGES
+-- =====================================================
+
+-- 41. DNS ANSWER CHANGES (Table)
+SELECT 
+    c.timestamp,
+    c.domain,
+    c.nameserver,
+    c.record_type,
+    prev.answers as previous_answers,
+    cur.answers as current_answers
+FROM dns_answer_changes c
+JOIN dns_answer_sets cur ON cur.answer_set_id = c.answer_set_id
+LEFT JOIN dns_answer_sets prev ON prev.answer_set_id = c.previous_answer_set_id
+WHERE c.unix_timestamp BETWEEN $__unixEpochFrom() * 1000 AND $__unixEpochTo() * 1000
+ORDER BY c.unix_timestamp DESC;
+
+-- 42. SMOOTHED JITTER (Time Series)
+SELECT 
+    unix_timestamp / 1000.0 as time,
+    target as metric,
+    ewma_jitter_ms as value
+FROM ping
+WHERE unix_timestamp BETWEEN $__unixEpochFrom() * 1000 AND $__unixEpochTo() * 1000
+  AND ewma_jitter_ms IS NOT NULL
+ORDER BY unix_timestamp;
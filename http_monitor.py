@@ -2,88 +2,64 @@
 HTTP/HTTPS monitoring module
 """
 import time
+import asyncio
 import logging
 import ssl
 import socket
+import http.client
 from datetime import datetime
-from threading import Thread, Event
-import requests
-from urllib.parse import urlparse
+from functools import partial
+from threading import Event
+from http_probe import probe_url, ConnectionPool, TooManyRedirects
+from scheduler import target_entries
 
 logger = logging.getLogger(__name__)
 
 
 class HTTPMonitor:
-    def __init__(self, db_manager, config):
+    def __init__(self, db_manager, config, scheduler, resolver=None):
         self.db_manager = db_manager
         self.config = config
+        self.scheduler = scheduler
         self.stop_event = Event()
-        self.thread = None
+        # Keep-alive connections and the shared ResolutionCache, used by warm checks;
+        # cold checks open a new connection and do their own DNS lookup
+        self.pool = ConnectionPool()
+        self.resolver = resolver
     
-    def measure_tls_handshake(self, hostname, port=443, timeout=5):
-        """Measure TLS handshake time"""
-        try:
-            context = ssl.create_default_context()
-            start_time = time.time()
-            
-            with socket.create_connection((hostname, port), timeout=timeout) as sock:
-                with context.wrap_socket(sock, server_hostname=hostname) as ssock:
-                    tls_time = (time.time() - start_time) * 1000
-                    return tls_time, ssock.version()
-        except Exception as e:
-            logger.debug(f"TLS handshake error for {hostname}: {e}")
-            return None, None
-    
-    def perform_http_request(self, url, timeout=10):
+    def perform_http_request(self, url, timeout=10, pool=None, resolver=None):
         """
         Perform HTTP request and measure timing metrics
+        Every phase is timed on the connection that carries the request and the
+        body is streamed and counted, not kept. With a pool (warm mode) the
+        connection is kept alive and reused by the next check, and with a
+        resolver the host address comes from the resolution cache.
         Returns: (dns_time_ms, connect_time_ms, tls_time_ms, ttfb_ms, total_time_ms, 
-                 status_code, response_size, is_successful, error_message)
+                 status_code, response_size, tls_version, is_successful, error_message)
         """
         try:
-            # Parse URL
-            parsed = urlparse(url)
-            hostname = parsed.hostname
-            is_https = parsed.scheme == 'https'
-            
-            # Measure TLS handshake time separately if HTTPS
-            tls_time_ms = None
-            tls_version = None
-            if is_https:
-                tls_time_ms, tls_version = self.measure_tls_handshake(hostname, 443, timeout)
-            
-            # Perform HTTP request with detailed timing
-            start_time = time.time()
-            response = requests.get(url, timeout=timeout, allow_redirects=True)
-            total_time_ms = (time.time() - start_time) * 1000
-            
-            # Get detailed timing from requests
-            # Note: requests doesn't provide detailed timing, so we estimate
-            dns_time_ms = None  # Not directly available in requests
-            connect_time_ms = None  # Not directly available
-            
-            # TTFB approximation (time to first byte)
-            # In requests, elapsed.total_seconds() gives us response time
-            ttfb_ms = response.elapsed.total_seconds() * 1000
-            
-            response_size = len(response.content)
-            status_code = response.status_code
-            
-            return (dns_time_ms, connect_time_ms, tls_time_ms, ttfb_ms, total_time_ms,
-                   status_code, response_size, tls_version, True, None)
-            
-        except requests.exceptions.Timeout:
+            result = probe_url(url, timeout, self.config.get('max_redirects', 5),
+                               pool=pool, resolver=resolver)
+            return (result['dns_time_ms'], result['connect_time_ms'], result['tls_time_ms'],
+                   result['ttfb_ms'], result['total_time_ms'], result['status_code'],
+                   result['response_size'], result['tls_version'], True, None)
+        
+        except socket.timeout:
             return None, None, None, None, None, None, None, None, False, "Request timeout"
-        except requests.exceptions.ConnectionError as e:
+        except socket.gaierror as e:
+            return None, None, None, None, None, None, None, None, False, f"DNS resolution failed: {str(e)}"
+        except ssl.SSLError as e:
+            return None, None, None, None, None, None, None, None, False, f"TLS error: {str(e)}"
+        except (ConnectionError, http.client.HTTPException) as e:
             return None, None, None, None, None, None, None, None, False, f"Connection error: {str(e)}"
-        except requests.exceptions.TooManyRedirects:
+        except TooManyRedirects:
             return None, None, None, None, None, None, None, None, False, "Too many redirects"
         except Exception as e:
             return None, None, None, None, None, None, None, None, False, str(e)
     
     def store_http_result(self, url, dns_time_ms, connect_time_ms, tls_time_ms, 
                          ttfb_ms, total_time_ms, status_code, response_size, 
-                         tls_version, is_successful, error_message):
+                         tls_version, is_successful, error_message, measurement_mode='cold'):
         """Store HTTP request result in database"""
         now = datetime.now()
         unix_timestamp = int(time.time() * 1000)
@@ -101,11 +77,12 @@ class HTTPMonitor:
             response_size=response_size,
             tls_version=tls_version,
             is_successful=is_successful,
-            error_message=error_message
+            error_message=error_message,
+            measurement_mode=measurement_mode
         )
         
         if success and is_successful:
-            logger.info(f"HTTP {url}: {total_time_ms:.0f}ms total, "
+            logger.info(f"HTTP {url} ({measurement_mode}): {total_time_ms:.0f}ms total, "
                        f"TTFB: {ttfb_ms:.0f}ms, Status: {status_code}, "
                        f"Size: {response_size} bytes")
         elif success:
@@ -113,48 +90,67 @@ class HTTPMonitor:
         else:
             logger.error(f"Failed to store HTTP result for {url}")
     
-    def monitor_loop(self):
-        """Main monitoring loop"""
+    def check_url(self, url, mode, timeout):
+        """Request one URL in cold or warm mode and store the result"""
+        warm = mode == 'warm'
+        (dns_time_ms, connect_time_ms, tls_time_ms, ttfb_ms, total_time_ms,
+         status_code, response_size, tls_version, is_successful, error_message) = \
+            self.perform_http_request(url, timeout, self.pool if warm else None,
+                                      self.resolver if warm else None)
+        
+        self.store_http_result(url, dns_time_ms, connect_time_ms, tls_time_ms,
+                              ttfb_ms, total_time_ms, status_code, response_size,
+                              tls_version, is_successful, error_message, mode)
+    
+    async def http_job(self, checks, timeout):
+        """
+        Scheduled job: check a batch of (url, mode) concurrently on the execution
+        engine's workers, at most http.concurrency at a time
+        """
+        engine = self.scheduler.execution_engine
+        results = await asyncio.gather(*(
+            asyncio.wrap_future(engine.submit('http', self.check_url, url, mode, timeout))
+            for url, mode in checks
+        ), return_exceptions=True)
+        for result, (url, _) in zip(results, checks):
+            if isinstance(result, Exception):
+                logger.error(f"HTTP check of {url} failed: {result}")
+    
+    def start(self):
+        """Register one job per interval, each checking all of its URLs at once"""
+        if not self.config.get('enabled', True):
+            logger.info("HTTP monitor is disabled")
+            return
+        
         interval = self.config.get('interval_seconds', 60)
-        urls = self.config.get('urls', [
+        url_config = self.config.get('urls', [
             'https://www.google.com',
             'https://www.cloudflare.com',
             'https://www.github.com'
         ])
+        urls = target_entries(url_config, 'url', interval)
+        # "cold": new connection and full handshake per check; "warm": pooled keep-alive connection
+        default_mode = self.config.get('mode', 'cold')
+        modes = {item['url']: item.get('mode', default_mode) for item in url_config if isinstance(item, dict)}
         timeout = self.config.get('timeout_seconds', 10)
         
-        logger.info(f"Starting HTTP monitor with {len(urls)} URLs, interval: {interval}s")
-        
-        while not self.stop_event.is_set():
-            for url in urls:
-                if self.stop_event.is_set():
-                    break
-                
-                (dns_time_ms, connect_time_ms, tls_time_ms, ttfb_ms, total_time_ms,
-                 status_code, response_size, tls_version, is_successful, error_message) = \
-                    self.perform_http_request(url, timeout)
-                
-                self.store_http_result(url, dns_time_ms, connect_time_ms, tls_time_ms,
-                                      ttfb_ms, total_time_ms, status_code, response_size,
-                                      tls_version, is_successful, error_message)
-            
-            # Wait for next interval
-            self.stop_event.wait(interval)
-    
-    def start(self):
-        """Start monitoring in a separate thread"""
-        if not self.config.get('enabled', True):
-            logger.info("HTTP monitor is disabled")
-            return
+        by_interval = {}
+        for url, url_interval in urls:
+            by_interval.setdefault(url_interval, []).append((url, modes.get(url, default_mode)))
         
-        self.thread = Thread(target=self.monitor_loop, daemon=True)
-        self.thread.start()
-        logger.info("HTTP monitor started")
+        self.scheduler.configure_monitor('http', self.config.get('concurrency', 20),
+                                         self.config.get('priority', 2))
+        self.scheduler.add_jobs('http', [
+            (f"every-{url_interval}s", url_interval, partial(self.http_job, checks, timeout))
+            for url_interval, checks in by_interval.items()
+        ])
+        warm = sum(1 for checks in by_interval.values() for _, mode in checks if mode == 'warm')
+        logger.info(f"HTTP monitor started with {len(urls)} URLs ({warm} warm)")
     
     def stop(self):
         """Stop monitoring"""
         logger.info("Stopping HTTP monitor...")
         self.stop_event.set()
-        if self.thread:
-            self.thread.join(timeout=5)
+        self.scheduler.remove_jobs('http')
+        self.pool.close()
         logger.info("HTTP monitor stopped")
@@ -0,0 +1,252 @@
+"""
+Instrumented HTTP client
+Times each phase of a request (DNS, TCP connect, TLS handshake, time to first
+byte, body) on the same connection that carries the request, like curl -w,
+and streams the body without keeping it
+"""
+import ssl
+import time
+import socket
+import http.client
+from threading import Lock
+from urllib.parse import urlsplit, urljoin
+
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+BODY_CHUNK_BYTES = 64 * 1024
+USER_AGENT = 'network-monitor/1.0'
+PHASES = ('dns', 'connect', 'tls', 'ttfb', 'body')
+# Raised when the server has closed an idle keep-alive connection
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+
+class TooManyRedirects(Exception):
+    pass
+
+
+def split_url(url):
+    """Returns: (scheme, host, port, request target)"""
+    parts = urlsplit(url)
+    if parts.scheme not in DEFAULT_PORTS or not parts.hostname:
+        raise ValueError(f"Unsupported URL: {url}")
+    target = parts.path or '/'
+    if parts.query:
+        target += '?' + parts.query
+    return parts.scheme, parts.hostname, parts.port or DEFAULT_PORTS[parts.scheme], target
+
+
+class ProbeConnection:
+    """
+    One HTTP(S) connection opened step by step so every phase can be timed.
+    Phase times (ms) accumulate in timings until take_timings() collects them.
+    """
+    def __init__(self, scheme, host, port, timeout=10, tls_context=None, resolver=None):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.tls_context = tls_context
+        # Shared ResolutionCache; None means every connection resolves the host itself
+        self.resolver = resolver
+        self.connection = None
+        self.tls_version = None
+        # Reused body buffer, the body is counted and discarded
+        self.buffer = bytearray(BODY_CHUNK_BYTES)
+        self.timings = dict.fromkeys(PHASES, 0.0)
+        # Requests completed on the current socket
+        self.requests = 0
+    
+    @property
+    def origin(self):
+        return self.scheme, self.host, self.port
+    
+    def connect(self):
+        """Resolve, connect and (for https) handshake, timing each step"""
+        start = time.perf_counter()
+        if self.resolver:
+            address = self.resolver.resolve(self.host)
+            if address is None:
+                raise socket.gaierror(socket.EAI_NONAME, f"Cannot resolve {self.host}")
+            family = socket.AF_INET6 if ':' in address else socket.AF_INET
+            addresses = [(family, socket.SOCK_STREAM, socket.IPPROTO_TCP, '', (address, self.port))]
+        else:
+            addresses = socket.getaddrinfo(self.host, self.port, type=socket.SOCK_STREAM)
+        resolved = time.perf_counter()
+        self.timings['dns'] += (resolved - start) * 1000
+        
+        sock = None
+        error = None
+        for family, sock_type, proto, _, address in addresses:
+            sock = socket.socket(family, sock_type, proto)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(address)
+                break
+            except OSError as e:
+                sock.close()
+                sock = None
+                error = e
+        if sock is None:
+            raise error or OSError(f"No addresses for {self.host}")
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connected = time.perf_counter()
+        self.timings['connect'] += (connected - resolved) * 1000
+        
+        if self.scheme == 'https':
+            context = self.tls_context or ssl.create_default_context()
+            try:
+                sock = context.wrap_socket(sock, server_hostname=self.host)
+            except Exception:
+                sock.close()
+                raise
+            self.tls_version = sock.version()
+            self.timings['tls'] += (time.perf_counter() - connected) * 1000
+            self.connection = http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout,
+                                                          context=context)
+        else:
+            self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        # The connection sends over the socket opened above instead of connecting itself
+        self.connection.sock = sock
+        self.requests = 0
+    
+    def request(self, target, method='GET'):
+        """
+        Send one request and read the response body to the end
+        Returns: (status_code, location header, body bytes, keep_alive)
+        """
+        if self.connection is None:
+            self.connect()
+        
+        start = time.perf_counter()
+        self.connection.request(method, target, headers={
+            'User-Agent': USER_AGENT,
+            'Accept': '*/*',
+            'Accept-Encoding': 'identity'
+        })
+        response = self.connection.getresponse()
+        first_byte = time.perf_counter()
+        self.timings['ttfb'] += (first_byte - start) * 1000
+        
+        size = 0
+        buffer = self.buffer
+        while True:
+            read = response.readinto(buffer)
+            if not read:
+                break
+            size += read
+        self.timings['body'] += (time.perf_counter() - first_byte) * 1000
+        
+        self.requests += 1
+        keep_alive = not response.will_close
+        if not keep_alive:
+            self.close()
+        return response.status, response.getheader('Location'), size, keep_alive
+    
+    def take_timings(self):
+        """Return the phase times accumulated so far and start over"""
+        timings = self.timings
+        self.timings = dict.fromkeys(PHASES, 0.0)
+        return timings
+    
+    def close(self):
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+
+
+class ConnectionPool:
+    """Idle keep-alive connections per origin, reused by warm measurements"""
+    def __init__(self, max_idle_per_origin=4):
+        self.max_idle = max_idle_per_origin
+        self.lock = Lock()
+        self.idle = {}
+    
+    def acquire(self, origin):
+        """Take an idle connection to origin, or None"""
+        with self.lock:
+            connections = self.idle.get(origin)
+            return connections.pop() if connections else None
+    
+    def release(self, connection):
+        """Return a connection after use; closed or surplus connections are dropped"""
+        if connection.connection is None:
+            return
+        with self.lock:
+            connections = self.idle.setdefault(connection.origin, [])
+            if len(connections) < self.max_idle:
+                connections.append(connection)
+                return
+        connection.close()
+    
+    def close(self):
+        with self.lock:
+            connections = [c for idle in self.idle.values() for c in idle]
+            self.idle.clear()
+        for connection in connections:
+            connection.close()
+
+
+def probe_url(url, timeout=10, max_redirects=5, tls_context=None, pool=None, resolver=None):
+    """
+    Request url, following redirects, and time every phase
+    Phase times are summed over the redirect chain; a redirect to the same origin
+    reuses the connection, so it adds no DNS, connect or TLS time. With a pool the
+    connections are kept alive for the next call (warm), otherwise closed (cold).
+    With a resolver (ResolutionCache) new connections take the host address from it.
+    Returns: dict with dns_time_ms, connect_time_ms, tls_time_ms, ttfb_ms,
+             body_time_ms, total_time_ms, status_code, response_size, tls_version
+    """
+    start = time.perf_counter()
+    totals = dict.fromkeys(PHASES, 0.0)
+    https = False
+    connection = None
+    
+    def finish(connection):
+        for phase, value in connection.take_timings().items():
+            totals[phase] += value
+        if pool:
+            pool.release(connection)
+        else:
+            connection.close()
+    
+    try:
+        for _ in range(max_redirects + 1):
+            scheme, host, port, target = split_url(url)
+            https = https or scheme == 'https'
+            if connection is None or connection.connection is None or connection.origin != (scheme, host, port):
+                if connection:
+                    finish(connection)
+                connection = pool.acquire((scheme, host, port)) if pool else None
+                if connection is None:
+                    connection = ProbeConnection(scheme, host, port, timeout, tls_context, resolver)
+            
+            try:
+                status, location, size, _ = connection.request(target)
+            except STALE_CONNECTION_ERRORS:
+                if not connection.requests:
+                    raise
+                # The server dropped the idle connection; request() reconnects
+                connection.close()
+                status, location, size, _ = connection.request(target)
+            if status in REDIRECT_STATUSES and location:
+                url = urljoin(url, location)
+                continue
+            
+            finish(connection)
+            tls_version = connection.tls_version
+            connection = None
+            return {
+                'dns_time_ms': totals['dns'],
+                'connect_time_ms': totals['connect'],
+                'tls_time_ms': totals['tls'] if https else None,
+                'ttfb_ms': totals['ttfb'],
+                'body_time_ms': totals['body'],
+                'total_time_ms': (time.perf_counter() - start) * 1000,
+                'status_code': status,
+                'response_size': size,
+                'tls_version': tls_version
+            }
+        raise TooManyRedirects(f"More than {max_redirects} redirects")
+    finally:
+        if connection:
+            connection.close()
@@ -0,0 +1,408 @@
+"""
+Multiplexed ICMP engine
+Sends echo requests and traceroute probes for many targets and matches the
+ICMP replies and errors in a single receiver thread, on one socket per address family
+"""
+import os
+import time
+import socket
+import struct
+import logging
+import selectors
+from threading import Thread, Event, Lock
+
+logger = logging.getLogger(__name__)
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+ICMP_DEST_UNREACHABLE = 3
+ICMP_TIME_EXCEEDED = 11
+ICMPV6_DEST_UNREACHABLE = 1
+ICMPV6_TIME_EXCEEDED = 3
+ICMPV6_ECHO_REQUEST = 128
+ICMPV6_ECHO_REPLY = 129
+
+# Destination unreachable codes -> traceroute annotation; port unreachable means the target was reached
+UNREACHABLE_ANNOTATIONS = {
+    socket.AF_INET: {0: '!N', 1: '!H', 2: '!P', 3: None, 9: '!X', 10: '!X', 13: '!X'},
+    socket.AF_INET6: {0: '!N', 1: '!X', 3: '!H', 4: None},
+}
+
+ICMP_HEADER = struct.Struct('!BBHHH')
+UDP_HEADER = struct.Struct('!HHHH')
+IPV6_HEADER_BYTES = 40
+
+RECEIVE_BUFFER_BYTES = 1 << 20
+
+TRACEROUTE_PORT = 33434
+# Probe n of a traceroute carries TRACE_PAYLOAD_BYTES + n bytes of UDP payload
+TRACE_PAYLOAD_BYTES = 32
+
+
+def icmp_checksum(data):
+    """RFC 1071 internet checksum"""
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def echo_request(family, identifier, sequence, payload):
+    """Build an ICMP (or ICMPv6) echo request packet"""
+    if family == socket.AF_INET6:
+        # The kernel fills in the ICMPv6 checksum, it covers a pseudo-header we do not see
+        return ICMP_HEADER.pack(ICMPV6_ECHO_REQUEST, 0, 0, identifier, sequence) + payload
+    header = ICMP_HEADER.pack(ICMP_ECHO_REQUEST, 0, 0, identifier, sequence)
+    checksum = icmp_checksum(header + payload)
+    return ICMP_HEADER.pack(ICMP_ECHO_REQUEST, 0, checksum, identifier, sequence) + payload
+
+
+def address_family(address):
+    return socket.AF_INET6 if ':' in address else socket.AF_INET
+
+
+def open_icmp_socket(family):
+    """
+    Open an ICMP socket for family, preferring raw and falling back to the
+    unprivileged datagram socket (Linux net.ipv4.ping_group_range)
+    Returns: (socket, is_raw), or (None, False) if neither is permitted
+    """
+    proto = socket.IPPROTO_ICMPV6 if family == socket.AF_INET6 else socket.IPPROTO_ICMP
+    for sock_type in (socket.SOCK_RAW, socket.SOCK_DGRAM):
+        try:
+            sock = socket.socket(family, sock_type, proto)
+        except OSError:
+            continue
+        sock.setblocking(False)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER_BYTES)
+        except OSError:
+            pass
+        return sock, sock_type == socket.SOCK_RAW
+    return None, False
+
+
+def parse_icmp_error(family, data):
+    """
+    Parse a time exceeded / destination unreachable message quoting a UDP probe
+    data starts at the ICMP header
+    Returns: (icmp type, code, probed address, UDP source port, UDP length), or None
+    """
+    if len(data) < ICMP_HEADER.size:
+        return None
+    icmp_type, code = data[0], data[1]
+    if family == socket.AF_INET:
+        if icmp_type not in (ICMP_TIME_EXCEEDED, ICMP_DEST_UNREACHABLE):
+            return None
+        inner = data[ICMP_HEADER.size:]
+        if len(inner) < 20 or inner[9] != socket.IPPROTO_UDP:
+            return None
+        header_length = (inner[0] & 0x0F) * 4
+        destination = socket.inet_ntop(socket.AF_INET, inner[16:20])
+    else:
+        if icmp_type not in (ICMPV6_TIME_EXCEEDED, ICMPV6_DEST_UNREACHABLE):
+            return None
+        inner = data[ICMP_HEADER.size:]
+        # Probes carry no extension headers, so UDP follows the fixed header directly
+        if len(inner) < IPV6_HEADER_BYTES or inner[6] != socket.IPPROTO_UDP:
+            return None
+        header_length = IPV6_HEADER_BYTES
+        destination = socket.inet_ntop(socket.AF_INET6, inner[24:40])
+    if len(inner) < header_length + UDP_HEADER.size:
+        return None
+    source_port, _, length, _ = UDP_HEADER.unpack_from(inner, header_length)
+    return icmp_type, code, destination, source_port, length
+
+
+class _Batch:
+    """Probes of one ping_many or trace call; done is set when every probe is answered"""
+    def __init__(self):
+        # slot -> reply, filled in by the receiver thread
+        self.results = {}
+        self.outstanding = 0
+        # Replies to early rounds must not complete the batch while later rounds are being sent
+        self.sending = True
+        self.done = Event()
+
+
+class IcmpEngine:
+    """
+    Echo requests and traceroute probes for any number of targets share one ICMP
+    socket per address family. A ping cycle or a traceroute costs about one
+    timeout no matter how many targets or hops are probed.
+    """
+    def __init__(self, config=None):
+        config = config or {}
+        self.payload_size = config.get('payload_bytes', 56)
+        self.lock = Lock()
+        self.stop_event = Event()
+        self.thread = None
+        self.selector = None
+        # family -> (socket, is_raw, identifier)
+        self.sockets = {}
+        # probe key -> (batch, slot, expected address, send time); echo probes are keyed
+        # by sequence, traceroute probes by (UDP source port, UDP length)
+        self.pending = {}
+        self.next_sequence = 0
+        self.packets_sent = 0
+        self.replies_received = 0
+
+    @property
+    def available(self):
+        return bool(self.sockets)
+
+    def supports(self, family):
+        return family in self.sockets
+
+    def supports_trace(self, family):
+        """Traceroute needs a raw socket, datagram ICMP sockets never see errors for UDP probes"""
+        return family in self.sockets and self.sockets[family][1]
+
+    def open(self):
+        """Open the ICMP sockets; returns True if at least one family is usable"""
+        self.selector = selectors.DefaultSelector()
+        for family in (socket.AF_INET, socket.AF_INET6):
+            sock, is_raw = open_icmp_socket(family)
+            if sock is None:
+                continue
+            # Datagram ICMP sockets get their identifier rewritten by the kernel to the local port
+            identifier = os.getpid() & 0xFFFF
+            if not is_raw:
+                sock.bind(('', 0) if family == socket.AF_INET else ('::', 0))
+                identifier = sock.getsockname()[1]
+            self.sockets[family] = (sock, is_raw, identifier)
+            self.selector.register(sock, selectors.EVENT_READ, family)
+            logger.info(f"ICMP engine using {'raw' if is_raw else 'datagram'} "
+                       f"{'IPv6' if family == socket.AF_INET6 else 'IPv4'} socket")
+
+        if not self.sockets:
+            logger.warning("ICMP engine has no usable socket (needs root, CAP_NET_RAW or ping_group_range)")
+            self.selector.close()
+            self.selector = None
+        return self.available
+
+    def close(self):
+        """Close the sockets"""
+        for sock, _, _ in self.sockets.values():
+            sock.close()
+        self.sockets = {}
+        if self.selector:
+            self.selector.close()
+            self.selector = None
+
+    def _allocate_sequence(self):
+        # Sequences are unique across all in-flight echo probes, so they alone key them
+        for _ in range(0x10000):
+            sequence = self.next_sequence
+            self.next_sequence = (self.next_sequence + 1) & 0xFFFF
+            if sequence not in self.pending:
+                return sequence
+        raise RuntimeError("Too many ICMP probes in flight")
+
+    def _register(self, batch, key, slot, address):
+        """Record a probe as in flight; called with the lock held, right before sending"""
+        self.pending[key] = (batch, slot, address, time.perf_counter())
+        batch.outstanding += 1
+
+    def _unregister(self, batch, key):
+        with self.lock:
+            if self.pending.pop(key, None):
+                batch.outstanding -= 1
+
+    def _complete(self, key, address, reply_from, received, **reply):
+        """Match a reply to its pending probe; address is the target the probe was sent to"""
+        with self.lock:
+            entry = self.pending.get(key)
+            if entry is None or entry[2] != address:
+                return
+            del self.pending[key]
+            batch, slot, _, sent = entry
+            batch.results[slot] = dict(reply, address=reply_from, rtt_ms=(received - sent) * 1000)
+            batch.outstanding -= 1
+            if not batch.outstanding and not batch.sending:
+                batch.done.set()
+        self.replies_received += 1
+
+    def _wait(self, batch, timeout):
+        """Wait for the replies of a batch, then forget its unanswered probes so late replies are ignored"""
+        with self.lock:
+            batch.sending = False
+            if not batch.outstanding:
+                batch.done.set()
+        batch.done.wait(timeout)
+
+        with self.lock:
+            for key in [k for k, entry in self.pending.items() if entry[0] is batch]:
+                del self.pending[key]
+
+    def echo_stream(self):
+        """
+        Batch for callers sending probes one at a time with send_echo: it never
+        completes, the caller takes the replies from its results by slot and
+        forgets probes that timed out with forget_probe
+        """
+        return _Batch()
+
+    def send_echo(self, batch, address, slot):
+        """
+        Send one echo request whose reply lands in batch.results[slot]
+        Returns: the probe key for forget_probe, or None if it could not be sent
+        """
+        family = address_family(address)
+        sock, _, identifier = self.sockets[family]
+        with self.lock:
+            sequence = self._allocate_sequence()
+            # Register before sending so a fast reply cannot beat the bookkeeping
+            self._register(batch, sequence, slot, address)
+
+        payload = struct.pack('!d', time.time()).ljust(self.payload_size, b'\x00')
+        try:
+            sock.sendto(echo_request(family, identifier, sequence, payload), (address, 0))
+            self.packets_sent += 1
+            return sequence
+        except OSError as e:
+            logger.debug(f"ICMP send to {address} failed: {e}")
+            self._unregister(batch, sequence)
+            return None
+
+    def forget_probe(self, batch, key):
+        """Stop waiting for a probe sent with send_echo, a late reply is ignored"""
+        self._unregister(batch, key)
+
+    def ping_many(self, addresses, count=4, timeout=2, spacing=0.2):
+        """
+        Probe every target count times, spacing seconds apart, and wait for the replies
+        addresses: {target: ip_address or None}
+        Returns: {target: [rtt_ms or None] * count}
+        """
+        batch = _Batch()
+        probes = {target: (address_family(address), address)
+                  for target, address in addresses.items() if address}
+
+        for index in range(count):
+            if index:
+                self.stop_event.wait(spacing)
+            for target, (family, address) in probes.items():
+                if self.supports(family):
+                    self.send_echo(batch, address, (target, index))
+
+        self._wait(batch, timeout)
+        return {target: [batch.results[(target, index)]['rtt_ms'] if (target, index) in batch.results else None
+                         for index in range(count)]
+                for target in addresses}
+
+    def trace(self, address, max_hops=30, timeout=2, probes_per_hop=3, spacing=0.05):
+        """
+        Paris-style traceroute: UDP probes for every TTL are sent at once from one
+        socket, so the flow (addresses, ports) is the same for every probe and
+        per-flow load balancers keep them on one path. Probes are told apart by
+        their UDP length, which is quoted back in the ICMP error.
+        Returns: [{'ttl', 'responses': [{'address', 'rtt_ms', 'reached', 'annotation'} or None]}]
+        """
+        family = address_family(address)
+        if not self.supports_trace(family):
+            raise RuntimeError(f"No raw ICMP socket for {address}")
+
+        if family == socket.AF_INET6:
+            ttl_option = (socket.IPPROTO_IPV6, socket.IPV6_UNICAST_HOPS)
+        else:
+            ttl_option = (socket.IPPROTO_IP, socket.IP_TTL)
+
+        batch = _Batch()
+        with socket.socket(family, socket.SOCK_DGRAM) as sock:
+            sock.bind(('', 0) if family == socket.AF_INET else ('::', 0))
+            source_port = sock.getsockname()[1]
+
+            for attempt in range(probes_per_hop):
+                if attempt:
+                    self.stop_event.wait(spacing)
+                for ttl in range(1, max_hops + 1):
+                    payload = bytes(TRACE_PAYLOAD_BYTES + (ttl - 1) * probes_per_hop + attempt)
+                    key = (source_port, UDP_HEADER.size + len(payload))
+                    with self.lock:
+                        self._register(batch, key, (ttl, attempt), address)
+                    try:
+                        sock.setsockopt(*ttl_option, ttl)
+                        sock.sendto(payload, (address, TRACEROUTE_PORT))
+                        self.packets_sent += 1
+                    except OSError as e:
+                        logger.debug(f"Traceroute probe to {address} (ttl {ttl}) failed: {e}")
+                        self._unregister(batch, key)
+
+            # Probes past the target are answered by the target itself, so a reachable
+            # target completes the batch well before the timeout
+            self._wait(batch, timeout)
+
+        return [{'ttl': ttl,
+                 'responses': [batch.results.get((ttl, attempt)) for attempt in range(probes_per_hop)]}
+                for ttl in range(1, max_hops + 1)]
+
+    def _handle_packet(self, family, data, source, received):
+        _, is_raw, our_identifier = self.sockets[family]
+        if family == socket.AF_INET and is_raw:
+            # Raw IPv4 sockets deliver the IP header as well
+            data = data[(data[0] & 0x0F) * 4:]
+        if len(data) < ICMP_HEADER.size:
+            return
+
+        icmp_type, _, _, identifier, sequence = ICMP_HEADER.unpack_from(data)
+        if icmp_type == (ICMPV6_ECHO_REPLY if family == socket.AF_INET6 else ICMP_ECHO_REPLY):
+            # Raw sockets see every process's echo replies
+            if identifier == our_identifier:
+                self._complete(sequence, source[0], source[0], received)
+            return
+
+        error = parse_icmp_error(family, data) if is_raw else None
+        if error is None:
+            return
+        icmp_type, code, destination, source_port, length = error
+        unreachable = icmp_type in (ICMP_DEST_UNREACHABLE, ICMPV6_DEST_UNREACHABLE)
+        annotation = UNREACHABLE_ANNOTATIONS[family].get(code, f'!{code}') if unreachable else None
+        self._complete((source_port, length), destination, source[0], received,
+                       reached=unreachable and annotation is None, annotation=annotation)
+
+    def receive_loop(self):
+        """Receiver thread: match replies to pending probes"""
+        while not self.stop_event.is_set():
+            for key, _ in self.selector.select(timeout=0.5):
+                family = key.data
+                sock = key.fileobj
+                while True:
+                    try:
+                        data, source = sock.recvfrom(65535)
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    except OSError as e:
+                        logger.debug(f"ICMP receive error: {e}")
+                        break
+                    self._handle_packet(family, data, source, time.perf_counter())
+
+    def get_stats(self):
+        """Return engine counters"""
+        with self.lock:
+            in_flight = len(self.pending)
+        return {
+            'packets_sent': self.packets_sent,
+            'replies_received': self.replies_received,
+            'in_flight': in_flight
+        }
+
+    def start(self):
+        """Open the sockets and start the receiver thread; returns False if ICMP is unavailable"""
+        if not self.sockets and not self.open():
+            return False
+        if self.thread and self.thread.is_alive():
+            return True
+        self.stop_event.clear()
+        self.thread = Thread(target=self.receive_loop, daemon=True)
+        self.thread.start()
+        return True
+
+    def stop(self):
+        """Stop the receiver thread and close the sockets"""
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+        self.close()
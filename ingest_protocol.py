@@ -0,0 +1,84 @@
+"""
+Agent -> collector ingest protocol
+Every frame is a 4-byte big-endian length followed by zlib-compressed JSON.
+An agent opens with hello, then sends numbered batches of insert calls; the
+collector acks each batch once it is written, and acked batches are never resent.
+    
+    agent:     {"type": "hello", "agent": id, "session": id, "token": secret}
+    collector: {"type": "welcome"} or {"type": "error", "error": reason}
+    agent:     {"type": "batch", "seq": n, "records": [[method, kwargs], ...]}
+    collector: {"type": "ack", "seq": n}
+"""
+import json
+import zlib
+import struct
+from datetime import datetime
+
+PROTOCOL_VERSION = 1
+LENGTH = struct.Struct('!I')
+# Largest compressed frame and decompressed message accepted
+MAX_FRAME_BYTES = 16 * 1024 * 1024
+MAX_MESSAGE_BYTES = 64 * 1024 * 1024
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'$datetime': value.isoformat()}
+    raise TypeError(f"Cannot encode {type(value).__name__}")
+
+
+def _decode_object(obj):
+    if len(obj) == 1 and '$datetime' in obj:
+        return datetime.fromisoformat(obj['$datetime'])
+    return obj
+
+
+def encode_frame(message, level=6):
+    """Serialize, compress and length-prefix one message"""
+    payload = zlib.compress(json.dumps(message, default=_encode_value,
+                                       separators=(',', ':')).encode(), level)
+    return LENGTH.pack(len(payload)) + payload
+
+
+def decode_payload(payload):
+    decompressor = zlib.decompressobj()
+    try:
+        data = decompressor.decompress(payload, MAX_MESSAGE_BYTES)
+    except zlib.error as e:
+        raise ProtocolError(f"Corrupt frame: {e}")
+    if decompressor.unconsumed_tail:
+        raise ProtocolError("Message too large")
+    return json.loads(data, object_hook=_decode_object)
+
+
+def recv_exact(sock, size):
+    """Read exactly size bytes; None if the peer closed before the first byte"""
+    chunks = []
+    remaining = size
+    while remaining:
+        chunk = sock.recv(min(remaining, 1024 * 1024))
+        if not chunk:
+            if remaining == size:
+                return None
+            raise ProtocolError("Connection closed mid-frame")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+
+def read_frame(sock):
+    """Read one message from a socket; None at end of stream"""
+    header = recv_exact(sock, LENGTH.size)
+    if header is None:
+        return None
+    (size,) = LENGTH.unpack(header)
+    if size > MAX_FRAME_BYTES:
+        raise ProtocolError(f"Frame of {size} bytes exceeds the limit")
+    payload = recv_exact(sock, size)
+    if payload is None:
+        raise ProtocolError("Connection closed mid-frame")
+    return decode_payload(payload)
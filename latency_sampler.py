@@ -0,0 +1,179 @@
+"""
+Loaded latency sampling for speed tests
+A probe stream on its own thread measures RTT while the transfers run. Samples
+are kept per phase (idle, download, upload) in compact arrays so the
+distributions can be compared and graded for bufferbloat.
+"""
+import math
+import time
+import socket
+import logging
+from collections import deque
+from array import array
+from threading import Thread, Event, Lock
+from pythonping import ping as pythonping_ping
+from icmp_engine import address_family
+
+logger = logging.getLogger(__name__)
+
+# Added median latency under load (ms) -> grade, F beyond the last limit
+BUFFERBLOAT_GRADES = ((30, 'A'), (60, 'B'), (200, 'C'), (400, 'D'))
+
+
+def percentile(values, fraction):
+    """Linearly interpolated percentile of sorted values"""
+    if not values:
+        return None
+    position = (len(values) - 1) * fraction
+    lower = math.floor(position)
+    upper = math.ceil(position)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def bufferbloat_grade(added_latency_ms):
+    """A-F grade for the latency a transfer adds on top of the idle latency"""
+    if added_latency_ms is None:
+        return None
+    for limit, grade in BUFFERBLOAT_GRADES:
+        if added_latency_ms < limit:
+            return grade
+    return 'F'
+
+
+class LatencySampler:
+    """
+    Probes one address every interval seconds from one background thread and
+    files each RTT under the phase that was current when its probe was sent.
+    With the shared ICMP engine probes go out on a fixed cadence while earlier
+    ones are still waiting for their reply, so lost probes leave no gaps.
+    Without it pythonping sends one probe at a time (it cannot match replies
+    of concurrent pings), and a lost probe delays the next one by its timeout.
+    """
+    def __init__(self, address, engine=None, interval=0.05, timeout=1.0):
+        self.address = address
+        self.engine = engine if engine and engine.supports(address_family(address)) else None
+        self.interval = interval
+        self.timeout = timeout
+        self.lock = Lock()
+        self.stop_event = Event()
+        self.thread = None
+        self.phase = None
+        # phase -> RTTs in ms, and phase -> probes that got no reply
+        self.samples = {}
+        self.lost = {}
+    
+    def record(self, phase, rtt_ms):
+        """File one probe result (None: lost) under phase"""
+        with self.lock:
+            if rtt_ms is None:
+                self.lost[phase] = self.lost.get(phase, 0) + 1
+            else:
+                self.samples.setdefault(phase, array('d')).append(rtt_ms)
+    
+    def stream_loop(self):
+        """Sampler thread with the ICMP engine: send on a fixed cadence, collect replies in send order"""
+        stream = self.engine.echo_stream()
+        # (slot, phase, send time, probe key) of the probes waiting for a reply, oldest first
+        in_flight = deque()
+        slot = 0
+        next_send = time.monotonic()
+        while in_flight or not self.stop_event.is_set():
+            now = time.monotonic()
+            if now >= next_send and not self.stop_event.is_set():
+                phase = self.phase
+                key = self.engine.send_echo(stream, self.address, slot)
+                if key is None:
+                    self.record(phase, None)
+                else:
+                    in_flight.append((slot, phase, now, key))
+                slot += 1
+                # Keep the cadence, but do not burst to catch up after a stall
+                next_send = max(next_send + self.interval, now)
+            
+            while in_flight:
+                probe_slot, phase, sent, key = in_flight[0]
+                reply = stream.results.pop(probe_slot, None)
+                if reply is None and now - sent < self.timeout:
+                    break
+                if reply is None:
+                    self.engine.forget_probe(stream, key)
+                    # The reply may have landed just before the probe was forgotten
+                    reply = stream.results.pop(probe_slot, None)
+                in_flight.popleft()
+                self.record(phase, reply['rtt_ms'] if reply else None)
+            
+            if self.stop_event.is_set():
+                # Stopped: only the replies of the probes in flight are still awaited
+                time.sleep(self.interval)
+            else:
+                self.stop_event.wait(max(next_send - time.monotonic(), 0))
+    
+    def sequential_loop(self):
+        """Sampler thread with pythonping: one probe at a time, every interval seconds"""
+        next_send = time.monotonic()
+        while not self.stop_event.is_set():
+            phase = self.phase
+            try:
+                replies = list(pythonping_ping(self.address, count=1, timeout=self.timeout))
+                reply = replies[0] if replies else None
+                self.record(phase, reply.time_elapsed_ms if reply and reply.success else None)
+            except Exception as e:
+                logger.debug(f"Latency probe to {self.address} failed: {e}")
+            next_send = max(next_send + self.interval, time.monotonic())
+            self.stop_event.wait(next_send - time.monotonic())
+    
+    def set_phase(self, phase):
+        """Tag probes sent from now on with phase"""
+        self.phase = phase
+    
+    def start(self, phase='idle'):
+        self.phase = phase
+        self.stop_event.clear()
+        self.thread = Thread(target=self.stream_loop if self.engine else self.sequential_loop,
+                             daemon=True, name='latency-sampler')
+        self.thread.start()
+    
+    def stop(self):
+        """Stop sampling, wait for the replies of the probes in flight and return the per-phase summary"""
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=self.timeout + 1)
+        return self.summary()
+    
+    def phase_stats(self, phase):
+        """Sample count, loss and RTT percentiles for one phase"""
+        with self.lock:
+            values = sorted(self.samples.get(phase, ()))
+            lost = self.lost.get(phase, 0)
+        return {
+            'samples': len(values),
+            'lost': lost,
+            'p50_ms': percentile(values, 0.5),
+            'p90_ms': percentile(values, 0.9),
+            'p99_ms': percentile(values, 0.99),
+            'max_ms': values[-1] if values else None
+        }
+    
+    def summary(self):
+        """
+        Stats per phase; transfer phases are graded on how far their median
+        rises above the idle median
+        """
+        with self.lock:
+            phases = list(self.samples.keys() | self.lost.keys())
+        stats = {phase: self.phase_stats(phase) for phase in phases}
+        idle = stats.get('idle', {}).get('p50_ms')
+        for phase, phase_stats in stats.items():
+            if phase != 'idle' and idle is not None and phase_stats['p50_ms'] is not None:
+                phase_stats['grade'] = bufferbloat_grade(phase_stats['p50_ms'] - idle)
+        return stats
+
+
+def resolve_address(host):
+    """Address to probe for a hostname or IP, preferring IPv4"""
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            return socket.getaddrinfo(host, None, family)[0][4][0]
+        except socket.gaierror:
+            continue
+    return None
@@ -0,0 +1,322 @@
+"""
+Prometheus/OpenMetrics exporter
+Serves the latest monitor results from the in-memory state store, plus the
+internal statistics of the scheduler, execution engine, caches and write
+path, over HTTP. Nothing is read from the database; a rendered page is
+reused for cache_seconds so concurrent scrapers cost one render.
+"""
+import time
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread, Lock
+from rollups import CONNECTION_STATUSES
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+# Metric name prefix
+PREFIX = 'netmon'
+
+# Fact table -> (metric subsystem, latency column of its histogram)
+LATENCY_HISTOGRAMS = {
+    'ping': ('ping_rtt', 'ping_ms'),
+    'dns_queries': ('dns_resolution', 'resolution_time_ms'),
+    'http_requests': ('http_total', 'total_time_ms'),
+}
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+class MetricsWriter:
+    """
+    Builds an OpenMetrics text page. Samples are kept per metric family, so a
+    family's samples stay together however they are added.
+    """
+    def __init__(self):
+        # Family name -> its TYPE/HELP lines and samples
+        self.families = {}
+    
+    def family(self, name, metric_type, help_text):
+        """Declare a family (once) and return its full name"""
+        name = f"{PREFIX}_{name}"
+        if name not in self.families:
+            self.families[name] = [f"# TYPE {name} {metric_type}", f"# HELP {name} {help_text}"]
+        return name
+    
+    def sample(self, family, value, labels=None, suffix=''):
+        """Add one sample to a family; None values and None labels are left out"""
+        if value is None:
+            return
+        label_text = ','.join(f'{key}="{_escape(label)}"' for key, label in (labels or {}).items()
+                              if label is not None)
+        if label_text:
+            self.families[family].append(f"{family}{suffix}{{{label_text}}} {_format_value(value)}")
+        else:
+            self.families[family].append(f"{family}{suffix} {_format_value(value)}")
+    
+    def gauge(self, name, help_text, value, labels=None):
+        self.sample(self.family(name, 'gauge', help_text), value, labels)
+    
+    def counter(self, name, help_text, value, labels=None):
+        self.sample(self.family(name, 'counter', help_text), value, labels, '_total')
+    
+    def render(self):
+        lines = [line for family in self.families.values() for line in family]
+        return ('\n'.join(lines) + '\n# EOF\n').encode()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        exporter = self.server.exporter
+        if self.path.split('?', 1)[0] != exporter.path:
+            self.send_error(404)
+            return
+        body = exporter.get_page()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsExporter:
+    """
+    HTTP endpoint for Prometheus scrapes. The components are optional: each
+    one given adds its metrics (the supervisor, agent and collector only
+    exist in their modes).
+    """
+    def __init__(self, config, db_manager, scheduler=None, execution_engine=None,
+                 resolution_cache=None, supervisor=None, agent=None, collector=None):
+        self.host = config.get('host', '0.0.0.0')
+        self.port = config.get('port', 9108)
+        self.path = config.get('path', '/metrics')
+        self.cache_seconds = config.get('cache_seconds', 5)
+        self.db_manager = db_manager
+        self.scheduler = scheduler
+        self.execution_engine = execution_engine
+        self.resolution_cache = resolution_cache
+        self.supervisor = supervisor
+        self.agent = agent
+        self.collector = collector
+        self.server = None
+        self.thread = None
+        # Held while rendering, so scrapers arriving meanwhile wait for that page
+        self.lock = Lock()
+        self.page = None
+        self.rendered_at = None
+        self.renders = 0
+        self.render_seconds = 0.0
+    
+    def get_page(self):
+        """The cached page, rendered again once it is cache_seconds old"""
+        with self.lock:
+            now = time.monotonic()
+            if self.page is None or now - self.rendered_at >= self.cache_seconds:
+                self.page = self.render()
+                self.rendered_at = time.monotonic()
+                self.renders += 1
+                self.render_seconds += self.rendered_at - now
+            return self.page
+    
+    def render(self):
+        """Render all metrics as an OpenMetrics page"""
+        writer = MetricsWriter()
+        state_store = getattr(self.db_manager, 'state_store', None)
+        if state_store:
+            self.add_results(writer, state_store)
+        self.add_internal(writer)
+        writer.counter('exporter_renders', "Pages rendered (scrapes within cache_seconds reuse a page)",
+                       self.renders)
+        writer.counter('exporter_render_seconds', "Time spent rendering pages", self.render_seconds)
+        return writer.render()
+    
+    def add_results(self, writer, state_store):
+        """Gauges of the newest result per series and the latency histograms"""
+        for row in state_store.latest('ping'):
+            labels = {'target': row['target'], 'agent': row['agent']}
+            writer.gauge('ping_rtt_seconds', "Average round trip time of the last ping test",
+                         row['ping_ms'] / 1000 if row['ping_ms'] is not None else None, labels)
+            writer.gauge('ping_jitter_seconds', "Jitter of the last ping test",
+                         row['jitter_ms'] / 1000 if row['jitter_ms'] is not None else None, labels)
+            writer.gauge('ping_packet_loss_percent', "Packet loss of the last ping test", row['packet_loss'], labels)
+            writer.gauge('ping_up', "Whether the target answered the last ping test", row['is_reachable'], labels)
+            name = writer.family('ping_connection_status', 'stateset', "Connection status of the last ping test")
+            if row['connection_status'] is not None:
+                for status in CONNECTION_STATUSES:
+                    writer.sample(name, status == row['connection_status'],
+                                  dict(labels, **{f"{PREFIX}_ping_connection_status": status}))
+            writer.gauge('ping_timestamp_seconds', "Time of the last ping test", row['unix_timestamp'] / 1000, labels)
+        
+        for row in state_store.latest('traceroute_runs'):
+            labels = {'target': row['target'], 'agent': row['agent']}
+            writer.gauge('traceroute_hops', "Hop count of the last traceroute", row['hop_count'], labels)
+            writer.gauge('traceroute_timeouts', "Timed out hops of the last traceroute", row['timeout_count'], labels)
+            writer.gauge('traceroute_route_changed', "Whether the last traceroute took a new path",
+                         row['route_changed'], labels)
+            writer.gauge('traceroute_timestamp_seconds', "Time of the last traceroute", row['unix_timestamp'] / 1000, labels)
+        
+        for row in state_store.latest('speedtest'):
+            labels = {'agent': row['agent']}
+            for column, direction in (('download_mbps', 'download'), ('upload_mbps', 'upload')):
+                writer.gauge(f"speedtest_{direction}_bits_per_second", f"Throughput of the last speed test {direction}",
+                             row[column] * 1e6 if row[column] is not None else None, labels)
+            writer.gauge('speedtest_ping_seconds', "Server latency of the last speed test",
+                         row['ping_ms'] / 1000 if row['ping_ms'] is not None else None, labels)
+            writer.gauge('speedtest_success', "Whether the last speed test succeeded", row['is_successful'], labels)
+            writer.gauge('speedtest_timestamp_seconds', "Time of the last speed test", row['unix_timestamp'] / 1000, labels)
+        
+        for row in state_store.latest('dns_queries'):
+            labels = {'domain': row['domain'], 'nameserver': row['nameserver'],
+                      'record_type': row['record_type'], 'agent': row['agent']}
+            writer.gauge('dns_resolution_seconds', "Resolution time of the last DNS query",
+                         row['resolution_time_ms'] / 1000 if row['resolution_time_ms'] is not None else None, labels)
+            writer.gauge('dns_success', "Whether the last DNS query succeeded", row['is_successful'], labels)
+            writer.gauge('dns_timestamp_seconds', "Time of the last DNS query", row['unix_timestamp'] / 1000, labels)
+        
+        for row in state_store.latest('http_requests'):
+            labels = {'url': row['url'], 'agent': row['agent']}
+            writer.gauge('http_total_seconds', "Total time of the last HTTP check",
+                         row['total_time_ms'] / 1000 if row['total_time_ms'] is not None else None, labels)
+            writer.gauge('http_ttfb_seconds', "Time to first byte of the last HTTP check",
+                         row['ttfb_ms'] / 1000 if row['ttfb_ms'] is not None else None, labels)
+            writer.gauge('http_status_code', "Status code of the last HTTP check", row['status_code'], labels)
+            writer.gauge('http_success', "Whether the last HTTP check succeeded", row['is_successful'], labels)
+            writer.gauge('http_timestamp_seconds', "Time of the last HTTP check", row['unix_timestamp'] / 1000, labels)
+        
+        for kind, (subsystem, column) in LATENCY_HISTOGRAMS.items():
+            name = writer.family(f"{subsystem}_distribution_seconds", 'histogram',
+                                 f"Distribution of {column} since start")
+            for series, bounds, cumulative, total, count in state_store.latency_histograms(kind):
+                labels = {key: value for key, value in series.items() if value is not None}
+                for bound, bucket_count in zip(bounds, cumulative):
+                    writer.sample(name, bucket_count, dict(labels, le=repr(bound / 1000)), '_bucket')
+                writer.sample(name, cumulative[-1], dict(labels, le='+Inf'), '_bucket')
+                writer.sample(name, count, labels, '_count')
+                writer.sample(name, total / 1000, labels, '_sum')
+    
+    def add_internal(self, writer):
+        """Counters and gauges of the monitor's own components"""
+        if self.scheduler:
+            by_monitor = {}
+            for job_name, job in self.scheduler.get_stats().items():
+                totals = by_monitor.setdefault(job_name.split(':', 1)[0], {'jobs': 0, 'runs': 0, 'skipped': 0, 'max_lag': 0.0})
+                totals['jobs'] += 1
+                totals['runs'] += job['runs']
+                totals['skipped'] += job['skipped']
+                totals['max_lag'] = max(totals['max_lag'], job['max_lag_seconds'] or 0.0)
+            for monitor, totals in by_monitor.items():
+                labels = {'monitor': monitor}
+                writer.gauge('scheduler_jobs', "Scheduled jobs", totals['jobs'], labels)
+                writer.counter('scheduler_runs', "Job runs", totals['runs'], labels)
+                writer.counter('scheduler_skipped', "Job runs skipped because the previous run was still going",
+                               totals['skipped'], labels)
+                writer.gauge('scheduler_max_lag_seconds', "Largest delay of a job start behind its slot",
+                             totals['max_lag'], labels)
+        
+        if self.execution_engine:
+            for monitor, queue in self.execution_engine.get_stats().items():
+                labels = {'monitor': monitor}
+                writer.gauge('engine_queued', "Work items waiting for a worker", queue['queued'], labels)
+                writer.gauge('engine_running', "Work items running", queue['running'], labels)
+                writer.counter('engine_completed', "Work items finished", queue['completed'], labels)
+                writer.counter('engine_failed', "Work items that raised", queue['failed'], labels)
+                writer.gauge('engine_max_wait_seconds', "Longest queue wait of a work item",
+                             queue['max_wait_seconds'], labels)
+        
+        if self.resolution_cache:
+            stats = self.resolution_cache.get_stats()
+            writer.gauge('resolution_cache_entries', "Cached hostnames", stats['entries'])
+            writer.counter('resolution_cache_hits', "Lookups answered from the cache", stats['hits'])
+            writer.counter('resolution_cache_misses', "Lookups that had to resolve", stats['misses'])
+            writer.counter('resolution_cache_refreshes', "Background refreshes", stats['refreshes'])
+            writer.counter('resolution_cache_failures', "Failed resolutions", stats['failures'])
+            writer.counter('resolution_cache_address_changes', "Address changes recorded", stats['address_changes'])
+        
+        write_behind = self.db_manager.get_write_behind_stats() if hasattr(self.db_manager, 'get_write_behind_stats') else None
+        if write_behind:
+            writer.gauge('write_behind_queue_depth', "Write batches waiting to be flushed", write_behind['queue_depth'])
+            writer.counter('write_behind_rows_flushed', "Rows written by the flusher", write_behind['rows_flushed'])
+            writer.counter('write_behind_rows_failed', "Rows the flusher could not write", write_behind['rows_failed'])
+            writer.counter('write_behind_sync_fallbacks', "Writes done synchronously because the queue was full",
+                           write_behind['sync_fallbacks'])
+            writer.gauge('write_behind_last_flush_seconds', "Duration of the last flush",
+                         write_behind['last_flush_latency_ms'] / 1000
+                         if write_behind['last_flush_latency_ms'] is not None else None)
+        
+        spool = self.db_manager.get_spool_stats() if hasattr(self.db_manager, 'get_spool_stats') else None
+        if spool:
+            writer.gauge('spool_pending_rows', "Rows spooled and not replayed yet", spool['pending_rows'])
+            writer.counter('spool_rows_spooled', "Rows written to the spool", spool['rows_spooled'])
+            writer.counter('spool_rows_replayed', "Rows replayed into the database", spool['rows_replayed'])
+            writer.counter('spool_rows_dropped', "Spooled rows rejected by the database on replay", spool['rows_dropped'])
+            writer.gauge('spool_outage', "Whether the database is considered unreachable", spool['outage'])
+        
+        state = self.db_manager.get_state_stats() if hasattr(self.db_manager, 'get_state_stats') else None
+        if state:
+            for kind, count in state['series'].items():
+                writer.gauge('state_store_series', "Series held in memory", count, {'table': kind})
+            writer.gauge('state_store_bytes', "Memory held by the ring buffers", state['bytes'])
+            writer.counter('state_store_samples', "Samples recorded", state['samples_appended'])
+        
+        if self.supervisor:
+            stats = self.supervisor.get_stats()
+            writer.counter('supervisor_forwarded_calls', "Database calls forwarded by workers", stats['forwarded_calls'])
+            writer.counter('supervisor_forwarded_messages', "Pipe messages (batches of calls) from workers",
+                           stats['forwarded_messages'])
+            for worker, worker_stats in stats['workers'].items():
+                labels = {'worker': worker}
+                writer.gauge('supervisor_worker_up', "Whether the worker process is alive", worker_stats['alive'], labels)
+                writer.counter('supervisor_worker_restarts', "Worker restarts", worker_stats['restarts'], labels)
+        
+        if self.agent:
+            stats = self.agent.get_stats()
+            writer.gauge('agent_connected', "Whether the agent is connected to the collector", stats['connected'])
+            writer.gauge('agent_buffered_records', "Records not cut into a batch yet", stats['buffered_records'])
+            writer.gauge('agent_unacked_records', "Records sent or waiting to be sent, not acked yet",
+                         stats['unacked_records'])
+            writer.counter('agent_records_acked', "Records acked by the collector", stats['records_acked'])
+            writer.counter('agent_records_dropped', "Records dropped from a full buffer", stats['records_dropped'])
+            writer.counter('agent_sent_bytes', "Compressed bytes sent", stats['bytes_sent'])
+        
+        if self.collector:
+            stats = self.collector.get_stats()
+            writer.counter('collector_connections', "Agent connections accepted", stats['connections'])
+            writer.counter('collector_duplicate_batches', "Resent batches acked without writing",
+                           stats['duplicate_batches'])
+            writer.counter('collector_failed_batches', "Batches that could not be written", stats['failed_batches'])
+            for agent, agent_stats in stats['agents'].items():
+                labels = {'agent': agent}
+                writer.counter('collector_agent_records', "Records received from the agent", agent_stats['records'], labels)
+                writer.gauge('collector_agent_last_seen_seconds', "Time of the agent's last batch",
+                             agent_stats['last_seen'], labels)
+    
+    def start(self):
+        """Start serving scrapes"""
+        self.server = ThreadingHTTPServer((self.host, self.port), _Handler)
+        self.server.daemon_threads = True
+        self.server.exporter = self
+        self.port = self.server.server_address[1]
+        self.thread = Thread(target=self.server.serve_forever, daemon=True, name='metrics-exporter')
+        self.thread.start()
+        logger.info(f"Metrics exporter listening on {self.host}:{self.port}{self.path}")
+    
+    def stop(self):
+        """Stop serving scrapes"""
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            logger.info(f"Metrics exporter stopped ({self.renders} pages rendered)")
@@ -1,19 +1,26 @@
 """
 Network Monitor - Main Application
 Monitors network connectivity using ping, traceroute, speedtest, DNS, and HTTP
-Stores results in MySQL database
+Stores results in MySQL (or an embedded SQLite database)
 """
 import sys
 import signal
 import logging
 import time
 from config_loader import load_config, validate_config
-from db_utils import DatabaseManager
+from db_utils import create_database_manager
+from agent import AgentDatabaseManager
 from ping_monitor import PingMonitor
 from traceroute_monitor import TracerouteMonitor
 from speedtest_monitor import SpeedTestMonitor
 from dns_monitor import DNSMonitor
 from http_monitor import HTTPMonitor
+from retention import RetentionManager
+from scheduler import Scheduler
+from execution_engine import ExecutionEngine
+from icmp_engine import IcmpEngine
+from resolution_cache import ResolutionCache
+from metrics_exporter import MetricsExporter
 
 # Configure logging
 logging.basicConfig(
@@ -29,14 +36,22 @@ logger = logging.getLogger(__name__)
 
 
 class NetworkMonitor:
-    def __init__(self, config_path='config.yaml'):
-        self.config = None
-        self.db_manager = None
+    def __init__(self, config_path='config.yaml', config=None, db_manager=None):
+        # A supervisor worker gets its shard of the configuration and a
+        # database manager forwarding to the supervisor's writer
+        self.config = config
+        self.db_manager = db_manager
+        self.scheduler = None
+        self.execution_engine = None
+        self.icmp_engine = None
+        self.resolution_cache = None
         self.ping_monitor = None
         self.traceroute_monitor = None
         self.speedtest_monitor = None
         self.dns_monitor = None
         self.http_monitor = None
+        self.retention_manager = None
+        self.metrics_exporter = None
         self.config_path = config_path
         self.running = False
     
@@ -47,7 +62,8 @@ class NetworkMonitor:
         logger.info("=" * 60)
         
         # Load configuration
-        self.config = load_config(self.config_path)
+        if self.config is None:
+            self.config = load_config(self.config_path)
         if not self.config:
             logger.error("Failed to load configuration")
             return False
@@ -57,30 +73,74 @@ class NetworkMonitor:
             logger.error("Configuration validation failed")
             return False
         
-        # Initialize database connection
-        self.db_manager = DatabaseManager(self.config['database'])
+        # Initialize database connection; an agent sends its results to a collector instead
+        agent_config = self.config.get('agent', {})
+        if self.db_manager is None and agent_config.get('enabled', False):
+            self.db_manager = AgentDatabaseManager(agent_config)
+        elif self.db_manager is None:
+            self.db_manager = create_database_manager(self.config['database'])
         if not self.db_manager.connect():
-            logger.error("Failed to connect to database")
-            return False
+            if not self.db_manager.spool:
+                logger.error("Failed to connect to database")
+                return False
+            logger.warning("Failed to connect to database, results will be spooled until it is reachable")
+            self.db_manager.spool.mark_outage()
+        
+        # Target hostnames are resolved through one TTL-aware cache
+        self.resolution_cache = ResolutionCache(self.config.get('resolution_cache', {}), self.db_manager)
+        self.resolution_cache.start()
+        
+        # Ping and traceroute share one ICMP engine (one receive socket per address family)
+        self.icmp_engine = IcmpEngine()
+        if not self.icmp_engine.start():
+            self.icmp_engine = None
         
-        # Initialize monitors
-        self.ping_monitor = PingMonitor(self.db_manager, self.config['ping'])
+        # Initialize monitors; their jobs all run on the shared scheduler and execution engine
+        self.execution_engine = ExecutionEngine(self.config.get('execution', {}))
+        self.scheduler = Scheduler(self.config.get('scheduler', {}), self.execution_engine)
+        self.ping_monitor = PingMonitor(self.db_manager, self.config['ping'], self.scheduler,
+                                        self.icmp_engine, self.resolution_cache)
         self.traceroute_monitor = TracerouteMonitor(
             self.db_manager, 
-            self.config['traceroute']
+            self.config['traceroute'],
+            self.scheduler,
+            self.icmp_engine,
+            self.resolution_cache
         )
         self.speedtest_monitor = SpeedTestMonitor(
             self.db_manager,
-            self.config['speedtest']
+            self.config['speedtest'],
+            self.scheduler,
+            self.icmp_engine,
+            self.resolution_cache
         )
         self.dns_monitor = DNSMonitor(
             self.db_manager,
-            self.config.get('dns', {'enabled': False})
+            self.config.get('dns', {'enabled': False}),
+            self.scheduler
         )
         self.http_monitor = HTTPMonitor(
             self.db_manager,
-            self.config.get('http', {'enabled': False})
+            self.config.get('http', {'enabled': False}),
+            self.scheduler,
+            self.resolution_cache
         )
+        # Agents have no database of their own to maintain
+        self.retention_manager = RetentionManager(
+            self.db_manager,
+            {'enabled': False} if agent_config.get('enabled', False) else self.config.get('retention', {'enabled': False})
+        )
+        
+        metrics_config = self.config.get('metrics', {})
+        if metrics_config.get('enabled', False):
+            self.metrics_exporter = MetricsExporter(
+                metrics_config,
+                self.db_manager,
+                scheduler=self.scheduler,
+                execution_engine=self.execution_engine,
+                resolution_cache=self.resolution_cache,
+                agent=self.db_manager if agent_config.get('enabled', False) else None
+            )
         
         logger.info("Initialization complete")
         return True
@@ -94,11 +154,16 @@ class NetworkMonitor:
         self.running = True
         
         # Start monitors
+        self.execution_engine.start()
+        self.scheduler.start()
         self.ping_monitor.start()
         self.traceroute_monitor.start()
         self.speedtest_monitor.start()
         self.dns_monitor.start()
         self.http_monitor.start()
+        self.retention_manager.start()
+        if self.metrics_exporter:
+            self.metrics_exporter.start()
         
         logger.info("=" * 60)
         logger.info("All monitors started successfully")
@@ -109,8 +174,9 @@ class NetworkMonitor:
         try:
             while self.running:
                 time.sleep(1)
-        except KeyboardInterrupt:
-            logger.info("Keyboard interrupt received")
+        except (KeyboardInterrupt, SystemExit):
+            # SIGTERM/SIGINT exit through signal_handler; stop() still drains pending writes
+            logger.info("Shutdown requested")
         
         self.stop()
         return True
@@ -123,6 +189,9 @@ class NetworkMonitor:
         
         self.running = False
         
+        if self.metrics_exporter:
+            self.metrics_exporter.stop()
+        
         # Stop monitors
         if self.ping_monitor:
             self.ping_monitor.stop()
@@ -139,6 +208,21 @@ class NetworkMonitor:
         if self.http_monitor:
             self.http_monitor.stop()
         
+        if self.scheduler:
+            self.scheduler.stop()
+        
+        if self.execution_engine:
+            self.execution_engine.stop()
+        
+        if self.icmp_engine:
+            self.icmp_engine.stop()
+        
+        if self.resolution_cache:
+            self.resolution_cache.stop()
+        
+        if self.retention_manager:
+            self.retention_manager.stop()
+        
         # Close database connection
         if self.db_manager:
             self.db_manager.disconnect()
@@ -159,8 +243,13 @@ def main():
     if hasattr(signal, 'SIGTERM'):
         signal.signal(signal.SIGTERM, signal_handler)
     
-    # Create and start monitor
-    monitor = NetworkMonitor()
+    # Create and start monitor, or a supervisor running it in worker processes
+    config = load_config('config.yaml')
+    if config and config.get('supervisor', {}).get('enabled', False):
+        from supervisor import Supervisor
+        monitor = Supervisor('config.yaml')
+    else:
+        monitor = NetworkMonitor()
     success = monitor.start()
     
     sys.exit(0 if success else 1)
@@ -7,25 +7,60 @@ import logging
 import statistics
 from datetime import datetime
 from pythonping import ping as pythonping_ping
-from threading import Thread, Event
+from threading import Event
+from icmp_engine import address_family
+from scheduler import target_entries
 
 logger = logging.getLogger(__name__)
 
+# Gain of the smoothed jitter estimate, as for RTP interarrival jitter (RFC 3550)
+JITTER_GAIN = 1 / 16
+
 
 class PingMonitor:
-    def __init__(self, db_manager, config):
+    def __init__(self, db_manager, config, scheduler, icmp_engine=None, resolver=None):
         self.db_manager = db_manager
         self.config = config
+        self.scheduler = scheduler
         self.stop_event = Event()
-        self.thread = None
+        # Shared multiplexed ICMP engine; None means targets are pinged one by one with pythonping
+        self.icmp_engine = icmp_engine
+        # Shared ResolutionCache; None means targets are resolved on every ping
+        self.resolver = resolver
+        self.engine = None
+        # Last (ping_ms, ewma_jitter_ms) per target for insert-time delta and jitter
+        self.last_sample = {}
     
     def resolve_hostname(self, target):
-        """Resolve hostname to IP address"""
+        """Resolve hostname to IP address (IPv4 preferred, IPv6 for v6-only names and literals)"""
+        if self.resolver:
+            return self.resolver.resolve(target)
         try:
             return socket.gethostbyname(target)
+        except socket.gaierror:
+            pass
+        try:
+            return socket.getaddrinfo(target, None, socket.AF_INET6)[0][4][0]
         except socket.gaierror:
             return None
     
+    def summarize_ping(self, ping_times, count):
+        """
+        Statistics over the successful round trip times of one test
+        Returns: (avg_ping_ms, min_ping_ms, max_ping_ms, jitter_ms, packet_loss, is_reachable)
+        """
+        success_count = len(ping_times)
+        packet_loss = ((count - success_count) / count) * 100
+        is_reachable = success_count > 0
+        
+        if not is_reachable:
+            return None, None, None, None, packet_loss, is_reachable
+        
+        # Calculate jitter as standard deviation
+        jitter_ms = statistics.stdev(ping_times) if success_count > 1 else 0.0
+        return (statistics.mean(ping_times), min(ping_times), max(ping_times),
+                jitter_ms, packet_loss, is_reachable)
+    
     def perform_ping(self, target, count=4, timeout=2):
         """
         Perform ping test and return results
@@ -34,35 +69,16 @@ class PingMonitor:
         try:
             # Resolve IP address
             ip_address = self.resolve_hostname(target)
+            if ip_address is None:
+                logger.error(f"Error pinging {target}: cannot resolve hostname")
+                return None, None, None, None, None, 100.0, False
             
-            # Perform ping
-            response = pythonping_ping(target, count=count, timeout=timeout)
-            
-            # Calculate statistics
-            success_count = sum(1 for r in response if r.success)
-            packet_loss = ((count - success_count) / count) * 100
-            is_reachable = success_count > 0
-            
-            # Calculate ping time statistics for successful pings
-            avg_ping_ms = None
-            min_ping_ms = None
-            max_ping_ms = None
-            jitter_ms = None
-            
-            if success_count > 0:
-                ping_times = [r.time_elapsed_ms for r in response if r.success]
-                avg_ping_ms = statistics.mean(ping_times)
-                min_ping_ms = min(ping_times)
-                max_ping_ms = max(ping_times)
-                
-                # Calculate jitter as standard deviation
-                if len(ping_times) > 1:
-                    jitter_ms = statistics.stdev(ping_times)
-                else:
-                    jitter_ms = 0.0
-            
-            return ip_address, avg_ping_ms, min_ping_ms, max_ping_ms, jitter_ms, packet_loss, is_reachable
+            # Perform ping (by address, so pythonping does not resolve the name again)
+            response = pythonping_ping(ip_address, count=count, timeout=timeout)
+            ping_times = [r.time_elapsed_ms for r in response if r.success]
             
+            return (ip_address,) + self.summarize_ping(ping_times, count)
+        
         except Exception as e:
             logger.error(f"Error pinging {target}: {e}")
             return None, None, None, None, None, 100.0, False
@@ -83,6 +99,29 @@ class PingMonitor:
         else:
             return 'excellent'
     
+    def update_jitter(self, target, ping_ms):
+        """
+        Delta from the previous sample and smoothed jitter for a new sample
+        Returns: (delta_ms, ewma_jitter_ms), both None if either sample is missing
+        """
+        if target not in self.last_sample:
+            self.last_sample[target] = self.db_manager.get_last_ping_sample(target)
+        if ping_ms is None:
+            return None, None
+        
+        previous = self.last_sample[target]
+        delta_ms = ewma_jitter_ms = None
+        if previous is not None:
+            previous_ping_ms, previous_jitter_ms = previous
+            delta_ms = abs(ping_ms - previous_ping_ms)
+            if previous_jitter_ms is None:
+                ewma_jitter_ms = delta_ms
+            else:
+                ewma_jitter_ms = previous_jitter_ms + (delta_ms - previous_jitter_ms) * JITTER_GAIN
+        
+        self.last_sample[target] = (ping_ms, ewma_jitter_ms)
+        return delta_ms, ewma_jitter_ms
+    
     def store_ping_result(self, target, ip_address, ping_ms, min_ping_ms, max_ping_ms, jitter_ms, packet_loss, is_reachable):
         """Store ping result in database"""
         now = datetime.now()
@@ -90,6 +129,7 @@ class PingMonitor:
         
         # Calculate connection status
         connection_status = self.calculate_connection_status(ping_ms, packet_loss, is_reachable)
+        delta_ms, ewma_jitter_ms = self.update_jitter(target, ping_ms)
         
         success = self.db_manager.insert_ping_result(
             timestamp=now,
@@ -102,7 +142,9 @@ class PingMonitor:
             jitter_ms=jitter_ms,
             packet_loss=packet_loss,
             is_reachable=is_reachable,
-            connection_status=connection_status
+            connection_status=connection_status,
+            delta_ms=delta_ms,
+            ewma_jitter_ms=ewma_jitter_ms
         )
         
         if success:
@@ -113,44 +155,83 @@ class PingMonitor:
         else:
             logger.error(f"Failed to store ping result for {target}")
     
-    def monitor_loop(self):
-        """Main monitoring loop"""
-        interval = self.config.get('interval_seconds', 10)
-        targets = self.config.get('targets', ['google.com'])
-        count = self.config.get('count', 4)
-        timeout = self.config.get('timeout_seconds', 2)
-        
-        logger.info(f"Starting ping monitor with {len(targets)} targets, "
-                   f"interval: {interval}s")
+    def ping_all(self, targets, count, timeout):
+        """
+        Ping every target concurrently through the ICMP engine
+        Targets whose address family the engine cannot use are pinged with pythonping.
+        Returns: {target: perform_ping-style result tuple}
+        """
+        addresses = {target: self.resolve_hostname(target) for target in targets}
+        multiplexed = {target: address for target, address in addresses.items()
+                       if address is None or self.engine.supports(address_family(address))}
         
-        while not self.stop_event.is_set():
+        rtts = self.engine.ping_many(multiplexed, count, timeout,
+                                     self.config.get('probe_interval_seconds', 0.2))
+        results = {}
+        for target in targets:
+            if target in rtts:
+                ping_times = [rtt for rtt in rtts[target] if rtt is not None]
+                results[target] = (addresses[target],) + self.summarize_ping(ping_times, count)
+            else:
+                results[target] = self.perform_ping(target, count, timeout)
+        return results
+    
+    def ping_job(self, targets, count, timeout):
+        """Scheduled job: ping a batch of targets and store the results"""
+        if self.engine:
+            results = self.ping_all(targets, count, timeout)
+        else:
+            results = {}
             for target in targets:
                 if self.stop_event.is_set():
                     break
-                
-                ip_address, ping_ms, min_ping_ms, max_ping_ms, jitter_ms, packet_loss, is_reachable = self.perform_ping(
-                    target, count, timeout
-                )
-                self.store_ping_result(target, ip_address, ping_ms, min_ping_ms, max_ping_ms, 
-                                      jitter_ms, packet_loss, is_reachable)
-            
-            # Wait for next interval
-            self.stop_event.wait(interval)
+                results[target] = self.perform_ping(target, count, timeout)
+        
+        for target, result in results.items():
+            ip_address, ping_ms, min_ping_ms, max_ping_ms, jitter_ms, packet_loss, is_reachable = result
+            self.store_ping_result(target, ip_address, ping_ms, min_ping_ms, max_ping_ms, 
+                                  jitter_ms, packet_loss, is_reachable)
     
     def start(self):
-        """Start monitoring in a separate thread"""
+        """Register the ping jobs with the scheduler"""
         if not self.config.get('enabled', True):
             logger.info("Ping monitor is disabled")
             return
         
-        self.thread = Thread(target=self.monitor_loop, daemon=True)
-        self.thread.start()
-        logger.info("Ping monitor started")
+        if self.config.get('engine', 'auto') == 'auto':
+            if self.icmp_engine:
+                self.engine = self.icmp_engine
+            else:
+                logger.warning("ICMP engine unavailable, pinging targets one by one with pythonping")
+        
+        interval = self.config.get('interval_seconds', 10)
+        targets = target_entries(self.config.get('targets', ['google.com']), 'target', interval)
+        count = self.config.get('count', 4)
+        timeout = self.config.get('timeout_seconds', 2)
+        # The engine pings a whole batch in about one timeout; pythonping needs a job per target
+        batch_size = self.config.get('batch_size', 100) if self.engine else 1
+        
+        by_interval = {}
+        for target, target_interval in targets:
+            by_interval.setdefault(target_interval, []).append(target)
+        
+        jobs = []
+        for target_interval, group in by_interval.items():
+            for i in range(0, len(group), batch_size):
+                batch = group[i:i + batch_size]
+                name = batch[0] if len(batch) == 1 else f"{batch[0]} +{len(batch) - 1}"
+                jobs.append((name, target_interval,
+                             lambda batch=batch: self.ping_job(batch, count, timeout)))
+        
+        self.scheduler.configure_monitor('ping', self.config.get('workers', 4),
+                                         self.config.get('priority', 0))
+        self.scheduler.add_jobs('ping', jobs)
+        logger.info(f"Ping monitor started with {len(targets)} targets, "
+                   f"engine: {'icmp' if self.engine else 'pythonping'}")
     
     def stop(self):
         """Stop monitoring"""
         logger.info("Stopping ping monitor...")
         self.stop_event.set()
-        if self.thread:
-            self.thread.join(timeout=5)
+        self.scheduler.remove_jobs('ping')
         logger.info("Ping monitor stopped")
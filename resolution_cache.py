@@ -0,0 +1,215 @@
+"""
+Shared hostname resolution cache
+Names are resolved once and served from memory for their DNS record TTL;
+a background thread refreshes them shortly before they expire, so monitors
+never wait on the resolver in their measurement path
+"""
+import time
+import socket
+import logging
+import ipaddress
+from datetime import datetime
+from threading import Thread, Event, Lock
+import dns.resolver
+import dns.exception
+
+logger = logging.getLogger(__name__)
+
+# family setting -> (record types, getaddrinfo families) in order of preference
+FAMILIES = {
+    'ipv4': (('A',), (socket.AF_INET,)),
+    'ipv6': (('AAAA',), (socket.AF_INET6,)),
+    'prefer_ipv4': (('A', 'AAAA'), (socket.AF_INET, socket.AF_INET6)),
+    'prefer_ipv6': (('AAAA', 'A'), (socket.AF_INET6, socket.AF_INET)),
+}
+
+
+def is_address(name):
+    """Whether name is an IP literal, which needs no resolution"""
+    try:
+        ipaddress.ip_address(name.split('%', 1)[0])
+        return True
+    except ValueError:
+        return False
+
+
+class _Entry:
+    __slots__ = ('address', 'expires', 'refresh_at', 'last_used')
+    
+    def __init__(self, address, expires, refresh_at, last_used):
+        self.address = address
+        self.expires = expires
+        self.refresh_at = refresh_at
+        self.last_used = last_used
+
+
+class ResolutionCache:
+    """
+    Name -> address cache honoring record TTLs (clamped to min/max_ttl_seconds).
+    Names missing from DNS (e.g. /etc/hosts entries) fall back to the system
+    resolver and are kept for default_ttl_seconds. A failed refresh keeps
+    serving the last good address, and so does a refresh whose address set
+    still contains it. Address changes are logged and, with a db_manager,
+    recorded in address_changes.
+    """
+    def __init__(self, config=None, db_manager=None):
+        config = config or {}
+        self.db_manager = db_manager
+        family = config.get('family', 'prefer_ipv4')
+        if family not in FAMILIES:
+            logger.warning(f"Unknown resolution family {family}, using prefer_ipv4")
+            family = 'prefer_ipv4'
+        self.record_types, self.families = FAMILIES[family]
+        self.min_ttl = config.get('min_ttl_seconds', 5)
+        self.max_ttl = config.get('max_ttl_seconds', 3600)
+        self.default_ttl = config.get('default_ttl_seconds', 300)
+        self.negative_ttl = config.get('negative_ttl_seconds', 30)
+        # Refresh once this fraction of the TTL has passed
+        self.refresh_ahead = config.get('refresh_ahead', 0.8)
+        # Names nobody looked up for this long are dropped instead of refreshed
+        self.idle_seconds = config.get('idle_seconds', 1800)
+        timeout = config.get('timeout_seconds', 5)
+        
+        self.resolver = dns.resolver.Resolver()
+        self.resolver.timeout = timeout
+        self.resolver.lifetime = timeout
+        self.lock = Lock()
+        self.stop_event = Event()
+        self.thread = None
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.failures = 0
+        self.changes = 0
+    
+    def query(self, name):
+        """
+        Resolve name now
+        Returns: (addresses of the name in answer order, empty if it does not resolve; ttl_seconds)
+        """
+        for record_type in self.record_types:
+            try:
+                answer = self.resolver.resolve(name, record_type)
+                ttl = min(max(answer.rrset.ttl, self.min_ttl), self.max_ttl)
+                return [str(record) for record in answer], ttl
+            except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+                continue
+            except dns.exception.DNSException as e:
+                logger.debug(f"DNS lookup of {name} failed: {e}")
+                break
+        
+        # Names outside DNS (hosts file, mDNS) or an unreachable resolver: ask the system, without a TTL
+        for family in self.families:
+            try:
+                addresses = [info[4][0] for info in socket.getaddrinfo(name, None, family)]
+                return list(dict.fromkeys(addresses)), self.default_ttl
+            except socket.gaierror:
+                continue
+        return [], self.negative_ttl
+    
+    def resolve(self, name):
+        """Address for name (IP literals are returned as is), or None if it does not resolve"""
+        if not name or is_address(name):
+            return name
+        
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is not None and now < entry.expires:
+                entry.last_used = now
+                self.hits += 1
+                return entry.address
+            self.misses += 1
+        
+        addresses, ttl = self.query(name)
+        return self._store(name, addresses, ttl)
+    
+    def _store(self, name, addresses, ttl):
+        """
+        Cache a lookup result and record address changes; returns the address now served.
+        Round-robin and CDN names rotate their records between lookups, so the
+        current address is kept while it is still among the name's addresses.
+        """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(name)
+            previous = entry.address if entry else None
+            if not addresses and previous is not None:
+                # Keep the last good address while the name fails to resolve
+                self.failures += 1
+                entry.refresh_at = now + self.negative_ttl
+                entry.expires = max(entry.expires, entry.refresh_at)
+                return previous
+        
+        if previous is None and addresses and self.db_manager:
+            # First lookup since start: continue from the last recorded address
+            previous = self.db_manager.get_last_address(name)
+        address = previous if previous in addresses else (addresses[0] if addresses else None)
+        with self.lock:
+            entry = self.entries.get(name)
+            self.entries[name] = _Entry(address, now + ttl, now + ttl * self.refresh_ahead,
+                                        entry.last_used if entry else now)
+        
+        if address is not None and address != previous:
+            self._record_change(name, previous, address)
+        return address
+    
+    def _record_change(self, name, previous, address):
+        """Log and store a new address for name"""
+        if previous is not None:
+            self.changes += 1
+            logger.warning(f"{name} now resolves to {address} (was {previous})")
+        if self.db_manager:
+            self.db_manager.insert_address_change(
+                timestamp=datetime.now(),
+                unix_timestamp=int(time.time() * 1000),
+                name=name,
+                previous_address=previous,
+                address=address
+            )
+    
+    def refresh_loop(self):
+        """Refresh entries that are about to expire and drop the ones no longer used"""
+        while not self.stop_event.wait(1.0):
+            now = time.monotonic()
+            with self.lock:
+                for name in [name for name, entry in self.entries.items()
+                             if now - entry.last_used > self.idle_seconds]:
+                    del self.entries[name]
+                due = [name for name, entry in self.entries.items() if entry.refresh_at <= now]
+            
+            for name in due:
+                if self.stop_event.is_set():
+                    return
+                addresses, ttl = self.query(name)
+                self.refreshes += 1
+                self._store(name, addresses, ttl)
+    
+    def get_stats(self):
+        """Return lookup counters and the hit rate"""
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else None,
+            'refreshes': self.refreshes,
+            'failures': self.failures,
+            'address_changes': self.changes
+        }
+    
+    def start(self):
+        """Start the background refresh thread"""
+        self.stop_event.clear()
+        self.thread = Thread(target=self.refresh_loop, daemon=True, name='resolution-cache')
+        self.thread.start()
+    
+    def stop(self):
+        """Stop refreshing"""
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=10)
+        stats = self.get_stats()
+        logger.info(f"Resolution cache stopped: {stats['hits']} hits, {stats['misses']} misses, "
+                   f"{stats['address_changes']} address changes")
@@ -0,0 +1,259 @@
+"""
+Data retention and partition maintenance
+Raw tables are RANGE partitioned on TO_DAYS(timestamp) so expiring data is a partition drop
+"""
+import time
+import logging
+from datetime import date, datetime, timedelta
+from threading import Thread, Event
+from dimensions import storage_table
+
+logger = logging.getLogger(__name__)
+
+# Raw measurement tables that are partitioned by day or week (fact views map
+# to their *_data storage tables through dimensions.storage_table)
+RAW_TABLES = ['ping', 'traceroute', 'traceroute_runs', 'speedtest', 'dns_queries', 'http_requests']
+
+ROLLUP_TABLES = ['ping_rollup', 'dns_rollup', 'http_rollup']
+
+DEFAULT_RETENTION_DAYS = {
+    'ping': 30,
+    'traceroute': 30,
+    'traceroute_runs': 30,
+    'speedtest': 365,
+    'dns_queries': 30,
+    'http_requests': 30
+}
+
+DEFAULT_ROLLUP_RETENTION_DAYS = {
+    '1m': 7,
+    '1h': 180,
+    '1d': None
+}
+
+# MySQL TO_DAYS() counts from year 0, Python ordinals from year 1
+TO_DAYS_OFFSET = 365
+
+
+def to_days(day):
+    """Python date -> MySQL TO_DAYS() value"""
+    return day.toordinal() + TO_DAYS_OFFSET
+
+
+def from_to_days(value):
+    """MySQL TO_DAYS() value -> Python date"""
+    return date.fromordinal(int(value) - TO_DAYS_OFFSET)
+
+
+def period_start(day, granularity='daily'):
+    """Start of the partition period containing day"""
+    if granularity == 'weekly':
+        return day - timedelta(days=day.weekday())
+    return day
+
+
+def period_length(granularity='daily'):
+    return timedelta(days=7 if granularity == 'weekly' else 1)
+
+
+def partition_name(start):
+    return f"p{start:%Y%m%d}"
+
+
+def partition_definitions(first_start, last_start, granularity='daily'):
+    """
+    Partition clauses for every period from first_start through last_start
+    Each partition is named after the first day it holds.
+    """
+    step = period_length(granularity)
+    definitions = []
+    start = first_start
+    while start <= last_start:
+        definitions.append(f"PARTITION {partition_name(start)} "
+                           f"VALUES LESS THAN ({to_days(start + step)})")
+        start += step
+    return definitions
+
+
+def partition_by_clause(first_start, last_start, granularity='daily'):
+    """PARTITION BY clause for converting a table to daily/weekly partitions"""
+    definitions = partition_definitions(first_start, last_start, granularity)
+    definitions.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+    return "PARTITION BY RANGE (TO_DAYS(timestamp)) (\n    " + ",\n    ".join(definitions) + "\n)"
+
+
+def split_pmax_query(table, first_start, last_start, granularity='daily'):
+    """ALTER TABLE splitting the catch-all pmax partition into daily/weekly partitions"""
+    definitions = partition_definitions(first_start, last_start, granularity)
+    definitions.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+    return f"ALTER TABLE {table} REORGANIZE PARTITION pmax INTO (" + ", ".join(definitions) + ")"
+
+
+class RetentionManager:
+    """
+    Periodic maintenance task: pre-creates future partitions and drops expired ones.
+    Backends without partition support (SQLite) fall back to chunked DELETEs.
+    """
+    def __init__(self, db_manager, config):
+        self.db_manager = db_manager
+        self.config = config
+        self.stop_event = Event()
+        self.thread = None
+        self.granularity = config.get('partition_granularity', 'daily')
+        self.precreate = config.get('precreate_partitions', 7)
+        # Retention is configured per table name, maintenance works on the storage tables
+        self.retention_days = {storage_table(table): days for table, days in
+                               dict(DEFAULT_RETENTION_DAYS, **(config.get('days') or {})).items()}
+        self.rollup_retention_days = dict(DEFAULT_ROLLUP_RETENTION_DAYS,
+                                          **(config.get('rollup_days') or {}))
+        self.delete_chunk_rows = config.get('delete_chunk_rows', 10000)
+        self.unpartitioned_warned = set()
+    
+    def get_partitions(self, table):
+        """Return [(name, upper_bound_date or None for MAXVALUE)] for a table, ordered"""
+        rows = self.db_manager.fetch_all("""
+            SELECT PARTITION_NAME AS name, PARTITION_DESCRIPTION AS description
+            FROM information_schema.PARTITIONS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL
+            ORDER BY PARTITION_ORDINAL_POSITION
+        """, (table,))
+        partitions = []
+        for row in rows:
+            description = row['description']
+            if description is None or str(description).upper() == 'MAXVALUE':
+                partitions.append((row['name'], None))
+            else:
+                partitions.append((row['name'], from_to_days(description)))
+        return partitions
+    
+    def create_future_partitions(self, table, partitions, today):
+        """Split pmax so partitions exist precreate periods ahead"""
+        step = period_length(self.granularity)
+        bounded = [upper for _, upper in partitions if upper is not None]
+        next_start = max(bounded) if bounded else period_start(today, self.granularity)
+        last_start = period_start(today, self.granularity) + step * self.precreate
+        if next_start > last_start:
+            return 0
+        
+        query = split_pmax_query(table, next_start, last_start, self.granularity)
+        if self.db_manager.execute_query(query):
+            created = (last_start - next_start) // step + 1
+            logger.info(f"Created {created} partitions on {table} through {last_start}")
+            return created
+        return 0
+    
+    def drop_expired_partitions(self, table, partitions, today):
+        """Drop partitions whose whole range is older than the retention period"""
+        days = self.retention_days.get(table)
+        if not days:
+            return 0
+        
+        cutoff = today - timedelta(days=days)
+        expired = [name for name, upper in partitions if upper is not None and upper <= cutoff]
+        if not expired:
+            return 0
+        
+        if self.db_manager.execute_query(f"ALTER TABLE {table} DROP PARTITION {', '.join(expired)}"):
+            logger.info(f"Dropped {len(expired)} expired partitions from {table} "
+                       f"(retention: {days} days)")
+            return len(expired)
+        return 0
+    
+    def delete_expired_rows(self, table):
+        """Chunked DELETE by id range for backends without partitions"""
+        days = self.retention_days.get(table)
+        if not days:
+            return 0
+        
+        cutoff_ms = int((time.time() - days * 86400) * 1000)
+        rows = self.db_manager.fetch_all(
+            f"SELECT MIN(id) AS first_id, MAX(id) AS last_id FROM {table} WHERE unix_timestamp < %s",
+            (cutoff_ms,)
+        )
+        first_id, last_id = rows[0]['first_id'], rows[0]['last_id']
+        if first_id is None:
+            return 0
+        
+        query = f"DELETE FROM {table} WHERE id BETWEEN %s AND %s AND unix_timestamp < %s"
+        chunks = 0
+        start = first_id
+        while start <= last_id and not self.stop_event.is_set():
+            end = min(start + self.delete_chunk_rows - 1, last_id)
+            if not self.db_manager.execute_query(query, (start, end, cutoff_ms)):
+                break
+            chunks += 1
+            start = end + 1
+        
+        logger.info(f"Expired rows older than {days} days from {table} ({chunks} chunks)")
+        return chunks
+    
+    def prune_rollups(self):
+        """Delete rollup buckets older than their granularity's retention"""
+        for granularity, days in self.rollup_retention_days.items():
+            if not days:
+                continue
+            cutoff = datetime.now() - timedelta(days=days)
+            for table in ROLLUP_TABLES:
+                self.db_manager.execute_query(
+                    f"DELETE FROM {table} WHERE granularity = %s AND bucket_start < %s",
+                    (granularity, cutoff)
+                )
+    
+    def maintain_table(self, table, today):
+        """Run partition maintenance (or row expiry) for one raw table"""
+        if not self.db_manager.supports_partitions:
+            self.delete_expired_rows(table)
+            return
+        
+        partitions = self.get_partitions(table)
+        if not partitions:
+            if table not in self.unpartitioned_warned:
+                logger.warning(f"Table {table} is not partitioned, run update_schema.py to convert it")
+                self.unpartitioned_warned.add(table)
+            return
+        
+        self.create_future_partitions(table, partitions, today)
+        self.drop_expired_partitions(table, self.get_partitions(table), today)
+    
+    def run_maintenance(self):
+        """Run one maintenance pass over all raw and rollup tables"""
+        today = date.today()
+        for table in RAW_TABLES:
+            if self.stop_event.is_set():
+                return
+            try:
+                self.maintain_table(storage_table(table), today)
+            except self.db_manager.unavailable_errors + self.db_manager.database_errors as e:
+                logger.error(f"Retention maintenance failed for {table}: {e}")
+        
+        try:
+            self.prune_rollups()
+        except self.db_manager.unavailable_errors + self.db_manager.database_errors as e:
+            logger.error(f"Rollup pruning failed: {e}")
+    
+    def maintenance_loop(self):
+        """Main maintenance loop"""
+        interval = self.config.get('interval_seconds', 3600)
+        logger.info(f"Starting retention maintenance, interval: {interval}s")
+        
+        while not self.stop_event.is_set():
+            self.run_maintenance()
+            self.stop_event.wait(interval)
+    
+    def start(self):
+        """Start maintenance in a separate thread"""
+        if not self.config.get('enabled', True):
+            logger.info("Retention maintenance is disabled")
+            return
+        
+        self.thread = Thread(target=self.maintenance_loop, daemon=True)
+        self.thread.start()
+        logger.info("Retention maintenance started")
+    
+    def stop(self):
+        """Stop maintenance"""
+        logger.info("Stopping retention maintenance...")
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=10)
+        logger.info("Retention maintenance stopped")
@@ -0,0 +1,262 @@
+"""
+Incrementally maintained rollups for ping, DNS and HTTP results
+Aggregates raw rows in memory and periodically upserts the deltas into rollup tables
+"""
+import logging
+from threading import Thread, Event, Lock
+
+logger = logging.getLogger(__name__)
+
+# Rollup granularity -> function truncating a timestamp to the start of its bucket
+GRANULARITIES = {
+    '1m': lambda ts: ts.replace(second=0, microsecond=0),
+    '1h': lambda ts: ts.replace(minute=0, second=0, microsecond=0),
+    '1d': lambda ts: ts.replace(hour=0, minute=0, second=0, microsecond=0),
+}
+
+CONNECTION_STATUSES = ('excellent', 'good', 'fair', 'poor', 'down')
+
+# agent_id of a rollup row from its agent name (the agents dimension row exists once
+# the agent's raw rows are written); local results, without an agent, use 0
+AGENT_ID_SQL = "COALESCE((SELECT agent_id FROM agents WHERE agent = %s), 0)"
+
+PING_ROLLUP_QUERY = """
+    INSERT INTO ping_rollup (granularity, bucket_start, target, agent_id, sample_count, reachable_count,
+                             latency_count, latency_sum, latency_min, latency_max, packet_loss_sum,
+                             status_excellent, status_good, status_fair, status_poor, status_down)
+    VALUES (%s, %s, %s, """ + AGENT_ID_SQL + """, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        sample_count = sample_count + VALUES(sample_count),
+        reachable_count = reachable_count + VALUES(reachable_count),
+        latency_count = latency_count + VALUES(latency_count),
+        latency_sum = latency_sum + VALUES(latency_sum),
+        latency_min = LEAST(COALESCE(latency_min, VALUES(latency_min)), COALESCE(VALUES(latency_min), latency_min)),
+        latency_max = GREATEST(COALESCE(latency_max, VALUES(latency_max)), COALESCE(VALUES(latency_max), latency_max)),
+        packet_loss_sum = packet_loss_sum + VALUES(packet_loss_sum),
+        status_excellent = status_excellent + VALUES(status_excellent),
+        status_good = status_good + VALUES(status_good),
+        status_fair = status_fair + VALUES(status_fair),
+        status_poor = status_poor + VALUES(status_poor),
+        status_down = status_down + VALUES(status_down)
+"""
+
+DNS_ROLLUP_QUERY = """
+    INSERT INTO dns_rollup (granularity, bucket_start, domain, nameserver, record_type, agent_id,
+                            query_count, success_count, resolution_sum, resolution_min, resolution_max)
+    VALUES (%s, %s, %s, %s, %s, """ + AGENT_ID_SQL + """, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        query_count = query_count + VALUES(query_count),
+        success_count = success_count + VALUES(success_count),
+        resolution_sum = resolution_sum + VALUES(resolution_sum),
+        resolution_min = LEAST(COALESCE(resolution_min, VALUES(resolution_min)), COALESCE(VALUES(resolution_min), resolution_min)),
+        resolution_max = GREATEST(COALESCE(resolution_max, VALUES(resolution_max)), COALESCE(VALUES(resolution_max), resolution_max))
+"""
+
+HTTP_ROLLUP_QUERY = """
+    INSERT INTO http_rollup (granularity, bucket_start, url, agent_id, request_count, success_count,
+                             total_time_sum, total_time_min, total_time_max, ttfb_sum,
+                             status_2xx, status_3xx, status_4xx, status_5xx, status_error)
+    VALUES (%s, %s, %s, """ + AGENT_ID_SQL + """, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        request_count = request_count + VALUES(request_count),
+        success_count = success_count + VALUES(success_count),
+        total_time_sum = total_time_sum + VALUES(total_time_sum),
+        total_time_min = LEAST(COALESCE(total_time_min, VALUES(total_time_min)), COALESCE(VALUES(total_time_min), total_time_min)),
+        total_time_max = GREATEST(COALESCE(total_time_max, VALUES(total_time_max)), COALESCE(VALUES(total_time_max), total_time_max)),
+        ttfb_sum = ttfb_sum + VALUES(ttfb_sum),
+        status_2xx = status_2xx + VALUES(status_2xx),
+        status_3xx = status_3xx + VALUES(status_3xx),
+        status_4xx = status_4xx + VALUES(status_4xx),
+        status_5xx = status_5xx + VALUES(status_5xx),
+        status_error = status_error + VALUES(status_error)
+"""
+
+
+def _update_min(current, value):
+    if value is None:
+        return current
+    return value if current is None else min(current, value)
+
+
+def _update_max(current, value):
+    if value is None:
+        return current
+    return value if current is None else max(current, value)
+
+
+def _merge_bucket(bucket, delta):
+    """Add the counts of delta to bucket"""
+    for field, value in delta.items():
+        if isinstance(value, dict):
+            for key, count in value.items():
+                bucket[field][key] += count
+        elif field.endswith('_min'):
+            bucket[field] = _update_min(bucket[field], value)
+        elif field.endswith('_max'):
+            bucket[field] = _update_max(bucket[field], value)
+        else:
+            bucket[field] += value
+
+
+class RollupAggregator:
+    """
+    Keeps 1-minute, 1-hour and 1-day aggregates per target (and agent) in memory.
+    Only the deltas since the last flush are held; the upsert adds them to the stored rollup.
+    A background thread flushes every flush_interval seconds; deltas of a failed
+    flush are merged back and sent with the next one.
+    """
+    def __init__(self, db_manager, config):
+        self.db_manager = db_manager
+        self.flush_interval = config.get('flush_interval_seconds', 60)
+        self.granularities = config.get('granularities', list(GRANULARITIES))
+        self.lock = Lock()
+        self.ping = {}
+        self.dns = {}
+        self.http = {}
+        self.stop_event = Event()
+        self.thread = None
+    
+    def _buckets(self, timestamp):
+        for granularity in self.granularities:
+            yield granularity, GRANULARITIES[granularity](timestamp)
+    
+    def add_ping(self, timestamp, target, ping_ms, packet_loss, is_reachable, connection_status, agent=None):
+        """Add one ping result to the in-memory rollups (agent: remote agent id, None for local results)"""
+        with self.lock:
+            for granularity, bucket_start in self._buckets(timestamp):
+                key = (granularity, bucket_start, target, agent)
+                bucket = self.ping.get(key)
+                if bucket is None:
+                    bucket = self.ping[key] = {
+                        'sample_count': 0, 'reachable_count': 0, 'latency_count': 0,
+                        'latency_sum': 0.0, 'latency_min': None, 'latency_max': None,
+                        'packet_loss_sum': 0.0, 'status': dict.fromkeys(CONNECTION_STATUSES, 0)
+                    }
+                bucket['sample_count'] += 1
+                if is_reachable:
+                    bucket['reachable_count'] += 1
+                if ping_ms is not None:
+                    bucket['latency_count'] += 1
+                    bucket['latency_sum'] += ping_ms
+                    bucket['latency_min'] = _update_min(bucket['latency_min'], ping_ms)
+                    bucket['latency_max'] = _update_max(bucket['latency_max'], ping_ms)
+                bucket['packet_loss_sum'] += packet_loss or 0.0
+                if connection_status in bucket['status']:
+                    bucket['status'][connection_status] += 1
+    
+    def add_dns(self, timestamp, domain, nameserver, record_type, resolution_time_ms, is_successful, agent=None):
+        """Add one DNS result to the in-memory rollups"""
+        with self.lock:
+            for granularity, bucket_start in self._buckets(timestamp):
+                key = (granularity, bucket_start, domain, nameserver, record_type, agent)
+                bucket = self.dns.get(key)
+                if bucket is None:
+                    bucket = self.dns[key] = {
+                        'query_count': 0, 'success_count': 0, 'resolution_sum': 0.0,
+                        'resolution_min': None, 'resolution_max': None
+                    }
+                bucket['query_count'] += 1
+                if is_successful and resolution_time_ms is not None:
+                    bucket['success_count'] += 1
+                    bucket['resolution_sum'] += resolution_time_ms
+                    bucket['resolution_min'] = _update_min(bucket['resolution_min'], resolution_time_ms)
+                    bucket['resolution_max'] = _update_max(bucket['resolution_max'], resolution_time_ms)
+    
+    def add_http(self, timestamp, url, total_time_ms, ttfb_ms, status_code, is_successful, agent=None):
+        """Add one HTTP result to the in-memory rollups"""
+        if status_code is None:
+            status_class = 'error'
+        else:
+            status_class = f"{min(max(status_code // 100, 2), 5)}xx"
+        
+        with self.lock:
+            for granularity, bucket_start in self._buckets(timestamp):
+                key = (granularity, bucket_start, url, agent)
+                bucket = self.http.get(key)
+                if bucket is None:
+                    bucket = self.http[key] = {
+                        'request_count': 0, 'success_count': 0, 'total_time_sum': 0.0,
+                        'total_time_min': None, 'total_time_max': None, 'ttfb_sum': 0.0,
+                        'status': {'2xx': 0, '3xx': 0, '4xx': 0, '5xx': 0, 'error': 0}
+                    }
+                bucket['request_count'] += 1
+                if is_successful and total_time_ms is not None:
+                    bucket['success_count'] += 1
+                    bucket['total_time_sum'] += total_time_ms
+                    bucket['ttfb_sum'] += ttfb_ms or 0.0
+                    bucket['total_time_min'] = _update_min(bucket['total_time_min'], total_time_ms)
+                    bucket['total_time_max'] = _update_max(bucket['total_time_max'], total_time_ms)
+                bucket['status'][status_class] += 1
+    
+    def flush(self):
+        """Upsert the pending deltas into the rollup tables"""
+        with self.lock:
+            ping, self.ping = self.ping, {}
+            dns, self.dns = self.dns, {}
+            http, self.http = self.http, {}
+        
+        statements = []
+        if ping:
+            statements.append((PING_ROLLUP_QUERY, [
+                key + (b['sample_count'], b['reachable_count'], b['latency_count'],
+                       b['latency_sum'], b['latency_min'], b['latency_max'], b['packet_loss_sum'])
+                + tuple(b['status'][status] for status in CONNECTION_STATUSES)
+                for key, b in ping.items()
+            ]))
+        if dns:
+            statements.append((DNS_ROLLUP_QUERY, [
+                key + (b['query_count'], b['success_count'], b['resolution_sum'],
+                       b['resolution_min'], b['resolution_max'])
+                for key, b in dns.items()
+            ]))
+        if http:
+            statements.append((HTTP_ROLLUP_QUERY, [
+                key + (b['request_count'], b['success_count'], b['total_time_sum'],
+                       b['total_time_min'], b['total_time_max'], b['ttfb_sum'],
+                       b['status']['2xx'], b['status']['3xx'], b['status']['4xx'],
+                       b['status']['5xx'], b['status']['error'])
+                for key, b in http.items()
+            ]))
+        
+        if not statements:
+            return True
+        
+        rows = sum(len(params_list) for _, params_list in statements)
+        success = self.db_manager.write(statements)
+        if success:
+            logger.debug(f"Flushed {rows} rollup rows")
+        else:
+            logger.error(f"Failed to flush {rows} rollup rows, keeping them for the next flush")
+            self._restore(ping, dns, http)
+        return success
+    
+    def _restore(self, ping, dns, http):
+        """Merge the deltas of a failed flush back into the pending ones"""
+        with self.lock:
+            for pending, failed in ((self.ping, ping), (self.dns, dns), (self.http, http)):
+                for key, delta in failed.items():
+                    bucket = pending.get(key)
+                    if bucket is None:
+                        pending[key] = delta
+                    else:
+                        _merge_bucket(bucket, delta)
+    
+    def flush_loop(self):
+        """Background flusher loop"""
+        while not self.stop_event.wait(self.flush_interval):
+            self.flush()
+    
+    def start(self):
+        """Start the flusher thread"""
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = Thread(target=self.flush_loop, daemon=True, name='rollup-flusher')
+        self.thread.start()
+    
+    def stop(self):
+        """Stop the flusher thread and write the pending deltas"""
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=10)
+        return self.flush()
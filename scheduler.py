@@ -0,0 +1,249 @@
+"""
+Shared job scheduler
+Fires every monitor job on a fixed wall-clock cadence, spreads job start phases
+across the interval and records how late each run started
+"""
+import time
+import heapq
+import logging
+import asyncio
+import itertools
+from threading import Thread, Event, Lock
+from execution_engine import ExecutionEngine
+
+logger = logging.getLogger(__name__)
+
+
+def target_entries(items, key, default_interval):
+    """
+    Normalize a target list whose entries are names or dicts with an interval override
+    e.g. ["google.com", {"target": "8.8.8.8", "interval_seconds": 5}]
+    Returns: [(name, interval_seconds)]
+    """
+    entries = []
+    for item in items:
+        if isinstance(item, dict):
+            entries.append((item[key], item.get('interval_seconds', default_interval)))
+        else:
+            entries.append((item, default_interval))
+    return entries
+
+
+def next_slot(scheduled, interval, now):
+    """
+    First slot on the grid scheduled + k * interval that is later than now
+    Returns: (next_run, slots missed in between)
+    """
+    missed = max(0, int((now - scheduled) // interval))
+    return scheduled + (missed + 1) * interval, missed
+
+
+class Job:
+    """One recurring unit of work, e.g. a traceroute to one target"""
+    def __init__(self, monitor, name, interval, func, phase):
+        self.monitor = monitor
+        self.name = name
+        self.interval = interval
+        self.func = func
+        # Coroutine jobs run on the engine's event loop instead of a pool worker
+        self.is_coroutine = asyncio.iscoroutinefunction(func)
+        self.phase = phase
+        self.next_run = None
+        self.running = False
+        self.cancelled = False
+        self.runs = 0
+        self.skipped = 0
+        self.last_lag = None
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+    
+    def first_run(self, now):
+        """First run on the wall-clock grid: multiples of the interval since the epoch plus the phase"""
+        start = now - now % self.interval + self.phase
+        return start if start >= now else start + self.interval
+
+
+class Scheduler:
+    """
+    Dispatcher thread handing due jobs to the shared ExecutionEngine, which runs
+    them within each monitor's concurrency limit and priority.
+    Runs are anchored to the grid, so work time never shifts later runs; a run that is
+    still busy when its next slot comes up makes that slot be skipped and counted.
+    """
+    def __init__(self, config=None, execution_engine=None):
+        config = config or {}
+        self.lag_warning = config.get('lag_warning_seconds', 1.0)
+        self.stats_log_interval = config.get('stats_log_interval_seconds', 300)
+        # Without a shared engine the scheduler runs (and stops) its own
+        self.owns_engine = execution_engine is None
+        self.execution_engine = execution_engine or ExecutionEngine()
+        self.lock = Lock()
+        self.wakeup = Event()
+        self.stop_event = Event()
+        self.thread = None
+        self.heap = []
+        self.counter = itertools.count()
+        self.jobs = []
+    
+    def configure_monitor(self, monitor, concurrency=1, priority=1):
+        """Set how many of a monitor's jobs may run at once and their priority (0 = most urgent)"""
+        self.execution_engine.configure(monitor, concurrency, priority)
+    
+    def add_jobs(self, monitor, jobs):
+        """
+        Register a monitor's jobs: [(name, interval_seconds, func)]
+        func may be a coroutine function, which is run on the engine's event loop.
+        Jobs sharing an interval get start phases spread evenly across it.
+        """
+        by_interval = {}
+        for name, interval, func in jobs:
+            by_interval.setdefault(interval, []).append((name, func))
+        
+        now = time.time()
+        with self.lock:
+            for interval, group in by_interval.items():
+                for i, (name, func) in enumerate(group):
+                    job = Job(monitor, name, interval, func, interval * i / len(group))
+                    job.next_run = job.first_run(now)
+                    self.jobs.append(job)
+                    heapq.heappush(self.heap, (job.next_run, next(self.counter), job))
+        self.wakeup.set()
+        logger.info(f"Scheduled {len(jobs)} {monitor} jobs "
+                   f"(intervals: {', '.join(f'{i}s' for i in sorted(by_interval))})")
+    
+    def remove_jobs(self, monitor):
+        """Cancel a monitor's jobs; runs already in progress finish on their own"""
+        with self.lock:
+            for job in self.jobs:
+                if job.monitor == monitor:
+                    job.cancelled = True
+            self.jobs = [job for job in self.jobs if not job.cancelled]
+    
+    def _dispatch(self, job, now):
+        """Hand a due job to the execution engine and schedule its next slot"""
+        scheduled = job.next_run
+        if job.running:
+            job.skipped += 1
+            logger.warning(f"{job.monitor} job {job.name} is still running, skipping its run")
+        else:
+            job.running = True
+            if job.is_coroutine:
+                self.execution_engine.run_coroutine(self.run_async_job(job, scheduled))
+            else:
+                self.execution_engine.submit(job.monitor, self.run_job, job, scheduled)
+        
+        job.next_run, missed = next_slot(scheduled, job.interval, now)
+        if missed:
+            job.skipped += missed
+            logger.warning(f"{job.monitor} job {job.name} fell {missed} runs behind schedule")
+        heapq.heappush(self.heap, (job.next_run, next(self.counter), job))
+    
+    def dispatch_loop(self):
+        """Dispatcher thread: wait for the earliest due job and hand it to the engine"""
+        last_stats_log = time.monotonic()
+        while not self.stop_event.is_set():
+            now = time.time()
+            with self.lock:
+                while self.heap and self.heap[0][0] <= now:
+                    _, _, job = heapq.heappop(self.heap)
+                    if not job.cancelled:
+                        self._dispatch(job, now)
+                delay = self.heap[0][0] - now if self.heap else 1.0
+            
+            if time.monotonic() - last_stats_log >= self.stats_log_interval:
+                self.log_stats()
+                last_stats_log = time.monotonic()
+            
+            self.wakeup.wait(min(delay, 1.0))
+            self.wakeup.clear()
+    
+    def _record_start(self, job, scheduled):
+        """Record how late a run started; returns False if the job was cancelled meanwhile"""
+        if job.cancelled:
+            job.running = False
+            return False
+        lag = max(0.0, time.time() - scheduled)
+        job.runs += 1
+        job.last_lag = lag
+        job.total_lag += lag
+        job.max_lag = max(job.max_lag, lag)
+        if lag > self.lag_warning:
+            logger.warning(f"{job.monitor} job {job.name} started {lag:.2f}s late")
+        return True
+    
+    def run_job(self, job, scheduled):
+        """Run one job on an engine worker"""
+        if not self._record_start(job, scheduled):
+            return
+        try:
+            job.func()
+        except Exception as e:
+            logger.error(f"{job.monitor} job {job.name} failed: {e}")
+        finally:
+            job.running = False
+    
+    async def run_async_job(self, job, scheduled):
+        """Run one coroutine job on the engine's event loop"""
+        if not self._record_start(job, scheduled):
+            return
+        try:
+            await job.func()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"{job.monitor} job {job.name} failed: {e}")
+        finally:
+            job.running = False
+    
+    def get_stats(self):
+        """Return per-job run counts and schedule lag"""
+        with self.lock:
+            jobs = list(self.jobs)
+        return {
+            f"{job.monitor}:{job.name}": {
+                'interval_seconds': job.interval,
+                'runs': job.runs,
+                'skipped': job.skipped,
+                'last_lag_seconds': job.last_lag,
+                'max_lag_seconds': job.max_lag,
+                'avg_lag_seconds': job.total_lag / job.runs if job.runs else None
+            }
+            for job in jobs
+        }
+    
+    def log_stats(self):
+        """Log the schedule lag per monitor"""
+        with self.lock:
+            jobs = list(self.jobs)
+        by_monitor = {}
+        for job in jobs:
+            by_monitor.setdefault(job.monitor, []).append(job)
+        for monitor, monitor_jobs in by_monitor.items():
+            runs = sum(job.runs for job in monitor_jobs)
+            if not runs:
+                continue
+            avg_lag = sum(job.total_lag for job in monitor_jobs) / runs
+            max_lag = max(job.max_lag for job in monitor_jobs)
+            skipped = sum(job.skipped for job in monitor_jobs)
+            logger.info(f"Scheduler {monitor}: {runs} runs, lag avg {avg_lag * 1000:.1f}ms, "
+                       f"max {max_lag * 1000:.1f}ms, {skipped} skipped")
+    
+    def start(self):
+        """Start the dispatcher thread"""
+        if self.owns_engine:
+            self.execution_engine.start()
+        self.stop_event.clear()
+        self.thread = Thread(target=self.dispatch_loop, daemon=True, name='scheduler')
+        self.thread.start()
+        logger.info("Scheduler started")
+    
+    def stop(self):
+        """Stop dispatching; runs already handed to the engine finish there"""
+        logger.info("Stopping scheduler...")
+        self.stop_event.set()
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+        if self.owns_engine:
+            self.execution_engine.stop()
+        logger.info("Scheduler stopped")
@@ -2,26 +2,96 @@
 CREATE DATABASE IF NOT EXISTS network_monitor;
 USE network_monitor;
 
+-- Raw measurement tables are RANGE partitioned by day (or week) on timestamp so
+-- that expiring data is a partition drop. They start with a single catch-all
+-- partition; the retention task in NetworkMonitor (retention.py) splits it into
+-- daily/weekly partitions ahead of time and drops expired ones. Partitioning
+-- requires timestamp in the primary key.
+--
+-- Targets, domains, nameservers, URLs and speed test servers are stored once in
+-- dimension tables; the raw *_data tables reference them by small integer ids
+-- and views under the original table names (ping, speedtest, ...) join the
+-- names back for queries. See dimensions.py.
+
+-- Dimension tables
+CREATE TABLE IF NOT EXISTS targets (
+    target_id SMALLINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    target VARCHAR(255) NOT NULL,
+    UNIQUE KEY uk_target (target)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS domains (
+    domain_id SMALLINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    domain VARCHAR(255) NOT NULL,
+    UNIQUE KEY uk_domain (domain)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS nameservers (
+    nameserver_id SMALLINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    nameserver VARCHAR(45) NOT NULL,
+    UNIQUE KEY uk_nameserver (nameserver)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS urls (
+    url_id INT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    url VARCHAR(500) NOT NULL,
+    UNIQUE KEY uk_url (url)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS speedtest_servers (
+    server_id SMALLINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    server_name VARCHAR(255) NOT NULL,  -- '' when unknown
+    server_location VARCHAR(255) NOT NULL,
+    server_country VARCHAR(100) NOT NULL,
+    UNIQUE KEY uk_server (server_name, server_location, server_country)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Remote probe agents (collector mode, see collector.py)
+CREATE TABLE IF NOT EXISTS agents (
+    agent_id SMALLINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    agent VARCHAR(255) NOT NULL,
+    UNIQUE KEY uk_agent (agent)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Last batch the collector wrote per agent, in the same transaction as the
+-- batch's rows, so a batch resent after a collector restart is not written twice
+CREATE TABLE IF NOT EXISTS agent_batches (
+    agent VARCHAR(255) NOT NULL PRIMARY KEY,
+    session VARCHAR(64) NOT NULL,
+    last_seq BIGINT NOT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
 -- Ping monitoring table
-CREATE TABLE IF NOT EXISTS ping (
-    id INT AUTO_INCREMENT PRIMARY KEY,
+CREATE TABLE IF NOT EXISTS ping_data (
+    id BIGINT NOT NULL AUTO_INCREMENT,
     timestamp DATETIME(3) NOT NULL,
     unix_timestamp BIGINT NOT NULL,
-    target VARCHAR(255) NOT NULL,
+    target_id SMALLINT UNSIGNED NOT NULL,
     ip_address VARCHAR(45),
     ping_ms FLOAT,
+    min_ping_ms FLOAT,
+    max_ping_ms FLOAT,
+    jitter_ms FLOAT,
+    delta_ms FLOAT,  -- |ping_ms - previous ping_ms| for the same target
+    ewma_jitter_ms FLOAT,  -- Smoothed interarrival jitter (RFC 3550, gain 1/16)
     packet_loss FLOAT,
     is_reachable BOOLEAN NOT NULL,
     connection_status ENUM('excellent', 'good', 'fair', 'poor', 'down') NOT NULL,
+    agent_id SMALLINT UNSIGNED,  -- Remote agent the row came from, NULL for local results
+    PRIMARY KEY (id, timestamp),
     INDEX idx_timestamp (timestamp),
-    INDEX idx_target (target),
     INDEX idx_unix_timestamp (unix_timestamp),
+    INDEX idx_target_unix_timestamp (target_id, unix_timestamp),
     INDEX idx_connection_status (connection_status)
-) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+PARTITION BY RANGE (TO_DAYS(timestamp)) (
+    PARTITION pmax VALUES LESS THAN MAXVALUE
+);
 
--- Traceroute monitoring table
+-- Traceroute hop table (one row per hop per run, written by older versions;
+-- new runs are stored in traceroute_runs and traceroute_paths below)
 CREATE TABLE IF NOT EXISTS traceroute (
-    id INT AUTO_INCREMENT PRIMARY KEY,
+    id BIGINT NOT NULL AUTO_INCREMENT,
     trace_id VARCHAR(36) NOT NULL,  -- UUID to group hops from same traceroute
     timestamp DATETIME(3) NOT NULL,
     unix_timestamp BIGINT NOT NULL,
@@ -33,20 +103,64 @@ CREATE TABLE IF NOT EXISTS traceroute (
     packets_sent INT NOT NULL,
     packets_received INT NOT NULL,
     is_timeout BOOLEAN NOT NULL,
+    PRIMARY KEY (id, timestamp),
     INDEX idx_trace_id (trace_id),
     INDEX idx_timestamp (timestamp),
     INDEX idx_target (target),
     INDEX idx_hop_number (hop_number)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+PARTITION BY RANGE (TO_DAYS(timestamp)) (
+    PARTITION pmax VALUES LESS THAN MAXVALUE
+);
+
+-- Distinct traceroute paths, keyed by a hash of the ordered hop IPs
+CREATE TABLE IF NOT EXISTS traceroute_paths (
+    path_id BIGINT NOT NULL PRIMARY KEY,
+    hop_count INT NOT NULL,
+    hop_ips TEXT NOT NULL,  -- Hop IPs joined with '>', '*' for timeouts
+    first_seen DATETIME(3) NOT NULL,
+    first_unix_timestamp BIGINT NOT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Hops of each distinct path, written once when the path first appears
+CREATE TABLE IF NOT EXISTS traceroute_path_hops (
+    path_id BIGINT NOT NULL,
+    hop_index INT NOT NULL,  -- 1-based position in the path and in traceroute_runs.rtt_ms
+    hop_number INT NOT NULL,
+    hop_ip VARCHAR(45),
+    hop_hostname VARCHAR(255),
+    PRIMARY KEY (path_id, hop_index)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
+-- One row per traceroute run
+CREATE TABLE IF NOT EXISTS traceroute_runs_data (
+    id BIGINT NOT NULL AUTO_INCREMENT,
+    trace_id VARCHAR(36) NOT NULL,
+    timestamp DATETIME(3) NOT NULL,
+    unix_timestamp BIGINT NOT NULL,
+    target_id SMALLINT UNSIGNED NOT NULL,
+    path_id BIGINT NOT NULL,
+    previous_path_id BIGINT,
+    route_changed BOOLEAN NOT NULL,
+    hop_count INT NOT NULL,
+    timeout_count INT NOT NULL,
+    rtt_ms JSON NOT NULL,  -- Average RTT per hop in path order, null for timeouts
+    agent_id SMALLINT UNSIGNED,  -- Remote agent the row came from, NULL for local results
+    PRIMARY KEY (id, timestamp),
+    INDEX idx_timestamp (timestamp),
+    INDEX idx_target_unix_timestamp (target_id, unix_timestamp),
+    INDEX idx_route_changed (route_changed, unix_timestamp)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+PARTITION BY RANGE (TO_DAYS(timestamp)) (
+    PARTITION pmax VALUES LESS THAN MAXVALUE
+);
+
 -- Speed test monitoring table
-CREATE TABLE IF NOT EXISTS speedtest (
-    id INT AUTO_INCREMENT PRIMARY KEY,
+CREATE TABLE IF NOT EXISTS speedtest_data (
+    id BIGINT NOT NULL AUTO_INCREMENT,
     timestamp DATETIME(3) NOT NULL,
     unix_timestamp BIGINT NOT NULL,
-    server_name VARCHAR(255),
-    server_location VARCHAR(255),
-    server_country VARCHAR(100),
+    server_id SMALLINT UNSIGNED NOT NULL,
     download_mbps FLOAT,
     upload_mbps FLOAT,
     ping_ms FLOAT,
@@ -54,9 +168,213 @@ CREATE TABLE IF NOT EXISTS speedtest (
     packet_loss FLOAT,
     isp VARCHAR(255),
     external_ip VARCHAR(45),
+    idle_latency_ms FLOAT,
+    download_latency_ms FLOAT,
+    upload_latency_ms FLOAT,
+    bufferbloat_rating VARCHAR(1),
     test_duration_seconds FLOAT,
+    discovery_seconds FLOAT,       -- Config fetch and server selection
+    measurement_seconds FLOAT,     -- Download and upload tests
+    latency_phases JSON,           -- Latency samples, loss, percentiles and grade per idle/download/upload phase
     is_successful BOOLEAN NOT NULL,
     error_message TEXT,
+    agent_id SMALLINT UNSIGNED,  -- Remote agent the row came from, NULL for local results
+    PRIMARY KEY (id, timestamp),
     INDEX idx_timestamp (timestamp),
     INDEX idx_unix_timestamp (unix_timestamp)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+PARTITION BY RANGE (TO_DAYS(timestamp)) (
+    PARTITION pmax VALUES LESS THAN MAXVALUE
+);
+
+-- DNS monitoring table
+CREATE TABLE IF NOT EXISTS dns_queries_data (
+    id BIGINT NOT NULL AUTO_INCREMENT,
+    timestamp DATETIME(3) NOT NULL,
+    unix_timestamp BIGINT NOT NULL,
+    domain_id SMALLINT UNSIGNED NOT NULL,
+    nameserver_id SMALLINT UNSIGNED NOT NULL,
+    record_type VARCHAR(10) NOT NULL,
+    resolution_time_ms FLOAT,
+    answer_set_id BIGINT,  -- References dns_answer_sets, NULL when the query failed
+    is_successful BOOLEAN NOT NULL,
+    error_message TEXT,
+    agent_id SMALLINT UNSIGNED,  -- Remote agent the row came from, NULL for local results
+    PRIMARY KEY (id, timestamp),
+    INDEX idx_timestamp (timestamp),
+    INDEX idx_unix_timestamp (unix_timestamp),
+    INDEX idx_query_key (domain_id, nameserver_id, record_type, unix_timestamp)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+PARTITION BY RANGE (TO_DAYS(timestamp)) (
+    PARTITION pmax VALUES LESS THAN MAXVALUE
+);
+
+-- Distinct DNS answer sets, keyed by a hash of the sorted answers
+CREATE TABLE IF NOT EXISTS dns_answer_sets (
+    answer_set_id BIGINT NOT NULL PRIMARY KEY,
+    answer_count INT NOT NULL,
+    answers TEXT NOT NULL,  -- Sorted answers joined with ','
+    first_seen DATETIME(3) NOT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- One row each time a domain's answer set differs from the previous one
+CREATE TABLE IF NOT EXISTS dns_answer_changes (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    timestamp DATETIME(3) NOT NULL,
+    unix_timestamp BIGINT NOT NULL,
+    domain VARCHAR(255) NOT NULL,
+    nameserver VARCHAR(45) NOT NULL,
+    record_type VARCHAR(10) NOT NULL,
+    previous_answer_set_id BIGINT,
+    answer_set_id BIGINT NOT NULL,
+    INDEX idx_timestamp (timestamp),
+    INDEX idx_domain (domain, unix_timestamp)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Address history of monitored hostnames (ping, traceroute and HTTP targets)
+-- previous_address is NULL for the first address seen
+CREATE TABLE IF NOT EXISTS address_changes (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    timestamp DATETIME(3) NOT NULL,
+    unix_timestamp BIGINT NOT NULL,
+    name VARCHAR(255) NOT NULL,
+    previous_address VARCHAR(45),
+    address VARCHAR(45) NOT NULL,
+    agent VARCHAR(255),  -- Remote agent that resolved the name, NULL for local lookups
+    INDEX idx_timestamp (timestamp),
+    INDEX idx_name (name, unix_timestamp)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- HTTP monitoring table
+CREATE TABLE IF NOT EXISTS http_requests_data (
+    id BIGINT NOT NULL AUTO_INCREMENT,
+    timestamp DATETIME(3) NOT NULL,
+    unix_timestamp BIGINT NOT NULL,
+    url_id INT UNSIGNED NOT NULL,
+    dns_time_ms FLOAT,
+    connect_time_ms FLOAT,
+    tls_time_ms FLOAT,
+    ttfb_ms FLOAT,
+    total_time_ms FLOAT,
+    status_code INT,
+    response_size INT,
+    tls_version VARCHAR(20),
+    is_successful BOOLEAN NOT NULL,
+    error_message TEXT,
+    -- 'cold': new connection per check, 'warm': reused keep-alive connection
+    measurement_mode ENUM('cold', 'warm') NOT NULL DEFAULT 'cold',
+    agent_id SMALLINT UNSIGNED,  -- Remote agent the row came from, NULL for local results
+    PRIMARY KEY (id, timestamp),
+    INDEX idx_timestamp (timestamp),
+    INDEX idx_url_unix_timestamp (url_id, unix_timestamp),
+    INDEX idx_unix_timestamp (unix_timestamp),
+    INDEX idx_status_code (status_code)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+PARTITION BY RANGE (TO_DAYS(timestamp)) (
+    PARTITION pmax VALUES LESS THAN MAXVALUE
+);
+
+-- Views under the original table names, joining the dimension names back
+CREATE OR REPLACE VIEW ping AS
+SELECT p.id, p.timestamp, p.unix_timestamp, t.target, p.target_id, p.ip_address,
+       p.ping_ms, p.min_ping_ms, p.max_ping_ms, p.jitter_ms, p.delta_ms, p.ewma_jitter_ms,
+       p.packet_loss, p.is_reachable, p.connection_status, p.agent_id, a.agent
+FROM ping_data p
+JOIN targets t ON t.target_id = p.target_id
+LEFT JOIN agents a ON a.agent_id = p.agent_id;
+
+CREATE OR REPLACE VIEW traceroute_runs AS
+SELECT r.id, r.trace_id, r.timestamp, r.unix_timestamp, t.target, r.target_id, r.path_id,
+       r.previous_path_id, r.route_changed, r.hop_count, r.timeout_count, r.rtt_ms,
+       r.agent_id, a.agent
+FROM traceroute_runs_data r
+JOIN targets t ON t.target_id = r.target_id
+LEFT JOIN agents a ON a.agent_id = r.agent_id;
+
+CREATE OR REPLACE VIEW speedtest AS
+SELECT s.id, s.timestamp, s.unix_timestamp, NULLIF(v.server_name, '') AS server_name,
+       NULLIF(v.server_location, '') AS server_location, NULLIF(v.server_country, '') AS server_country,
+       s.server_id, s.download_mbps, s.upload_mbps, s.ping_ms, s.jitter_ms, s.packet_loss,
+       s.isp, s.external_ip, s.idle_latency_ms, s.download_latency_ms, s.upload_latency_ms,
+       s.bufferbloat_rating, s.test_duration_seconds, s.discovery_seconds, s.measurement_seconds,
+       s.latency_phases, s.is_successful, s.error_message, s.agent_id, a.agent
+FROM speedtest_data s
+JOIN speedtest_servers v ON v.server_id = s.server_id
+LEFT JOIN agents a ON a.agent_id = s.agent_id;
+
+CREATE OR REPLACE VIEW dns_queries AS
+SELECT q.id, q.timestamp, q.unix_timestamp, d.domain, n.nameserver, q.domain_id, q.nameserver_id,
+       q.record_type, q.resolution_time_ms, q.answer_set_id, q.is_successful, q.error_message,
+       q.agent_id, a.agent
+FROM dns_queries_data q
+JOIN domains d ON d.domain_id = q.domain_id
+JOIN nameservers n ON n.nameserver_id = q.nameserver_id
+LEFT JOIN agents a ON a.agent_id = q.agent_id;
+
+CREATE OR REPLACE VIEW http_requests AS
+SELECT h.id, h.timestamp, h.unix_timestamp, u.url, h.url_id, h.dns_time_ms, h.connect_time_ms,
+       h.tls_time_ms, h.ttfb_ms, h.total_time_ms, h.status_code, h.response_size,
+       h.tls_version, h.is_successful, h.error_message, h.measurement_mode, h.agent_id, a.agent
+FROM http_requests_data h
+JOIN urls u ON u.url_id = h.url_id
+LEFT JOIN agents a ON a.agent_id = h.agent_id;
+
+-- Rollup tables, maintained incrementally by the monitor (see rollups.py)
+-- granularity: '1m', '1h' or '1d'; bucket_start: start of the bucket in local time
+-- agent_id: agents.agent_id of rows from remote agents, 0 for local results
+CREATE TABLE IF NOT EXISTS ping_rollup (
+    granularity ENUM('1m', '1h', '1d') NOT NULL,
+    bucket_start DATETIME NOT NULL,
+    target VARCHAR(255) NOT NULL,
+    agent_id SMALLINT UNSIGNED NOT NULL DEFAULT 0,
+    sample_count INT NOT NULL,
+    reachable_count INT NOT NULL,
+    latency_count INT NOT NULL,
+    latency_sum DOUBLE NOT NULL,
+    latency_min FLOAT,
+    latency_max FLOAT,
+    packet_loss_sum DOUBLE NOT NULL,
+    status_excellent INT NOT NULL,
+    status_good INT NOT NULL,
+    status_fair INT NOT NULL,
+    status_poor INT NOT NULL,
+    status_down INT NOT NULL,
+    PRIMARY KEY (granularity, bucket_start, target, agent_id),
+    INDEX idx_target (target)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS dns_rollup (
+    granularity ENUM('1m', '1h', '1d') NOT NULL,
+    bucket_start DATETIME NOT NULL,
+    domain VARCHAR(255) NOT NULL,
+    nameserver VARCHAR(45) NOT NULL,
+    record_type VARCHAR(10) NOT NULL,
+    agent_id SMALLINT UNSIGNED NOT NULL DEFAULT 0,
+    query_count INT NOT NULL,
+    success_count INT NOT NULL,
+    resolution_sum DOUBLE NOT NULL,
+    resolution_min FLOAT,
+    resolution_max FLOAT,
+    PRIMARY KEY (granularity, bucket_start, domain, nameserver, record_type, agent_id),
+    INDEX idx_domain (domain)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS http_rollup (
+    granularity ENUM('1m', '1h', '1d') NOT NULL,
+    bucket_start DATETIME NOT NULL,
+    url VARCHAR(500) NOT NULL,
+    agent_id SMALLINT UNSIGNED NOT NULL DEFAULT 0,
+    request_count INT NOT NULL,
+    success_count INT NOT NULL,
+    total_time_sum DOUBLE NOT NULL,
+    total_time_min FLOAT,
+    total_time_max FLOAT,
+    ttfb_sum DOUBLE NOT NULL,
+    status_2xx INT NOT NULL,
+    status_3xx INT NOT NULL,
+    status_4xx INT NOT NULL,
+    status_5xx INT NOT NULL,
+    status_error INT NOT NULL,
+    PRIMARY KEY (granularity, bucket_start, url, agent_id),
+    INDEX idx_url (url(255))
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
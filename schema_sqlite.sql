@@ -0,0 +1,330 @@
+-- SQLite schema for the embedded storage backend
+-- Applied automatically by SQLiteDatabaseManager on connect
+-- Raw *_data tables reference dimension tables by id; views under the original
+-- table names join the names back (see dimensions.py)
+
+-- Dimension tables
+CREATE TABLE IF NOT EXISTS targets (
+    target_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    target TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS domains (
+    domain_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    domain TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS nameservers (
+    nameserver_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    nameserver TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS urls (
+    url_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    url TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS speedtest_servers (
+    server_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    server_name TEXT NOT NULL,  -- '' when unknown
+    server_location TEXT NOT NULL,
+    server_country TEXT NOT NULL,
+    UNIQUE (server_name, server_location, server_country)
+);
+
+-- Remote probe agents (collector mode, see collector.py)
+CREATE TABLE IF NOT EXISTS agents (
+    agent_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    agent TEXT NOT NULL UNIQUE
+);
+
+-- Last batch the collector wrote per agent, in the same transaction as the
+-- batch's rows, so a batch resent after a collector restart is not written twice
+CREATE TABLE IF NOT EXISTS agent_batches (
+    agent TEXT NOT NULL PRIMARY KEY,
+    session TEXT NOT NULL,
+    last_seq INTEGER NOT NULL
+);
+
+-- Ping monitoring table
+CREATE TABLE IF NOT EXISTS ping_data (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    unix_timestamp INTEGER NOT NULL,
+    target_id INTEGER NOT NULL,
+    ip_address TEXT,
+    ping_ms REAL,
+    min_ping_ms REAL,
+    max_ping_ms REAL,
+    jitter_ms REAL,
+    delta_ms REAL,  -- |ping_ms - previous ping_ms| for the same target
+    ewma_jitter_ms REAL,  -- Smoothed interarrival jitter (RFC 3550, gain 1/16)
+    packet_loss REAL,
+    is_reachable INTEGER NOT NULL,
+    connection_status TEXT NOT NULL CHECK (connection_status IN ('excellent', 'good', 'fair', 'poor', 'down')),
+    agent_id INTEGER  -- Remote agent the row came from, NULL for local results
+);
+CREATE INDEX IF NOT EXISTS idx_ping_data_timestamp ON ping_data (timestamp);
+CREATE INDEX IF NOT EXISTS idx_ping_data_unix_timestamp ON ping_data (unix_timestamp);
+CREATE INDEX IF NOT EXISTS idx_ping_data_target ON ping_data (target_id, unix_timestamp);
+
+-- Traceroute hop table (one row per hop per run, written by older versions;
+-- new runs are stored in traceroute_runs and traceroute_paths below)
+CREATE TABLE IF NOT EXISTS traceroute (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    trace_id TEXT NOT NULL,  -- UUID to group hops from same traceroute
+    timestamp TEXT NOT NULL,
+    unix_timestamp INTEGER NOT NULL,
+    target TEXT NOT NULL,
+    hop_number INTEGER NOT NULL,
+    hop_ip TEXT,
+    hop_hostname TEXT,
+    rtt_ms REAL,
+    packets_sent INTEGER NOT NULL,
+    packets_received INTEGER NOT NULL,
+    is_timeout INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_traceroute_trace_id ON traceroute (trace_id);
+CREATE INDEX IF NOT EXISTS idx_traceroute_timestamp ON traceroute (timestamp);
+CREATE INDEX IF NOT EXISTS idx_traceroute_target ON traceroute (target);
+
+-- Distinct traceroute paths, keyed by a hash of the ordered hop IPs
+CREATE TABLE IF NOT EXISTS traceroute_paths (
+    path_id INTEGER NOT NULL PRIMARY KEY,
+    hop_count INTEGER NOT NULL,
+    hop_ips TEXT NOT NULL,  -- Hop IPs joined with '>', '*' for timeouts
+    first_seen TEXT NOT NULL,
+    first_unix_timestamp INTEGER NOT NULL
+);
+
+-- Hops of each distinct path, written once when the path first appears
+CREATE TABLE IF NOT EXISTS traceroute_path_hops (
+    path_id INTEGER NOT NULL,
+    hop_index INTEGER NOT NULL,  -- 1-based position in the path and in traceroute_runs.rtt_ms
+    hop_number INTEGER NOT NULL,
+    hop_ip TEXT,
+    hop_hostname TEXT,
+    PRIMARY KEY (path_id, hop_index)
+) WITHOUT ROWID;
+
+-- One row per traceroute run
+CREATE TABLE IF NOT EXISTS traceroute_runs_data (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    trace_id TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    unix_timestamp INTEGER NOT NULL,
+    target_id INTEGER NOT NULL,
+    path_id INTEGER NOT NULL,
+    previous_path_id INTEGER,
+    route_changed INTEGER NOT NULL,
+    hop_count INTEGER NOT NULL,
+    timeout_count INTEGER NOT NULL,
+    rtt_ms TEXT NOT NULL,  -- JSON array: average RTT per hop in path order, null for timeouts
+    agent_id INTEGER  -- Remote agent the row came from, NULL for local results
+);
+CREATE INDEX IF NOT EXISTS idx_traceroute_runs_data_target ON traceroute_runs_data (target_id, unix_timestamp);
+CREATE INDEX IF NOT EXISTS idx_traceroute_runs_data_route_changed ON traceroute_runs_data (route_changed, unix_timestamp);
+
+-- Speed test monitoring table
+CREATE TABLE IF NOT EXISTS speedtest_data (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    unix_timestamp INTEGER NOT NULL,
+    server_id INTEGER NOT NULL,
+    download_mbps REAL,
+    upload_mbps REAL,
+    ping_ms REAL,
+    jitter_ms REAL,
+    packet_loss REAL,
+    isp TEXT,
+    external_ip TEXT,
+    idle_latency_ms REAL,
+    download_latency_ms REAL,
+    upload_latency_ms REAL,
+    bufferbloat_rating TEXT,
+    test_duration_seconds REAL,
+    discovery_seconds REAL,
+    measurement_seconds REAL,
+    latency_phases TEXT,  -- JSON: latency samples, loss, percentiles and grade per phase
+    is_successful INTEGER NOT NULL,
+    error_message TEXT,
+    agent_id INTEGER  -- Remote agent the row came from, NULL for local results
+);
+CREATE INDEX IF NOT EXISTS idx_speedtest_data_timestamp ON speedtest_data (timestamp);
+CREATE INDEX IF NOT EXISTS idx_speedtest_data_unix_timestamp ON speedtest_data (unix_timestamp);
+
+-- DNS monitoring table
+CREATE TABLE IF NOT EXISTS dns_queries_data (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    unix_timestamp INTEGER NOT NULL,
+    domain_id INTEGER NOT NULL,
+    nameserver_id INTEGER NOT NULL,
+    record_type TEXT NOT NULL,
+    resolution_time_ms REAL,
+    answer_set_id INTEGER,  -- References dns_answer_sets, NULL when the query failed
+    is_successful INTEGER NOT NULL,
+    error_message TEXT,
+    agent_id INTEGER  -- Remote agent the row came from, NULL for local results
+);
+CREATE INDEX IF NOT EXISTS idx_dns_queries_data_timestamp ON dns_queries_data (timestamp);
+CREATE INDEX IF NOT EXISTS idx_dns_queries_data_unix_timestamp ON dns_queries_data (unix_timestamp);
+CREATE INDEX IF NOT EXISTS idx_dns_queries_data_key ON dns_queries_data (domain_id, nameserver_id, record_type, unix_timestamp);
+
+-- Distinct DNS answer sets, keyed by a hash of the sorted answers
+CREATE TABLE IF NOT EXISTS dns_answer_sets (
+    answer_set_id INTEGER NOT NULL PRIMARY KEY,
+    answer_count INTEGER NOT NULL,
+    answers TEXT NOT NULL,  -- Sorted answers joined with ','
+    first_seen TEXT NOT NULL
+);
+
+-- One row each time a domain's answer set differs from the previous one
+CREATE TABLE IF NOT EXISTS dns_answer_changes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    unix_timestamp INTEGER NOT NULL,
+    domain TEXT NOT NULL,
+    nameserver TEXT NOT NULL,
+    record_type TEXT NOT NULL,
+    previous_answer_set_id INTEGER,
+    answer_set_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_dns_answer_changes_domain ON dns_answer_changes (domain, unix_timestamp);
+
+-- Address history of monitored hostnames (ping, traceroute and HTTP targets)
+-- previous_address is NULL for the first address seen
+CREATE TABLE IF NOT EXISTS address_changes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    unix_timestamp INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    previous_address TEXT,
+    address TEXT NOT NULL,
+    agent TEXT  -- Remote agent that resolved the name, NULL for local lookups
+);
+CREATE INDEX IF NOT EXISTS idx_address_changes_name ON address_changes (name, unix_timestamp);
+
+-- HTTP monitoring table
+CREATE TABLE IF NOT EXISTS http_requests_data (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    unix_timestamp INTEGER NOT NULL,
+    url_id INTEGER NOT NULL,
+    dns_time_ms REAL,
+    connect_time_ms REAL,
+    tls_time_ms REAL,
+    ttfb_ms REAL,
+    total_time_ms REAL,
+    status_code INTEGER,
+    response_size INTEGER,
+    tls_version TEXT,
+    is_successful INTEGER NOT NULL,
+    error_message TEXT,
+    measurement_mode TEXT NOT NULL DEFAULT 'cold',
+    agent_id INTEGER  -- Remote agent the row came from, NULL for local results
+);
+CREATE INDEX IF NOT EXISTS idx_http_requests_data_timestamp ON http_requests_data (timestamp);
+CREATE INDEX IF NOT EXISTS idx_http_requests_data_url ON http_requests_data (url_id, unix_timestamp);
+CREATE INDEX IF NOT EXISTS idx_http_requests_data_unix_timestamp ON http_requests_data (unix_timestamp);
+
+-- Views under the original table names, joining the dimension names back
+CREATE VIEW IF NOT EXISTS ping AS
+SELECT p.id, p.timestamp, p.unix_timestamp, t.target, p.target_id, p.ip_address,
+       p.ping_ms, p.min_ping_ms, p.max_ping_ms, p.jitter_ms, p.delta_ms, p.ewma_jitter_ms,
+       p.packet_loss, p.is_reachable, p.connection_status, p.agent_id, a.agent
+FROM ping_data p
+JOIN targets t ON t.target_id = p.target_id
+LEFT JOIN agents a ON a.agent_id = p.agent_id;
+
+CREATE VIEW IF NOT EXISTS traceroute_runs AS
+SELECT r.id, r.trace_id, r.timestamp, r.unix_timestamp, t.target, r.target_id, r.path_id,
+       r.previous_path_id, r.route_changed, r.hop_count, r.timeout_count, r.rtt_ms,
+       r.agent_id, a.agent
+FROM traceroute_runs_data r
+JOIN targets t ON t.target_id = r.target_id
+LEFT JOIN agents a ON a.agent_id = r.agent_id;
+
+CREATE VIEW IF NOT EXISTS speedtest AS
+SELECT s.id, s.timestamp, s.unix_timestamp, NULLIF(v.server_name, '') AS server_name,
+       NULLIF(v.server_location, '') AS server_location, NULLIF(v.server_country, '') AS server_country,
+       s.server_id, s.download_mbps, s.upload_mbps, s.ping_ms, s.jitter_ms, s.packet_loss,
+       s.isp, s.external_ip, s.idle_latency_ms, s.download_latency_ms, s.upload_latency_ms,
+       s.bufferbloat_rating, s.test_duration_seconds, s.discovery_seconds, s.measurement_seconds,
+       s.latency_phases, s.is_successful, s.error_message, s.agent_id, a.agent
+FROM speedtest_data s
+JOIN speedtest_servers v ON v.server_id = s.server_id
+LEFT JOIN agents a ON a.agent_id = s.agent_id;
+
+CREATE VIEW IF NOT EXISTS dns_queries AS
+SELECT q.id, q.timestamp, q.unix_timestamp, d.domain, n.nameserver, q.domain_id, q.nameserver_id,
+       q.record_type, q.resolution_time_ms, q.answer_set_id, q.is_successful, q.error_message,
+       q.agent_id, a.agent
+FROM dns_queries_data q
+JOIN domains d ON d.domain_id = q.domain_id
+JOIN nameservers n ON n.nameserver_id = q.nameserver_id
+LEFT JOIN agents a ON a.agent_id = q.agent_id;
+
+CREATE VIEW IF NOT EXISTS http_requests AS
+SELECT h.id, h.timestamp, h.unix_timestamp, u.url, h.url_id, h.dns_time_ms, h.connect_time_ms,
+       h.tls_time_ms, h.ttfb_ms, h.total_time_ms, h.status_code, h.response_size,
+       h.tls_version, h.is_successful, h.error_message, h.measurement_mode, h.agent_id, a.agent
+FROM http_requests_data h
+JOIN urls u ON u.url_id = h.url_id
+LEFT JOIN agents a ON a.agent_id = h.agent_id;
+
+-- Rollup tables, maintained incrementally by the monitor (see rollups.py)
+-- agent_id: agents.agent_id of rows from remote agents, 0 for local results
+CREATE TABLE IF NOT EXISTS ping_rollup (
+    granularity TEXT NOT NULL,
+    bucket_start TEXT NOT NULL,
+    target TEXT NOT NULL,
+    agent_id INTEGER NOT NULL DEFAULT 0,
+    sample_count INTEGER NOT NULL,
+    reachable_count INTEGER NOT NULL,
+    latency_count INTEGER NOT NULL,
+    latency_sum REAL NOT NULL,
+    latency_min REAL,
+    latency_max REAL,
+    packet_loss_sum REAL NOT NULL,
+    status_excellent INTEGER NOT NULL,
+    status_good INTEGER NOT NULL,
+    status_fair INTEGER NOT NULL,
+    status_poor INTEGER NOT NULL,
+    status_down INTEGER NOT NULL,
+    PRIMARY KEY (granularity, bucket_start, target, agent_id)
+);
+
+CREATE TABLE IF NOT EXISTS dns_rollup (
+    granularity TEXT NOT NULL,
+    bucket_start TEXT NOT NULL,
+    domain TEXT NOT NULL,
+    nameserver TEXT NOT NULL,
+    record_type TEXT NOT NULL,
+    agent_id INTEGER NOT NULL DEFAULT 0,
+    query_count INTEGER NOT NULL,
+    success_count INTEGER NOT NULL,
+    resolution_sum REAL NOT NULL,
+    resolution_min REAL,
+    resolution_max REAL,
+    PRIMARY KEY (granularity, bucket_start, domain, nameserver, record_type, agent_id)
+);
+
+CREATE TABLE IF NOT EXISTS http_rollup (
+    granularity TEXT NOT NULL,
+    bucket_start TEXT NOT NULL,
+    url TEXT NOT NULL,
+    agent_id INTEGER NOT NULL DEFAULT 0,
+    request_count INTEGER NOT NULL,
+    success_count INTEGER NOT NULL,
+    total_time_sum REAL NOT NULL,
+    total_time_min REAL,
+    total_time_max REAL,
+    ttfb_sum REAL NOT NULL,
+    status_2xx INTEGER NOT NULL,
+    status_3xx INTEGER NOT NULL,
+    status_4xx INTEGER NOT NULL,
+    status_5xx INTEGER NOT NULL,
+    status_error INTEGER NOT NULL,
+    PRIMARY KEY (granularity, bucket_start, url, agent_id)
+);
@@ -5,6 +5,10 @@ Run this script to create the database and tables
 import mysql.connector
 from mysql.connector import Error
 import sys
+from datetime import date
+from config_loader import load_config
+from retention import RAW_TABLES, period_start, period_length, split_pmax_query
+from dimensions import storage_table
 
 def setup_database():
     """Create database and tables"""
@@ -43,6 +47,18 @@ def setup_database():
                     except Error as e:
                         print(f"Warning: {e}")
             
+            # Split the catch-all partition so the next days/weeks have their own partitions
+            retention = (load_config() or {}).get('retention', {})
+            granularity = retention.get('partition_granularity', 'daily')
+            first_start = period_start(date.today(), granularity)
+            last_start = first_start + period_length(granularity) * retention.get('precreate_partitions', 7)
+            for table in map(storage_table, RAW_TABLES):
+                try:
+                    cursor.execute(split_pmax_query(table, first_start, last_start, granularity))
+                    print(f"✓ Created partitions for {table} through {last_start}")
+                except Error as e:
+                    print(f"Warning: {e}")
+            
             connection.commit()
             cursor.close()
             connection.close()
@@ -51,7 +67,7 @@ def setup_database():
             print("✓ Database setup completed successfully!")
             print("=" * 60)
             return True
-            
+    
     except Error as e:
         print(f"Error connecting to MySQL: {e}")
         print("\nPlease ensure:")
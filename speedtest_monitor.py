@@ -1,47 +1,149 @@
 """
 Speed test monitoring module with bufferbloat detection
 """
+import os
+import json
 import time
 import logging
 from datetime import datetime
-from threading import Thread, Event
+from threading import Event
 import speedtest
-from pythonping import ping as pythonping_ping
+from latency_sampler import LatencySampler, resolve_address
 
 logger = logging.getLogger(__name__)
 
 
+class ServerCache:
+    """
+    Speed test servers persisted to a JSON file across runs and restarts:
+    the closest servers (refreshed after server_list_ttl) and the best of them
+    by latency (re-probed among the closest after best_server_ttl)
+    """
+    def __init__(self, path, server_list_ttl=86400, best_server_ttl=3600):
+        self.path = path
+        self.server_list_ttl = server_list_ttl
+        self.best_server_ttl = best_server_ttl
+        self.data = self.load()
+    
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable speed test server cache {self.path}: {e}")
+            return {}
+    
+    def save(self):
+        if not self.path:
+            return
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump(self.data, f)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Could not save speed test server cache {self.path}: {e}")
+    
+    def fresh(self, key, ttl, location):
+        """Cached entry if it is younger than ttl and was chosen from the same client location"""
+        entry = self.data.get(key)
+        if not entry or time.time() - entry['saved_at'] > ttl or entry['location'] != list(location):
+            return None
+        return entry['value']
+    
+    def put(self, key, value, location):
+        self.data[key] = {'saved_at': time.time(), 'location': list(location), 'value': value}
+        self.save()
+    
+    def closest(self, location):
+        return self.fresh('closest', self.server_list_ttl, location)
+    
+    def best(self, location):
+        return self.fresh('best', self.best_server_ttl, location)
+    
+    def pinned(self, server_id):
+        """Pinned server details, which do not depend on the client location"""
+        entry = self.data.get('pinned', {}).get(str(server_id))
+        if not entry or time.time() - entry['saved_at'] > self.server_list_ttl:
+            return None
+        return entry['value']
+    
+    def put_pinned(self, server_id, server):
+        self.data.setdefault('pinned', {})[str(server_id)] = {'saved_at': time.time(), 'value': server}
+        self.save()
+    
+    def clear(self):
+        self.data = {}
+        self.save()
+
+
 class SpeedTestMonitor:
-    def __init__(self, db_manager, config):
+    def __init__(self, db_manager, config, scheduler, icmp_engine=None, resolver=None):
         self.db_manager = db_manager
         self.config = config
+        self.scheduler = scheduler
+        self.icmp_engine = icmp_engine
+        self.resolver = resolver
         self.stop_event = Event()
-        self.thread = None
+        self.server_cache = ServerCache(
+            config.get('server_cache_path', 'data/speedtest_servers.json'),
+            config.get('server_list_ttl_seconds', 86400),
+            config.get('best_server_ttl_seconds', 3600)
+        )
     
-    def measure_idle_latency(self, target='8.8.8.8', count=5):
-        """
-        Measure baseline latency when network is idle
-        Returns: average latency in ms
-        """
-        try:
-            response = pythonping_ping(target, count=count, timeout=2)
-            success_count = sum(1 for r in response if r.success)
-            
-            if success_count > 0:
-                ping_times = [r.time_elapsed_ms for r in response if r.success]
-                return sum(ping_times) / len(ping_times)
-            return None
-        except Exception as e:
-            logger.error(f"Error measuring idle latency: {e}")
+    def start_latency_sampler(self):
+        """Start probing the latency target in the idle phase, or return None if it cannot be resolved"""
+        target = self.config.get('latency_target', '8.8.8.8')
+        address = self.resolver.resolve(target) if self.resolver else resolve_address(target)
+        if address is None:
+            logger.warning(f"Cannot resolve latency target {target}, skipping bufferbloat measurement")
             return None
+        sampler = LatencySampler(address, self.icmp_engine,
+                                 self.config.get('latency_interval_seconds', 0.05),
+                                 self.config.get('latency_timeout_seconds', 1.0))
+        sampler.start('idle')
+        return sampler
     
-    def measure_loaded_latency(self, target='8.8.8.8', count=5):
+    def select_server(self, st, server_id=None):
         """
-        Measure latency while network is under load (during speed test)
-        This should be called during active download/upload
-        Returns: average latency in ms
+        Pick the server to test against, probing as few candidates as possible
+        A pinned server is probed alone; otherwise the cached best server is
+        re-probed, then the cached closest servers, and only when both have
+        expired is the full server list downloaded.
         """
-        return self.measure_idle_latency(target, count)
+        cache = self.server_cache
+        if server_id:
+            server = cache.pinned(server_id)
+            if server is None:
+                logger.info(f"Looking up pinned server {server_id}...")
+                servers = [s for candidates in st.get_servers([server_id]).values() for s in candidates]
+                if not servers:
+                    raise speedtest.NoMatchedServers(f"Server {server_id} not found")
+                server = servers[0]
+                cache.put_pinned(server_id, server)
+            return st.get_best_server([server])
+        
+        location = st.lat_lon
+        best = cache.best(location)
+        if best is not None:
+            return st.get_best_server([best])
+        
+        closest = cache.closest(location)
+        if closest is None:
+            logger.info("Getting server list...")
+            st.get_servers()
+            closest = st.get_closest_servers(self.config.get('candidate_servers', 5))
+            cache.put('closest', closest, location)
+        
+        logger.info(f"Selecting best of {len(closest)} servers...")
+        best = st.get_best_server(closest)
+        cache.put('best', best, location)
+        return best
     
     def perform_speedtest(self, server_id=None, measure_bufferbloat=True):
         """
@@ -52,28 +154,38 @@ class SpeedTestMonitor:
             start_time = time.time()
             
             st = speedtest.Speedtest()
+            try:
+                server = self.select_server(st, server_id)
+            except speedtest.SpeedtestBestServerFailure:
+                # Cached servers may have gone away; rediscover from scratch once
+                logger.warning("Cached speed test servers unreachable, rediscovering...")
+                self.server_cache.clear()
+                server = self.select_server(st, server_id)
             
-            # Get server list and select best server
-            logger.info("Getting server list...")
-            st.get_servers()
-            
-            if server_id:
-                st.get_servers([server_id])
-            
-            logger.info("Selecting best server...")
-            st.get_best_server()
-            
-            server = st.results.server
+            measurement_start = time.time()
+            discovery_seconds = measurement_start - start_time
             
-            # Perform download test
-            logger.info(f"Testing download speed (server: {server['sponsor']}, {server['name']})...")
-            st.download()
-            
-            # Perform upload test
-            logger.info("Testing upload speed...")
-            st.upload()
+            # Sample latency while idle, then through the download and upload
+            sampler = self.start_latency_sampler() if measure_bufferbloat else None
+            try:
+                if sampler:
+                    self.stop_event.wait(self.config.get('idle_sample_seconds', 2))
+                    sampler.set_phase('download')
+                
+                # Perform download test
+                logger.info(f"Testing download speed (server: {server['sponsor']}, {server['name']})...")
+                st.download()
+                
+                # Perform upload test
+                if sampler:
+                    sampler.set_phase('upload')
+                logger.info("Testing upload speed...")
+                st.upload()
+            finally:
+                latency = sampler.stop() if sampler else {}
             
             test_duration = time.time() - start_time
+            measurement_seconds = time.time() - measurement_start
             
             # Get results
             results = st.results.dict()
@@ -89,11 +201,20 @@ class SpeedTestMonitor:
                 'packet_loss': None,  # speedtest-cli doesn't provide packet loss
                 'isp': results.get('client', {}).get('isp', None),
                 'external_ip': results.get('client', {}).get('ip', None),
+                'idle_latency_ms': latency.get('idle', {}).get('p50_ms'),
+                'download_latency_ms': latency.get('download', {}).get('p50_ms'),
+                'upload_latency_ms': latency.get('upload', {}).get('p50_ms'),
+                # The worse of the download and upload grades
+                'bufferbloat_rating': max((stats['grade'] for stats in latency.values() if 'grade' in stats),
+                                          default=None),
+                'latency_phases': latency or None,
                 'test_duration_seconds': test_duration,
+                'discovery_seconds': discovery_seconds,
+                'measurement_seconds': measurement_seconds,
                 'is_successful': True,
                 'error_message': None
             }
-            
+        
         except Exception as e:
             logger.error(f"Error performing speed test: {e}")
             return {
@@ -111,7 +232,10 @@ class SpeedTestMonitor:
                 'download_latency_ms': None,
                 'upload_latency_ms': None,
                 'bufferbloat_rating': None,
+                'latency_phases': None,
                 'test_duration_seconds': None,
+                'discovery_seconds': None,
+                'measurement_seconds': None,
                 'is_successful': False,
                 'error_message': str(e)
             }
@@ -138,9 +262,12 @@ class SpeedTestMonitor:
             download_latency_ms=result.get('download_latency_ms'),
             upload_latency_ms=result.get('upload_latency_ms'),
             bufferbloat_rating=result.get('bufferbloat_rating'),
+            latency_phases=result.get('latency_phases'),
             test_duration_seconds=result['test_duration_seconds'],
             is_successful=result['is_successful'],
-            error_message=result['error_message']
+            error_message=result['error_message'],
+            discovery_seconds=result.get('discovery_seconds'),
+            measurement_seconds=result.get('measurement_seconds')
         )
         
         if success and result['is_successful']:
@@ -148,40 +275,37 @@ class SpeedTestMonitor:
             logger.info(f"Speed test completed: Down {result['download_mbps']:.2f} Mbps, "
                        f"Up {result['upload_mbps']:.2f} Mbps, "
                        f"Ping: {result['ping_ms']:.2f}ms{bufferbloat_str} "
-                       f"(Server: {result['server_name']}, {result['server_location']})")
+                       f"(Server: {result['server_name']}, {result['server_location']}; "
+                       f"discovery {result['discovery_seconds']:.1f}s, "
+                       f"measurement {result['measurement_seconds']:.1f}s)")
         elif success:
             logger.warning(f"Speed test failed: {result['error_message']}")
         else:
             logger.error("Failed to store speed test result")
     
-    def monitor_loop(self):
-        """Main monitoring loop"""
-        interval = self.config.get('interval_seconds', 300)  # Default 5 minutes
-        server_id = self.config.get('server_id', None)
-        
-        logger.info(f"Starting speed test monitor, interval: {interval}s")
-        
-        while not self.stop_event.is_set():
-            result = self.perform_speedtest(server_id)
-            self.store_speedtest_result(result)
-            
-            # Wait for next interval
-            self.stop_event.wait(interval)
+    def speedtest_job(self, server_id):
+        """Scheduled job: run one speed test and store the result"""
+        result = self.perform_speedtest(server_id, self.config.get('measure_bufferbloat', True))
+        self.store_speedtest_result(result)
     
     def start(self):
-        """Start monitoring in a separate thread"""
+        """Register the speed test job with the scheduler"""
         if not self.config.get('enabled', True):
             logger.info("Speed test monitor is disabled")
             return
         
-        self.thread = Thread(target=self.monitor_loop, daemon=True)
-        self.thread.start()
-        logger.info("Speed test monitor started")
+        interval = self.config.get('interval_seconds', 300)  # Default 5 minutes
+        server_id = self.config.get('server_id', None)
+        
+        self.scheduler.configure_monitor('speedtest', 1, self.config.get('priority', 3))
+        self.scheduler.add_jobs('speedtest', [
+            ('speedtest', interval, lambda: self.speedtest_job(server_id))
+        ])
+        logger.info(f"Speed test monitor started, interval: {interval}s")
     
     def stop(self):
         """Stop monitoring"""
         logger.info("Stopping speed test monitor...")
         self.stop_event.set()
-        if self.thread:
-            self.thread.join(timeout=10)
+        self.scheduler.remove_jobs('speedtest')
         logger.info("Speed test monitor stopped")
@@ -0,0 +1,239 @@
+"""
+Local durable spool for database writes
+Absorbs rows while MySQL is unreachable or slow and replays them in bulk once it recovers
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+from datetime import datetime, date
+from threading import Thread, Event, Lock
+
+logger = logging.getLogger(__name__)
+
+
+def _encode_value(value):
+    """JSON encoder hook for values that appear in query parameters"""
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, date):
+        return {'__date__': value.isoformat()}
+    if isinstance(value, bytes):
+        return {'__bytes__': value.hex()}
+    raise TypeError(f"Cannot spool value of type {type(value).__name__}")
+
+
+def _decode_value(obj):
+    """JSON decoder hook restoring values encoded by _encode_value"""
+    if '__datetime__' in obj:
+        return datetime.fromisoformat(obj['__datetime__'])
+    if '__date__' in obj:
+        return date.fromisoformat(obj['__date__'])
+    if '__bytes__' in obj:
+        return bytes.fromhex(obj['__bytes__'])
+    return obj
+
+
+def encode_statements(statements):
+    """Serialize a list of (query, params_list) statements"""
+    return json.dumps([[query, [list(params) for params in params_list]]
+                       for query, params_list in statements], default=_encode_value)
+
+
+def decode_statements(payload):
+    """Deserialize statements produced by encode_statements"""
+    return [(query, [tuple(params) for params in params_list])
+            for query, params_list in json.loads(payload, object_hook=_decode_value)]
+
+
+class LocalSpool:
+    """
+    Append-only spool backed by SQLite in WAL mode.
+    Each entry is one write (a list of statements) so multi-row writes replay atomically.
+    """
+    def __init__(self, db_manager, config):
+        self.db_manager = db_manager
+        self.path = config.get('path', 'spool/network_monitor_spool.db')
+        self.replay_batch_rows = config.get('replay_batch_rows', 5000)
+        self.replay_interval = config.get('replay_interval_seconds', 10)
+        self.lock = Lock()
+        self.outage = Event()
+        self.stop_event = Event()
+        self.thread = None
+        self.conn = None
+        self.rows_spooled = 0
+        self.rows_replayed = 0
+        self.rows_dropped = 0
+    
+    def open(self):
+        """Open (or create) the spool database"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS spool (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at REAL NOT NULL,
+                row_count INTEGER NOT NULL,
+                payload TEXT NOT NULL
+            )
+        """)
+        
+        pending = self.pending_rows()
+        if pending:
+            logger.info(f"Spool {self.path} has {pending} rows waiting for replay")
+    
+    def close(self):
+        """Close the spool database"""
+        with self.lock:
+            if self.conn:
+                self.conn.close()
+                self.conn = None
+    
+    def append(self, statements):
+        """Append one write to the spool"""
+        row_count = sum(len(params_list) for _, params_list in statements)
+        try:
+            payload = encode_statements(statements)
+            with self.lock:
+                self.conn.execute(
+                    "INSERT INTO spool (created_at, row_count, payload) VALUES (?, ?, ?)",
+                    (time.time(), row_count, payload)
+                )
+                self.rows_spooled += row_count
+            return True
+        except (sqlite3.Error, TypeError) as e:
+            logger.error(f"Error writing to spool: {e}")
+            return False
+    
+    def pending_rows(self):
+        """Number of rows waiting for replay"""
+        with self.lock:
+            row = self.conn.execute("SELECT COALESCE(SUM(row_count), 0) FROM spool").fetchone()
+        return row[0]
+    
+    def mark_outage(self):
+        """Route new writes straight to the spool until the replayer reaches the database"""
+        if not self.outage.is_set():
+            logger.warning("Database unavailable, spooling writes locally")
+            self.outage.set()
+    
+    def _read_chunk(self):
+        """Read the oldest entries up to replay_batch_rows rows"""
+        entries = []
+        rows = 0
+        with self.lock:
+            cursor = self.conn.execute("SELECT id, row_count, payload FROM spool ORDER BY id")
+            for entry_id, row_count, payload in cursor:
+                if entries and rows + row_count > self.replay_batch_rows:
+                    break
+                entries.append((entry_id, row_count, payload))
+                rows += row_count
+            cursor.close()
+        return entries, rows
+    
+    def _delete(self, entry_ids):
+        with self.lock:
+            self.conn.executemany("DELETE FROM spool WHERE id = ?", [(i,) for i in entry_ids])
+    
+    def replay_once(self):
+        """
+        Replay one chunk of spooled writes
+        Returns: number of rows replayed, or None if the database is still unavailable
+        """
+        entries, rows = self._read_chunk()
+        if not entries:
+            return 0
+        
+        decoded = [(entry_id, decode_statements(payload)) for entry_id, _, payload in entries]
+        grouped = {}
+        for _, statements in decoded:
+            for query, params_list in statements:
+                grouped.setdefault(query, []).extend(params_list)
+        
+        try:
+            self.db_manager.execute_statements(list(grouped.items()))
+        except self.db_manager.unavailable_errors:
+            return None
+        except Exception as e:
+            # Something in the chunk is rejected by the database, replay entries one by one
+            logger.warning(f"Spool chunk rejected ({e}), replaying entries individually")
+            return self._replay_individually(decoded)
+        
+        self._delete([entry_id for entry_id, _ in decoded])
+        self.rows_replayed += rows
+        return rows
+    
+    def _replay_individually(self, decoded):
+        replayed = 0
+        for entry_id, statements in decoded:
+            row_count = sum(len(params_list) for _, params_list in statements)
+            try:
+                self.db_manager.execute_statements(statements)
+                replayed += row_count
+            except self.db_manager.unavailable_errors:
+                self.rows_replayed += replayed
+                return None
+            except Exception as e:
+                logger.error(f"Dropping spooled write of {row_count} rows: {e}")
+                self.rows_dropped += row_count
+            self._delete([entry_id])
+        self.rows_replayed += replayed
+        return replayed
+    
+    def replay_loop(self):
+        """Background replayer loop"""
+        while not self.stop_event.is_set():
+            replayed_total = 0
+            while not self.stop_event.is_set():
+                replayed = self.replay_once()
+                if replayed is None:
+                    break
+                replayed_total += replayed
+                if replayed == 0:
+                    if self.outage.is_set():
+                        logger.info("Database reachable again, resuming direct writes")
+                        self.outage.clear()
+                    break
+            
+            if replayed_total:
+                logger.info(f"Replayed {replayed_total} spooled rows "
+                           f"({self.pending_rows()} still pending)")
+            
+            self.stop_event.wait(self.replay_interval)
+    
+    def get_stats(self):
+        """Return spool statistics"""
+        return {
+            'pending_rows': self.pending_rows(),
+            'rows_spooled': self.rows_spooled,
+            'rows_replayed': self.rows_replayed,
+            'rows_dropped': self.rows_dropped,
+            'outage': self.outage.is_set()
+        }
+    
+    def start(self):
+        """Open the spool and start the replayer thread"""
+        if self.conn is None:
+            self.open()
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = Thread(target=self.replay_loop, daemon=True)
+        self.thread.start()
+        logger.info(f"Spool replayer started ({self.path})")
+    
+    def stop(self):
+        """Stop the replayer thread; pending rows stay on disk for the next run"""
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=10)
+        pending = self.pending_rows() if self.conn else 0
+        if pending:
+            logger.warning(f"{pending} spooled rows left for replay on next start")
+        self.close()
@@ -0,0 +1,224 @@
+"""
+Embedded SQLite storage backend
+For single-box and edge deployments that cannot run a MySQL server
+"""
+import os
+import re
+import sqlite3
+import logging
+from datetime import datetime, date
+from threading import Lock
+from db_utils import BaseDatabaseManager, DatabaseUnavailableError
+from dimensions import FACT_TABLES, conversion_statements
+from retention import ROLLUP_TABLES
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema_sqlite.sql')
+
+# MySQL constructs used by the shared write queries and their SQLite equivalents
+DIALECT_REWRITES = [
+    (re.compile(r'ON DUPLICATE KEY UPDATE'), 'ON CONFLICT DO UPDATE SET'),
+    (re.compile(r'VALUES\((\w+)\)'), r'excluded.\1'),
+    (re.compile(r'\bINSERT IGNORE\b'), 'INSERT OR IGNORE'),
+    (re.compile(r'\bLEAST\('), 'MIN('),
+    (re.compile(r'\bGREATEST\('), 'MAX('),
+    (re.compile(r'\s+FROM DUAL\b'), ''),
+]
+
+# Columns added after a table was first released: (table, column, declaration).
+# Applied to existing databases before the schema script runs.
+ADDED_COLUMNS = [
+    ('dns_queries', 'answer_set_id', 'INTEGER'),
+    ('ping', 'delta_ms', 'REAL'),
+    ('ping', 'ewma_jitter_ms', 'REAL'),
+    ('http_requests_data', 'measurement_mode', "TEXT NOT NULL DEFAULT 'cold'"),
+    ('speedtest_data', 'discovery_seconds', 'REAL'),
+    ('speedtest_data', 'measurement_seconds', 'REAL'),
+    ('speedtest_data', 'latency_phases', 'TEXT'),
+    ('ping_data', 'agent_id', 'INTEGER'),
+    ('traceroute_runs_data', 'agent_id', 'INTEGER'),
+    ('speedtest_data', 'agent_id', 'INTEGER'),
+    ('dns_queries_data', 'agent_id', 'INTEGER'),
+    ('http_requests_data', 'agent_id', 'INTEGER'),
+    ('address_changes', 'agent', 'TEXT'),
+]
+
+
+def _adapt_value(value):
+    """Store datetimes in the same sortable text format MySQL returns"""
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ', timespec='milliseconds')
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+class SQLiteDatabaseManager(BaseDatabaseManager):
+    """SQLite storage backend in WAL mode, schema is created on connect"""
+    backend_name = 'sqlite'
+    database_errors = (sqlite3.Error,)
+    
+    def __init__(self, config):
+        super().__init__(config)
+        self.path = config.get('path', 'network_monitor.db')
+        self.busy_timeout = config.get('busy_timeout_seconds', 10)
+        self.conn = None
+        self.lock = Lock()
+        self.translated = {}
+    
+    def connect(self):
+        """Open the SQLite database and apply the schema"""
+        self._start_spool()
+        
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            
+            self.conn = sqlite3.connect(self.path, timeout=self.busy_timeout,
+                                        check_same_thread=False, isolation_level=None)
+            self.conn.row_factory = sqlite3.Row
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            
+            self._add_missing_columns()
+            self._rename_legacy_fact_tables()
+            self._rename_legacy_rollup_tables()
+            with open(SCHEMA_PATH, 'r') as f:
+                self.conn.executescript(f.read())
+            self._convert_legacy_fact_tables()
+            self._convert_legacy_rollup_tables()
+            
+            logger.info(f"Successfully opened SQLite database {self.path}")
+            self._start_background()
+            return True
+        except (sqlite3.Error, OSError) as e:
+            logger.error(f"Error opening SQLite database: {e}")
+            return False
+    
+    def _add_missing_columns(self):
+        """Bring tables created by older versions up to date with schema_sqlite.sql"""
+        for table, column, declaration in ADDED_COLUMNS:
+            columns = [row['name'] for row in self.conn.execute(f"PRAGMA table_info({table})")]
+            if columns and column not in columns:
+                self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+                logger.info(f"Added column {column} to {table}")
+                # The schema script recreates the view over the storage table with the new column
+                for fact, (storage, _) in FACT_TABLES.items():
+                    if storage == table:
+                        self.conn.execute(f"DROP VIEW IF EXISTS {fact}")
+    
+    def _table_names(self, object_type='table'):
+        rows = self.conn.execute("SELECT name FROM sqlite_master WHERE type = ?", (object_type,))
+        return {row['name'] for row in rows}
+    
+    def _rename_legacy_fact_tables(self):
+        """Move fact tables from before the dimension tables aside so views can take their names"""
+        tables = self._table_names()
+        for fact in FACT_TABLES:
+            if fact in tables:
+                self.conn.execute(f"ALTER TABLE {fact} RENAME TO {fact}_legacy")
+    
+    def _convert_legacy_fact_tables(self):
+        """Copy rows of renamed legacy fact tables into the *_data tables, then drop them"""
+        tables = self._table_names()
+        for fact, (table, _) in FACT_TABLES.items():
+            legacy_table = f"{fact}_legacy"
+            if legacy_table not in tables:
+                continue
+            
+            data_columns = [row['name'] for row in self.conn.execute(f"PRAGMA table_info({table})")]
+            legacy_columns = {row['name'] for row in self.conn.execute(f"PRAGMA table_info({legacy_table})")}
+            self.conn.execute("BEGIN")
+            try:
+                for query in conversion_statements(fact, legacy_table, data_columns, legacy_columns):
+                    self.conn.execute(self.translate(query))
+                self.conn.execute(f"DROP TABLE {legacy_table}")
+                self.conn.execute("COMMIT")
+            except sqlite3.Error:
+                self.conn.execute("ROLLBACK")
+                raise
+            logger.info(f"Converted {fact} to {table} with dimension ids")
+    
+    def _rename_legacy_rollup_tables(self):
+        """Move rollup tables from before the agent_id key column aside, the key cannot be altered in place"""
+        for table in ROLLUP_TABLES:
+            columns = [row['name'] for row in self.conn.execute(f"PRAGMA table_info({table})")]
+            if columns and 'agent_id' not in columns:
+                self.conn.execute(f"ALTER TABLE {table} RENAME TO {table}_legacy")
+    
+    def _convert_legacy_rollup_tables(self):
+        """Copy rows of renamed legacy rollup tables into the new tables as local results (agent_id 0)"""
+        tables = self._table_names()
+        for table in ROLLUP_TABLES:
+            legacy_table = f"{table}_legacy"
+            if legacy_table not in tables:
+                continue
+            
+            columns = ', '.join(row['name'] for row in self.conn.execute(f"PRAGMA table_info({legacy_table})"))
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.execute(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {legacy_table}")
+                self.conn.execute(f"DROP TABLE {legacy_table}")
+                self.conn.execute("COMMIT")
+            except sqlite3.Error:
+                self.conn.execute("ROLLBACK")
+                raise
+            logger.info(f"Converted {table} to per-agent rollups")
+    
+    def disconnect(self):
+        """Close the SQLite database"""
+        self._stop_background()
+        with self.lock:
+            if self.conn:
+                self.conn.close()
+                self.conn = None
+                logger.info("SQLite database closed")
+    
+    def translate(self, query):
+        """Translate a MySQL-style query (%s placeholders, upserts) to SQLite"""
+        translated = self.translated.get(query)
+        if translated is None:
+            translated = query.replace('%s', '?')
+            for pattern, replacement in DIALECT_REWRITES:
+                translated = pattern.sub(replacement, translated)
+            self.translated[query] = translated
+        return translated
+    
+    def execute_statements(self, statements):
+        """
+        Execute (query, params_list) statements in a single transaction
+        Raises DatabaseUnavailableError if the database is closed or stays locked.
+        """
+        with self.lock:
+            if self.conn is None:
+                raise DatabaseUnavailableError("SQLite database is not open")
+            try:
+                self.conn.execute("BEGIN")
+                for query, params_list in statements:
+                    if params_list:
+                        self.conn.executemany(
+                            self.translate(query),
+                            [tuple(_adapt_value(v) for v in params) for params in params_list]
+                        )
+                self.conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                try:
+                    self.conn.execute("ROLLBACK")
+                except sqlite3.Error:
+                    pass
+                if isinstance(e, sqlite3.OperationalError) and 'locked' in str(e):
+                    raise DatabaseUnavailableError(str(e)) from e
+                raise
+    
+    def fetch_all(self, query, params=None):
+        """Run a read query and return rows as dictionaries"""
+        with self.lock:
+            if self.conn is None:
+                raise DatabaseUnavailableError("SQLite database is not open")
+            cursor = self.conn.execute(self.translate(query),
+                                       tuple(_adapt_value(v) for v in (params or ())))
+            rows = [dict(row) for row in cursor.fetchall()]
+            cursor.close()
+        return rows
@@ -0,0 +1,259 @@
+"""
+In-memory latest-state store
+Keeps the last N samples of every target, domain, URL and speed test in
+per-series ring buffers of typed arrays, so "current status" and "last hour"
+reads are answered from memory instead of scanning the raw tables
+"""
+import math
+import time
+import bisect
+import logging
+from array import array
+from threading import Lock
+from rollups import CONNECTION_STATUSES
+
+logger = logging.getLogger(__name__)
+
+# Fact table -> (columns identifying a series, (column, array typecode) stored per sample)
+# 'd' columns hold NaN for NULL, integer columns -1
+SERIES = {
+    'ping': (('target',), (
+        ('ping_ms', 'd'), ('jitter_ms', 'd'), ('packet_loss', 'd'),
+        ('is_reachable', 'b'), ('connection_status', 'b'))),
+    'traceroute_runs': (('target',), (
+        ('path_id', 'q'), ('route_changed', 'b'), ('hop_count', 'h'), ('timeout_count', 'h'))),
+    'speedtest': ((), (
+        ('download_mbps', 'd'), ('upload_mbps', 'd'), ('ping_ms', 'd'),
+        ('jitter_ms', 'd'), ('is_successful', 'b'))),
+    'dns_queries': (('domain', 'nameserver', 'record_type'), (
+        ('resolution_time_ms', 'd'), ('is_successful', 'b'))),
+    'http_requests': (('url',), (
+        ('total_time_ms', 'd'), ('ttfb_ms', 'd'), ('status_code', 'h'), ('is_successful', 'b'))),
+}
+
+# Fact table -> column also counted in a cumulative latency histogram per series
+HISTOGRAMS = {
+    'ping': 'ping_ms',
+    'dns_queries': 'resolution_time_ms',
+    'http_requests': 'total_time_ms',
+}
+
+# Upper bounds of the histogram buckets, in milliseconds (plus one for everything above)
+HISTOGRAM_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# Text columns stored as their index in a fixed list of values
+CODED_COLUMNS = {
+    'connection_status': CONNECTION_STATUSES,
+}
+
+NAN = float('nan')
+
+
+def _encode(column, typecode, value):
+    if value is None:
+        return NAN if typecode == 'd' else -1
+    if column in CODED_COLUMNS:
+        values = CODED_COLUMNS[column]
+        return values.index(value) if value in values else -1
+    return float(value) if typecode == 'd' else int(value)
+
+
+def _decode(column, typecode, value):
+    if typecode == 'd':
+        return None if math.isnan(value) else value
+    if value == -1:
+        return None
+    if column in CODED_COLUMNS:
+        return CODED_COLUMNS[column][value]
+    return bool(value) if typecode == 'b' else value
+
+
+class RingBuffer:
+    """
+    Fixed-capacity columnar buffer: one preallocated array per column and a
+    write position; the oldest sample is overwritten once it is full.
+    Samples are expected in timestamp order, as results of one series arrive.
+    """
+    def __init__(self, capacity, columns):
+        self.capacity = capacity
+        self.columns = columns
+        self.timestamps = array('d', [0.0]) * capacity
+        self.arrays = [array(typecode, [0]) * capacity for _, typecode in columns]
+        self.head = 0
+        self.count = 0
+    
+    def append(self, unix_timestamp, values):
+        self.timestamps[self.head] = unix_timestamp
+        for data, value in zip(self.arrays, values):
+            data[self.head] = value
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+    
+    def _index(self, position):
+        """Array index of the position-th oldest sample"""
+        return (self.head - self.count + position) % self.capacity
+    
+    def latest(self):
+        """(timestamp, encoded values) of the newest sample"""
+        index = (self.head - 1) % self.capacity
+        return self.timestamps[index], [data[index] for data in self.arrays]
+    
+    def first_position_since(self, since):
+        """Position of the oldest sample at or after since (binary search)"""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.timestamps[self._index(middle)] < since:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+    
+    def window(self, position):
+        """Array slices from position to the newest sample, oldest first"""
+        arrays = [self.timestamps] + self.arrays
+        if position >= self.count:
+            return [data[0:0] for data in arrays]
+        start = self._index(position)
+        end = self._index(self.count - 1) + 1
+        if start < end:
+            return [data[start:end] for data in arrays]
+        return [data[start:] + data[:end] for data in arrays]
+    
+    def nbytes(self):
+        return sum(data.itemsize * len(data) for data in [self.timestamps] + self.arrays)
+
+
+class Histogram:
+    """Cumulative counts of all values ever observed, per bucket"""
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = array('q', [0]) * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class StateStore:
+    """
+    Latest results per series, fed by the database manager's insert calls.
+    A series is one target (ping, traceroute), domain/nameserver/record type
+    (DNS), URL (HTTP) or the speed test, per agent for rows from remote agents.
+    Timestamps are unix_timestamp values as the monitors write them, in milliseconds.
+    """
+    def __init__(self, config):
+        self.samples = max(1, config.get('samples', 720))
+        self.buckets = tuple(sorted(config.get('histogram_buckets_ms', HISTOGRAM_BUCKETS_MS)))
+        self.lock = Lock()
+        # Fact table -> series key (key column values..., agent) -> RingBuffer
+        self.series = {kind: {} for kind in SERIES}
+        # Fact table -> series key -> Histogram, for the tables in HISTOGRAMS
+        self.histograms = {kind: {} for kind in HISTOGRAMS}
+        self.appended = 0
+    
+    def add(self, kind, row):
+        """Record one fact row (the insert's column values) in its series"""
+        key_columns, columns = SERIES[kind]
+        key = tuple(row.get(column) for column in key_columns) + (row.get('agent'),)
+        values = [_encode(column, typecode, row.get(column)) for column, typecode in columns]
+        unix_timestamp = row.get('unix_timestamp') or int(time.time() * 1000)
+        with self.lock:
+            buffer = self.series[kind].get(key)
+            if buffer is None:
+                buffer = self.series[kind][key] = RingBuffer(self.samples, columns)
+            buffer.append(unix_timestamp, values)
+            self.appended += 1
+            
+            value = row.get(HISTOGRAMS[kind]) if kind in HISTOGRAMS else None
+            if value is not None:
+                histogram = self.histograms[kind].get(key)
+                if histogram is None:
+                    histogram = self.histograms[kind][key] = Histogram(self.buckets)
+                histogram.observe(value)
+    
+    def _describe(self, kind, key):
+        key_columns, _ = SERIES[kind]
+        described = dict(zip(key_columns, key))
+        described['agent'] = key[-1]
+        return described
+    
+    def latest(self, kind, agent=None):
+        """
+        Newest sample of every series of a fact table, as a list of dicts with the
+        key columns, agent, unix_timestamp and the stored columns (agent=None: all)
+        """
+        _, columns = SERIES[kind]
+        with self.lock:
+            newest = [(key, buffer.latest()) for key, buffer in self.series[kind].items()
+                      if agent is None or key[-1] == agent]
+        results = []
+        for key, (unix_timestamp, values) in newest:
+            row = self._describe(kind, key)
+            row['unix_timestamp'] = unix_timestamp
+            for (column, typecode), value in zip(columns, values):
+                row[column] = _decode(column, typecode, value)
+            results.append(row)
+        return results
+    
+    def history(self, kind, key, seconds=3600, agent=None, now=None):
+        """
+        Samples of one series from the last seconds, oldest first, as
+        {'unix_timestamp': [...], column: [...]}; None for an unknown series.
+        key: the series' key column values (a string for single-column keys)
+        now: end of the window as a unix time in seconds (default: the current time)
+        """
+        if not isinstance(key, tuple):
+            key = (key,)
+        key_columns, columns = SERIES[kind]
+        since = ((now or time.time()) - seconds) * 1000
+        with self.lock:
+            buffer = self.series[kind].get(key + (agent,))
+            if buffer is None:
+                return None
+            slices = buffer.window(buffer.first_position_since(since))
+        
+        history = {'unix_timestamp': slices[0].tolist()}
+        for (column, typecode), data in zip(columns, slices[1:]):
+            if typecode == 'd':
+                history[column] = [None if value != value else value for value in data]
+            elif column in CODED_COLUMNS or typecode == 'b':
+                # Indexed by the stored value, -1 (the last entry) is None
+                table = CODED_COLUMNS.get(column, (False, True)) + (None,)
+                history[column] = [table[value] for value in data]
+            else:
+                history[column] = [None if value == -1 else value for value in data]
+        return history
+    
+    def latency_histograms(self, kind):
+        """
+        Cumulative histogram of every series of a fact table in HISTOGRAMS, as a
+        list of (series dict, bucket bounds in ms, cumulative counts, sum, count);
+        the last count is the +Inf bucket
+        """
+        with self.lock:
+            snapshot = [(key, histogram.counts.tolist(), histogram.sum, histogram.count)
+                        for key, histogram in self.histograms[kind].items()]
+        results = []
+        for key, counts, total, count in snapshot:
+            cumulative = []
+            running = 0
+            for bucket_count in counts:
+                running += bucket_count
+                cumulative.append(running)
+            results.append((self._describe(kind, key), self.buckets, cumulative, total, count))
+        return results
+    
+    def get_stats(self):
+        """Return series and sample counts and the memory held by the buffers"""
+        with self.lock:
+            return {
+                'series': {kind: len(series) for kind, series in self.series.items()},
+                'samples_per_series': self.samples,
+                'samples_appended': self.appended,
+                'bytes': sum(buffer.nbytes() for series in self.series.values()
+                             for buffer in series.values())
+            }
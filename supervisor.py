@@ -0,0 +1,407 @@
+"""
+Supervisor mode
+Splits the targets over worker processes by consistent hashing, restarts
+workers that crash, and writes every worker's results to the database from
+one writer thread, so batching and rollups still happen in one place
+"""
+import os
+import copy
+import time
+import bisect
+import signal
+import hashlib
+import logging
+import multiprocessing
+from multiprocessing.connection import wait
+from threading import Thread, Event, Lock
+from config_loader import load_config, validate_config
+from db_utils import create_database_manager
+from agent import AgentDatabaseManager
+from retention import RetentionManager
+from metrics_exporter import MetricsExporter
+from network_monitor import NetworkMonitor
+
+logger = logging.getLogger(__name__)
+
+# (config section, target list, key of dict entries) split across workers
+SHARDED_LISTS = (
+    ('ping', 'targets', 'target'),
+    ('traceroute', 'targets', 'target'),
+    ('dns', 'domains', 'domain'),
+    ('http', 'urls', 'url'),
+)
+
+# Database manager methods a worker may call; lookups get a reply
+FORWARDED_INSERTS = 'insert_'
+FORWARDED_LOOKUPS = 'get_last_'
+
+
+def hash_key(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """
+    Consistent hash ring: every node owns many points on the ring and a key
+    belongs to the first point after its hash, so adding or removing a node
+    only moves the keys of that node's points
+    """
+    def __init__(self, nodes, replicas=100):
+        self.points = sorted((hash_key(f"{node}#{i}"), node) for node in nodes for i in range(replicas))
+        self.hashes = [point for point, _ in self.points]
+    
+    def node_for(self, key):
+        index = bisect.bisect(self.hashes, hash_key(key)) % len(self.points)
+        return self.points[index][1]
+
+
+def shard_config(config, ring, node):
+    """
+    Configuration for one worker: only the targets, domains and URLs hashed to
+    node; the speed test runs on a single worker and retention in the supervisor
+    """
+    shard = copy.deepcopy(config)
+    for section, key, item_key in SHARDED_LISTS:
+        section_config = shard.get(section)
+        if section_config is None:
+            continue
+        if key not in section_config:
+            # The monitor's default list: run it whole on one worker
+            if ring.node_for(section) != node:
+                section_config['enabled'] = False
+            continue
+        section_config[key] = [
+            item for item in section_config[key]
+            if ring.node_for(item[item_key] if isinstance(item, dict) else item) == node
+        ]
+        if not section_config[key]:
+            section_config['enabled'] = False
+    if 'speedtest' in shard and ring.node_for('speedtest') != node:
+        shard['speedtest']['enabled'] = False
+    shard['retention'] = {'enabled': False}
+    # Results reach the supervisor's state store, which serves the metrics
+    shard['metrics'] = {'enabled': False}
+    return shard
+
+
+class ForwardingDatabaseManager:
+    """
+    Database manager of a worker process: inserts are buffered and sent over a
+    pipe to the supervisor's writer in batches of up to batch_size calls, at
+    least every flush_interval seconds. A lookup is sent after the buffered
+    inserts in the same message and waits for the writer's reply.
+    """
+    def __init__(self, connection, batch_size=500, flush_interval=1):
+        self.connection = connection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # Held while using the pipe, so messages and replies stay in order
+        self.lock = Lock()
+        self.buffer_lock = Lock()
+        self.calls = []
+        self.stop_event = Event()
+        self.thread = None
+        self.spool = None
+    
+    def connect(self):
+        """Start the thread sending buffered inserts every flush_interval"""
+        self.stop_event.clear()
+        self.thread = Thread(target=self.flush_loop, daemon=True, name='worker-forwarder')
+        self.thread.start()
+        return True
+    
+    def disconnect(self):
+        """Send what is still buffered and close the pipe"""
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=10)
+        self.flush()
+        with self.lock:
+            self.connection.close()
+    
+    def _take_calls(self):
+        with self.buffer_lock:
+            calls, self.calls = self.calls, []
+        return calls
+    
+    def flush(self):
+        """Send the buffered inserts as one message; returns False if the supervisor is gone"""
+        with self.lock:
+            calls = self._take_calls()
+            if not calls:
+                return True
+            try:
+                self.connection.send(calls)
+                return True
+            except (OSError, ValueError) as e:
+                logger.error(f"Cannot forward {len(calls)} calls to the supervisor: {e}")
+                return False
+    
+    def flush_loop(self):
+        while not self.stop_event.wait(self.flush_interval):
+            self.flush()
+    
+    def send(self, method, args, kwargs):
+        """Buffer one insert, sending the batch once it is full"""
+        with self.buffer_lock:
+            self.calls.append((method, args, kwargs))
+            full = len(self.calls) >= self.batch_size
+        return self.flush() if full else True
+    
+    def call(self, method, args, kwargs):
+        """Send the buffered inserts and one lookup, and wait for the lookup's result"""
+        try:
+            with self.lock:
+                self.connection.send(self._take_calls() + [(method, args, kwargs)])
+                return self.connection.recv()
+        except (OSError, EOFError, ValueError) as e:
+            logger.error(f"Cannot forward {method} to the supervisor: {e}")
+            return None
+    
+    def __getattr__(self, name):
+        if name.startswith(FORWARDED_INSERTS):
+            return lambda *args, **kwargs: self.send(name, args, kwargs)
+        if name.startswith(FORWARDED_LOOKUPS):
+            return lambda *args, **kwargs: self.call(name, args, kwargs)
+        raise AttributeError(name)
+
+
+def run_worker(name, config, connection):
+    """Worker process: run the monitors of one shard until told to stop"""
+    supervisor_config = config.get('supervisor', {})
+    db_manager = ForwardingDatabaseManager(connection, supervisor_config.get('batch_size', 500),
+                                           supervisor_config.get('flush_interval_seconds', 1))
+    monitor = NetworkMonitor(config=config, db_manager=db_manager)
+    
+    def request_stop(signum, frame):
+        monitor.running = False
+    
+    # Ctrl+C reaches the whole process group; the supervisor decides when workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, request_stop)
+    logger.info(f"Worker {name} started (pid {os.getpid()})")
+    monitor.start()
+
+
+class _Worker:
+    def __init__(self, name):
+        self.name = name
+        self.process = None
+        self.connection = None
+        self.started = None
+        self.restarts = 0
+        # Consecutive short-lived runs, for the restart backoff
+        self.failures = 0
+        self.restart_at = None
+
+
+class Supervisor:
+    """
+    Runs NetworkMonitor in worker processes, one shard of the targets each.
+    Workers that exit are restarted, with a doubling delay while they keep
+    crashing soon after start.
+    """
+    def __init__(self, config_path='config.yaml'):
+        self.config_path = config_path
+        self.config = None
+        self.db_manager = None
+        self.retention_manager = None
+        self.metrics_exporter = None
+        self.ring = None
+        self.workers = []
+        self.restart_delay = 1
+        self.max_restart_delay = 60
+        self.lock = Lock()
+        # Parent ends of the worker pipes -> worker
+        self.connections = {}
+        self.stop_event = Event()
+        self.writer_thread = None
+        self.running = False
+        self.calls = 0
+        self.messages = 0
+        # Workers start in a fresh interpreter: forking after the database pool, the
+        # write-behind and writer threads exist would copy their locks and sockets
+        self.context = multiprocessing.get_context('spawn')
+    
+    def initialize(self):
+        """Load the configuration, connect to the database and build the hash ring"""
+        self.config = load_config(self.config_path)
+        if not self.config or not validate_config(self.config):
+            logger.error("Configuration validation failed")
+            return False
+        
+        agent_config = self.config.get('agent', {})
+        if agent_config.get('enabled', False):
+            # Workers' results go to the collector through the supervisor's agent connection
+            self.db_manager = AgentDatabaseManager(agent_config)
+        else:
+            self.db_manager = create_database_manager(self.config['database'])
+        if not self.db_manager.connect():
+            if not self.db_manager.spool:
+                logger.error("Failed to connect to database")
+                return False
+            logger.warning("Failed to connect to database, results will be spooled until it is reachable")
+            self.db_manager.spool.mark_outage()
+        
+        supervisor_config = self.config.get('supervisor', {})
+        count = supervisor_config.get('workers', 0) or os.cpu_count() or 1
+        self.restart_delay = supervisor_config.get('restart_delay_seconds', 1)
+        self.max_restart_delay = supervisor_config.get('max_restart_delay_seconds', 60)
+        self.workers = [_Worker(f"worker-{i}") for i in range(count)]
+        self.ring = HashRing([worker.name for worker in self.workers])
+        # Agents have no database of their own to maintain
+        self.retention_manager = RetentionManager(
+            self.db_manager,
+            {'enabled': False} if agent_config.get('enabled', False) else self.config.get('retention', {'enabled': False})
+        )
+        metrics_config = self.config.get('metrics', {})
+        if metrics_config.get('enabled', False):
+            self.metrics_exporter = MetricsExporter(
+                metrics_config,
+                self.db_manager,
+                supervisor=self,
+                agent=self.db_manager if agent_config.get('enabled', False) else None
+            )
+        return True
+    
+    def start_worker(self, worker):
+        """Start (or restart) one worker process with a fresh pipe"""
+        parent_end, child_end = self.context.Pipe()
+        worker.process = self.context.Process(
+            target=run_worker,
+            args=(worker.name, shard_config(self.config, self.ring, worker.name), child_end),
+            name=worker.name,
+            daemon=True
+        )
+        worker.process.start()
+        # Only the worker holds the child end, so the writer sees EOF when it exits
+        child_end.close()
+        worker.connection = parent_end
+        worker.started = time.monotonic()
+        worker.restart_at = None
+        with self.lock:
+            self.connections[parent_end] = worker
+    
+    def writer_loop(self):
+        """Writer thread: apply the database calls of all workers in arrival order"""
+        while True:
+            with self.lock:
+                connections = list(self.connections)
+            if not connections:
+                if self.stop_event.is_set():
+                    return
+                self.stop_event.wait(0.1)
+                continue
+            
+            for connection in wait(connections, timeout=0.5):
+                try:
+                    calls = connection.recv()
+                except (EOFError, OSError):
+                    # The worker exited; its pipe is drained
+                    with self.lock:
+                        self.connections.pop(connection, None)
+                    connection.close()
+                    continue
+                
+                # A message is a batch of inserts, possibly ending with a lookup
+                for method, args, kwargs in calls:
+                    lookup = method.startswith(FORWARDED_LOOKUPS)
+                    result = None
+                    if lookup or method.startswith(FORWARDED_INSERTS):
+                        try:
+                            result = getattr(self.db_manager, method)(*args, **kwargs)
+                        except Exception as e:
+                            logger.error(f"Forwarded {method} failed: {e}")
+                    else:
+                        logger.warning(f"Ignoring forwarded call {method}")
+                    self.calls += 1
+                    if lookup:
+                        try:
+                            connection.send(result)
+                        except OSError:
+                            pass
+                self.messages += 1
+    
+    def check_workers(self):
+        """Restart workers that exited, backing off while they keep crashing"""
+        now = time.monotonic()
+        for worker in self.workers:
+            if worker.process.is_alive():
+                continue
+            if worker.restart_at is None:
+                # Runs shorter than the backoff cap count as a crash loop
+                worker.failures = worker.failures + 1 if now - worker.started < self.max_restart_delay else 1
+                delay = min(self.restart_delay * 2 ** (worker.failures - 1), self.max_restart_delay)
+                worker.restart_at = now + delay
+                logger.error(f"Worker {worker.name} exited with code {worker.process.exitcode}, "
+                            f"restarting in {delay:.0f}s")
+            elif now >= worker.restart_at:
+                worker.restarts += 1
+                self.start_worker(worker)
+    
+    def get_stats(self):
+        """Return per-worker state and the number of forwarded database calls and pipe messages"""
+        return {
+            'forwarded_calls': self.calls,
+            'forwarded_messages': self.messages,
+            'workers': {
+                worker.name: {
+                    'pid': worker.process.pid if worker.process else None,
+                    'alive': bool(worker.process and worker.process.is_alive()),
+                    'restarts': worker.restarts
+                }
+                for worker in self.workers
+            }
+        }
+    
+    def start(self):
+        """Start the writer and the workers, then watch the workers until stopped"""
+        if not self.initialize():
+            logger.error("Initialization failed, exiting")
+            return False
+        
+        self.running = True
+        self.writer_thread = Thread(target=self.writer_loop, daemon=True, name='supervisor-writer')
+        self.writer_thread.start()
+        for worker in self.workers:
+            self.start_worker(worker)
+        self.retention_manager.start()
+        if self.metrics_exporter:
+            self.metrics_exporter.start()
+        logger.info(f"Supervisor started {len(self.workers)} workers")
+        
+        try:
+            while self.running:
+                time.sleep(1)
+                self.check_workers()
+        except (KeyboardInterrupt, SystemExit):
+            logger.info("Shutdown requested")
+        
+        self.stop()
+        return True
+    
+    def stop(self, timeout=30):
+        """Stop the workers, write what they sent and close the database"""
+        logger.info("Stopping supervisor...")
+        self.running = False
+        if self.metrics_exporter:
+            self.metrics_exporter.stop()
+        for worker in self.workers:
+            if worker.process and worker.process.is_alive():
+                worker.process.terminate()
+        deadline = time.monotonic() + timeout
+        for worker in self.workers:
+            if worker.process:
+                worker.process.join(timeout=max(0, deadline - time.monotonic()))
+                if worker.process.is_alive():
+                    logger.warning(f"Worker {worker.name} did not stop, killing it")
+                    worker.process.kill()
+        
+        self.stop_event.set()
+        if self.writer_thread:
+            self.writer_thread.join(timeout=10)
+        if self.retention_manager:
+            self.retention_manager.stop()
+        if self.db_manager:
+            self.db_manager.disconnect()
+        logger.info(f"Supervisor stopped ({self.calls} forwarded database calls)")
@@ -0,0 +1,142 @@
+import time
+import socket
+import sqlite3
+from datetime import datetime
+import pytest
+from agent import AgentDatabaseManager
+from collector import Collector
+from sqlite_db import SQLiteDatabaseManager
+
+TIMESTAMP = datetime(2026, 1, 1, 12, 0)
+
+
+def ping_record(target, ping_ms=10.0):
+    return ('insert_ping_result', {
+        'timestamp': TIMESTAMP, 'unix_timestamp': 1_767_268_800_000, 'target': target,
+        'ip_address': None, 'ping_ms': ping_ms, 'min_ping_ms': ping_ms, 'max_ping_ms': ping_ms,
+        'jitter_ms': 0.0, 'packet_loss': 0.0, 'is_reachable': True, 'connection_status': 'good'
+    })
+
+
+def test_failed_batch_is_not_counted_before_resend(tmp_path, monkeypatch):
+    db = SQLiteDatabaseManager({
+        'path': str(tmp_path / 'collector.db'),
+        'rollups': {'enabled': True, 'flush_interval_seconds': 3600},
+        'state_store': {'enabled': True}
+    })
+    assert db.connect()
+    collector = Collector({}, db)
+    records = [ping_record('example.com')]
+    
+    def reject(statements):
+        raise sqlite3.IntegrityError("rejected")
+    
+    execute_statements = db.execute_statements
+    monkeypatch.setattr(db, 'execute_statements', reject)
+    assert not collector.apply_batch('site-a', 'session', 1, records)
+    assert db.state_store.latest('ping') == []
+    assert db.rollups.ping == {}
+    
+    # The agent resends the batch once the database accepts writes again
+    monkeypatch.setattr(db, 'execute_statements', execute_statements)
+    assert collector.apply_batch('site-a', 'session', 1, records)
+    assert collector.apply_batch('site-a', 'session', 1, records)
+    assert db.get_state_stats()['samples_appended'] == 1
+    assert [bucket['sample_count'] for bucket in db.rollups.ping.values()] == [1, 1, 1]
+    assert db.fetch_all("SELECT agent, COUNT(*) AS n FROM ping GROUP BY agent") == [{'agent': 'site-a', 'n': 1}]
+    db.disconnect()
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.05)
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = SQLiteDatabaseManager({'path': str(tmp_path / 'collector.db')})
+    assert db.connect()
+    yield db
+    db.disconnect()
+
+
+def start_collector(db, token=None):
+    collector = Collector({'host': '127.0.0.1', 'port': 0, 'token': token}, db)
+    collector.start()
+    return collector
+
+
+def start_agent(collector, token=None):
+    agent = AgentDatabaseManager({
+        'agent_id': 'site-a', 'collector_port': collector.port, 'token': token,
+        'flush_interval_seconds': 0.1, 'retry_delay_seconds': 0.1
+    })
+    agent.connect()
+    return agent
+
+
+def ping_rows(db):
+    return db.fetch_all("SELECT agent, target FROM ping ORDER BY target")
+
+
+def test_agent_rows_reach_the_collector(db):
+    collector = start_collector(db, token='secret')
+    agent = start_agent(collector, token='secret')
+    for target in ('a.example.com', 'b.example.com'):
+        _, kwargs = ping_record(target)
+        agent.insert_ping_result(**kwargs)
+    wait_for(lambda: agent.get_stats()['records_acked'] == 2)
+    agent.disconnect()
+    collector.stop()
+    assert ping_rows(db) == [{'agent': 'site-a', 'target': 'a.example.com'},
+                             {'agent': 'site-a', 'target': 'b.example.com'}]
+
+
+def test_batch_resent_after_a_lost_ack_is_written_once(db, monkeypatch):
+    collector = start_collector(db)
+    apply_batch = collector.apply_batch
+    
+    def apply_and_drop_connection(*args):
+        # The batch is written, then the connection breaks before the ack is sent
+        monkeypatch.setattr(collector, 'apply_batch', apply_batch)
+        result = apply_batch(*args)
+        for sock in list(collector.sockets):
+            sock.shutdown(socket.SHUT_RDWR)
+        return result
+    
+    monkeypatch.setattr(collector, 'apply_batch', apply_and_drop_connection)
+    agent = start_agent(collector)
+    _, kwargs = ping_record('example.com')
+    agent.insert_ping_result(**kwargs)
+    wait_for(lambda: agent.get_stats()['records_acked'] == 1)
+    agent.disconnect()
+    collector.stop()
+    assert agent.get_stats()['connections'] == 2
+    assert collector.get_stats()['duplicate_batches'] == 1
+    assert ping_rows(db) == [{'agent': 'site-a', 'target': 'example.com'}]
+
+
+def test_batch_resent_to_a_restarted_collector_is_written_once(db):
+    records = [ping_record('example.com')]
+    assert Collector({}, db).apply_batch('site-a', 'session', 1, records)
+    # A new collector run continues from the last batch stored with the rows
+    restarted = Collector({}, db)
+    assert restarted.apply_batch('site-a', 'session', 1, records)
+    assert restarted.get_stats()['duplicate_batches'] == 1
+    assert restarted.apply_batch('site-a', 'session', 2, [ping_record('other.example.com')])
+    assert len(ping_rows(db)) == 2
+
+
+def test_agent_with_a_bad_token_is_rejected(db):
+    collector = start_collector(db, token='secret')
+    agent = start_agent(collector, token='wrong')
+    _, kwargs = ping_record('example.com')
+    agent.insert_ping_result(**kwargs)
+    time.sleep(0.5)
+    agent.disconnect(timeout=0)
+    collector.stop()
+    assert agent.get_stats()['connections'] == 0
+    assert collector.get_stats()['connections'] == 0
+    assert ping_rows(db) == []
@@ -0,0 +1,57 @@
+import time
+from threading import Timer, Lock
+from latency_sampler import LatencySampler
+
+
+class _Batch:
+    def __init__(self):
+        self.results = {}
+
+
+class _SlowEngine:
+    """Replies to even probes after reply_delay seconds (RTT = slot number), loses odd ones"""
+    def __init__(self, reply_delay):
+        self.reply_delay = reply_delay
+        self.sampler = None
+        self.lock = Lock()
+        # slot -> phase of the sampler when the probe was sent
+        self.sent = {}
+        self.forgotten = []
+    
+    def supports(self, family):
+        return True
+    
+    def echo_stream(self):
+        return _Batch()
+    
+    def send_echo(self, batch, address, slot):
+        self.sent[slot] = self.sampler.phase
+        if slot % 2 == 0:
+            timer = Timer(self.reply_delay, batch.results.__setitem__, (slot, {'rtt_ms': float(slot)}))
+            timer.daemon = True
+            timer.start()
+        return slot
+    
+    def forget_probe(self, batch, key):
+        self.forgotten.append(key)
+
+
+def test_replies_are_filed_under_the_phase_of_their_send():
+    engine = _SlowEngine(reply_delay=0.15)
+    sampler = LatencySampler('192.0.2.1', engine, interval=0.02, timeout=0.3)
+    engine.sampler = sampler
+    sampler.start('idle')
+    time.sleep(0.2)
+    # Replies of idle probes arrive after the switch and still count as idle
+    sampler.set_phase('download')
+    time.sleep(0.2)
+    sampler.stop()
+    
+    for phase in ('idle', 'download'):
+        slots = [slot for slot, sent_phase in engine.sent.items() if sent_phase == phase]
+        assert slots
+        assert list(sampler.samples[phase]) == [float(slot) for slot in slots if slot % 2 == 0]
+        assert sampler.lost[phase] == len([slot for slot in slots if slot % 2])
+    assert sorted(engine.forgotten) == [slot for slot in engine.sent if slot % 2]
+    # Probes kept their cadence while replies were outstanding
+    assert len(engine.sent) >= 15
@@ -0,0 +1,17 @@
+from types import SimpleNamespace
+from metrics_exporter import MetricsExporter
+from state_store import StateStore
+
+
+def test_timestamps_exported_in_seconds():
+    store = StateStore({})
+    store.add('ping', {
+        'unix_timestamp': 1_800_000_000_500, 'target': 'example.com', 'ping_ms': 12.0,
+        'jitter_ms': 1.0, 'packet_loss': 0.0, 'is_reachable': True, 'connection_status': 'good'
+    })
+    exporter = MetricsExporter({}, SimpleNamespace(state_store=store))
+    lines = exporter.render().decode().splitlines()
+    
+    assert 'netmon_ping_timestamp_seconds{target="example.com"} 1800000000.5' in lines
+    assert 'netmon_ping_rtt_seconds{target="example.com"} 0.012' in lines
+    assert lines[-1] == '# EOF'
@@ -0,0 +1,38 @@
+from resolution_cache import ResolutionCache
+
+
+class _AddressHistory:
+    def __init__(self, last_address=None):
+        self.last_address = last_address
+        self.changes = []
+    
+    def get_last_address(self, name):
+        return self.last_address
+    
+    def insert_address_change(self, **kwargs):
+        self.changes.append((kwargs['previous_address'], kwargs['address']))
+
+
+def test_rotating_records_keep_the_current_address():
+    db = _AddressHistory()
+    cache = ResolutionCache({}, db)
+    assert cache._store('cdn.example.com', ['192.0.2.1', '192.0.2.2'], 60) == '192.0.2.1'
+    # The resolver rotates the records; the address served is still in the set
+    assert cache._store('cdn.example.com', ['192.0.2.2', '192.0.2.1'], 60) == '192.0.2.1'
+    assert cache._store('cdn.example.com', ['192.0.2.3', '192.0.2.2'], 60) == '192.0.2.3'
+    assert db.changes == [(None, '192.0.2.1'), ('192.0.2.1', '192.0.2.3')]
+    assert cache.get_stats()['address_changes'] == 1
+
+
+def test_first_lookup_continues_from_recorded_address():
+    db = _AddressHistory(last_address='192.0.2.2')
+    cache = ResolutionCache({}, db)
+    assert cache._store('cdn.example.com', ['192.0.2.1', '192.0.2.2'], 60) == '192.0.2.2'
+    assert db.changes == []
+
+
+def test_failed_refresh_keeps_the_last_address():
+    cache = ResolutionCache({})
+    assert cache._store('example.com', ['192.0.2.1'], 60) == '192.0.2.1'
+    assert cache._store('example.com', [], 30) == '192.0.2.1'
+    assert cache.get_stats()['failures'] == 1
@@ -0,0 +1,90 @@
+import time
+import sqlite3
+from datetime import datetime
+from sqlite_db import SQLiteDatabaseManager
+
+TIMESTAMP = datetime(2026, 1, 1, 12, 0)
+
+
+def open_database(path, flush_interval=3600):
+    db = SQLiteDatabaseManager({'path': str(path), 'rollups': {'enabled': True, 'flush_interval_seconds': flush_interval}})
+    assert db.connect()
+    return db
+
+
+def insert_ping(db, ping_ms, agent=None):
+    db.insert_ping_result(TIMESTAMP, 1_767_268_800_000, 'example.com', None, ping_ms, ping_ms, ping_ms,
+                          0.0, 0.0, True, 'good', agent=agent)
+
+
+def test_rollups_are_kept_per_agent(tmp_path):
+    db = open_database(tmp_path / 'rollups.db')
+    insert_ping(db, 10.0)
+    insert_ping(db, 20.0, agent='site-a')
+    insert_ping(db, 30.0, agent='site-a')
+    insert_ping(db, 40.0, agent='site-b')
+    assert db.flush_rollups()
+    
+    rows = db.fetch_all("""
+        SELECT a.agent, r.sample_count, r.latency_sum FROM ping_rollup r
+        LEFT JOIN agents a ON a.agent_id = r.agent_id
+        WHERE r.granularity = '1m' ORDER BY r.latency_sum
+    """)
+    assert [(row['agent'], row['sample_count'], row['latency_sum']) for row in rows] == [
+        (None, 1, 10.0), ('site-b', 1, 40.0), ('site-a', 2, 50.0)]
+    db.disconnect()
+
+
+def test_legacy_rollup_table_is_converted(tmp_path):
+    path = tmp_path / 'legacy.db'
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE dns_rollup (
+            granularity TEXT NOT NULL, bucket_start TEXT NOT NULL, domain TEXT NOT NULL,
+            nameserver TEXT NOT NULL, record_type TEXT NOT NULL, query_count INTEGER NOT NULL,
+            success_count INTEGER NOT NULL, resolution_sum REAL NOT NULL, resolution_min REAL,
+            resolution_max REAL, PRIMARY KEY (granularity, bucket_start, domain, nameserver, record_type))
+    """)
+    conn.execute("INSERT INTO dns_rollup VALUES ('1h', '2026-01-01 12:00:00', 'example.com', '1.1.1.1', 'A', "
+                 "3, 3, 30.0, 5.0, 15.0)")
+    conn.commit()
+    conn.close()
+    
+    db = open_database(path)
+    db.insert_dns_result(TIMESTAMP, 1_767_268_800_000, 'example.com', '1.1.1.1', 'A', 20.0,
+                         ['93.184.216.34'], True, agent='site-a')
+    assert db.flush_rollups()
+    rows = db.fetch_all("SELECT agent_id, query_count FROM dns_rollup WHERE granularity = '1h' ORDER BY agent_id")
+    assert [row['query_count'] for row in rows] == [3, 1]
+    assert rows[0]['agent_id'] == 0
+    db.disconnect()
+
+
+def ping_rollup(db):
+    rows = db.fetch_all("SELECT sample_count, latency_min, latency_max FROM ping_rollup WHERE granularity = '1m'")
+    return [tuple(row.values()) for row in rows]
+
+
+def test_failed_flush_is_merged_into_the_next_one(tmp_path, monkeypatch):
+    db = open_database(tmp_path / 'rollups.db')
+    insert_ping(db, 10.0)
+    write = db.write
+    monkeypatch.setattr(db, 'write', lambda statements: False)
+    assert not db.flush_rollups()
+    
+    monkeypatch.setattr(db, 'write', write)
+    insert_ping(db, 30.0)
+    assert db.flush_rollups()
+    assert ping_rollup(db) == [(2, 10.0, 30.0)]
+    db.disconnect()
+
+
+def test_rollups_are_flushed_without_new_results(tmp_path):
+    db = open_database(tmp_path / 'rollups.db', flush_interval=0.1)
+    insert_ping(db, 10.0)
+    deadline = time.monotonic() + 5
+    while not ping_rollup(db):
+        assert time.monotonic() < deadline, "rollups were not flushed"
+        time.sleep(0.05)
+    assert ping_rollup(db) == [(1, 10.0, 10.0)]
+    db.disconnect()
@@ -0,0 +1,77 @@
+import pytest
+from db_utils import DatabaseUnavailableError
+from spool import LocalSpool
+from sqlite_db import SQLiteDatabaseManager
+
+INSERT_AGENT = "INSERT INTO agents (agent) VALUES (%s)"
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = SQLiteDatabaseManager({'path': str(tmp_path / 'monitor.db')})
+    assert db.connect()
+    yield db
+    db.disconnect()
+
+
+def open_spool(db, tmp_path, replay_batch_rows=5000):
+    # Opened without the replayer thread so the test drives replay_once itself
+    spool = LocalSpool(db, {'path': str(tmp_path / 'spool.db'), 'replay_batch_rows': replay_batch_rows})
+    spool.open()
+    db.spool = spool
+    return spool
+
+
+def insert_agents(*agents):
+    return [(INSERT_AGENT, [(agent,) for agent in agents])]
+
+
+def agents(db):
+    return [row['agent'] for row in db.fetch_all("SELECT agent FROM agents ORDER BY agent")]
+
+
+def test_writes_are_spooled_during_an_outage(db, tmp_path, monkeypatch):
+    spool = open_spool(db, tmp_path)
+    
+    def unavailable(statements):
+        raise DatabaseUnavailableError("database is locked")
+    
+    execute_statements = db.execute_statements
+    monkeypatch.setattr(db, 'execute_statements', unavailable)
+    assert db.write_now(insert_agents('site-a', 'site-b'))
+    assert spool.outage.is_set()
+    # Once in an outage new writes go straight to the spool
+    monkeypatch.setattr(db, 'execute_statements', execute_statements)
+    assert db.write_now(insert_agents('site-c'))
+    assert agents(db) == []
+    assert spool.get_stats()['pending_rows'] == 3
+    
+    assert spool.replay_once() == 3
+    assert agents(db) == ['site-a', 'site-b', 'site-c']
+    assert spool.pending_rows() == 0
+
+
+def test_replay_drains_in_chunks(db, tmp_path):
+    spool = open_spool(db, tmp_path, replay_batch_rows=4)
+    for i in range(5):
+        assert spool.append(insert_agents(f'site-{i}a', f'site-{i}b'))
+    
+    assert [spool.replay_once() for _ in range(4)] == [4, 4, 2, 0]
+    assert len(agents(db)) == 10
+    stats = spool.get_stats()
+    assert stats['rows_replayed'] == 10
+    assert stats['pending_rows'] == 0
+
+
+def test_rejected_write_is_dropped_alone(db, tmp_path):
+    spool = open_spool(db, tmp_path)
+    spool.append(insert_agents('site-a', 'site-b'))
+    spool.append([("INSERT INTO missing_table (agent) VALUES (%s)", [('site-c',), ('site-d',), ('site-e',)])])
+    spool.append(insert_agents('site-f'))
+    
+    assert spool.replay_once() == 3
+    assert agents(db) == ['site-a', 'site-b', 'site-f']
+    stats = spool.get_stats()
+    assert stats['rows_replayed'] == 3
+    assert stats['rows_dropped'] == 3
+    assert stats['pending_rows'] == 0
@@ -0,0 +1,109 @@
+from datetime import datetime
+import pytest
+from db_utils import traceroute_path_id
+from sqlite_db import SQLiteDatabaseManager
+
+TIMESTAMP = datetime(2026, 1, 1, 12, 0, 30)
+UNIX_TIMESTAMP = 1_767_268_830_000
+
+HOPS = [
+    {'hop_number': 1, 'hop_ip': '192.168.1.1', 'hop_hostname': 'router', 'rtt_ms': 1.2,
+     'packets_sent': 3, 'packets_received': 3, 'is_timeout': False},
+    {'hop_number': 2, 'hop_ip': None, 'hop_hostname': None, 'rtt_ms': None,
+     'packets_sent': 3, 'packets_received': 0, 'is_timeout': True},
+]
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = SQLiteDatabaseManager({'path': str(tmp_path / 'monitor.db'),
+                                'rollups': {'enabled': True, 'flush_interval_seconds': 3600}})
+    assert db.connect()
+    yield db
+    db.disconnect()
+
+
+def test_ping_result(db):
+    assert db.insert_ping_result(TIMESTAMP, UNIX_TIMESTAMP, 'example.com', '93.184.216.34', 12.5, 10.0, 15.0,
+                                 1.5, 0.0, True, 'good', delta_ms=0.5, ewma_jitter_ms=1.2, agent='site-a')
+    rows = db.fetch_all("SELECT * FROM ping")
+    assert len(rows) == 1
+    assert rows[0]['target'] == 'example.com'
+    assert rows[0]['agent'] == 'site-a'
+    assert rows[0]['ping_ms'] == 12.5
+    assert rows[0]['timestamp'] == '2026-01-01 12:00:30.000'
+    assert db.get_last_ping_sample('example.com') == (12.5, 1.2)
+
+
+def test_traceroute_run(db):
+    path_id = traceroute_path_id(HOPS)
+    assert db.insert_traceroute_run('trace-1', TIMESTAMP, UNIX_TIMESTAMP, 'example.com', path_id, HOPS)
+    # A repeated path write is ignored (INSERT IGNORE -> INSERT OR IGNORE)
+    assert db.insert_traceroute_run('trace-2', TIMESTAMP, UNIX_TIMESTAMP + 60_000, 'example.com', path_id, HOPS,
+                                    previous_path_id=path_id)
+    rows = db.fetch_all("SELECT trace_id, hop_count, timeout_count, route_changed FROM traceroute_runs "
+                        "ORDER BY trace_id")
+    assert [(row['trace_id'], row['hop_count'], row['timeout_count'], row['route_changed']) for row in rows] == [
+        ('trace-1', 2, 1, 0), ('trace-2', 2, 1, 0)]
+    assert len(db.fetch_all("SELECT * FROM traceroute_path_hops")) == 2
+    assert db.get_last_traceroute_path('example.com') == path_id
+
+
+def test_speedtest_result(db):
+    assert db.insert_speedtest_result(TIMESTAMP, UNIX_TIMESTAMP, 'Server', 'City', 'Country', 250.0, 50.0,
+                                      8.0, 1.0, 0.0, 'ISP', '203.0.113.1', 8.0, 30.0, 25.0, 'B', 20.0, True,
+                                      latency_phases={'idle': {'median_ms': 8.0}})
+    rows = db.fetch_all("SELECT server_name, download_mbps, latency_phases, agent FROM speedtest")
+    assert [(row['server_name'], row['download_mbps'], row['agent']) for row in rows] == [('Server', 250.0, None)]
+    assert rows[0]['latency_phases'] == '{"idle": {"median_ms": 8.0}}'
+
+
+def test_dns_result(db):
+    assert db.insert_dns_result(TIMESTAMP, UNIX_TIMESTAMP, 'example.com', '1.1.1.1', 'A', 20.0,
+                                ['93.184.216.34'], True)
+    answer_set_id = db.get_last_dns_answer_set('example.com', '1.1.1.1', 'A')
+    assert answer_set_id is not None
+    assert db.insert_dns_result(TIMESTAMP, UNIX_TIMESTAMP + 60_000, 'example.com', '1.1.1.1', 'A', 22.0,
+                                ['93.184.216.35'], True, previous_answer_set_id=answer_set_id)
+    rows = db.fetch_all("SELECT domain, nameserver, record_type, resolution_time_ms FROM dns_queries "
+                        "ORDER BY unix_timestamp")
+    assert [row['resolution_time_ms'] for row in rows] == [20.0, 22.0]
+    assert rows[0]['nameserver'] == '1.1.1.1'
+    changes = db.fetch_all("SELECT previous_answer_set_id FROM dns_answer_changes")
+    assert [row['previous_answer_set_id'] for row in changes] == [answer_set_id]
+
+
+def test_address_change(db):
+    assert db.insert_address_change(TIMESTAMP, UNIX_TIMESTAMP, 'example.com', None, '93.184.216.34')
+    assert db.insert_address_change(TIMESTAMP, UNIX_TIMESTAMP + 60_000, 'example.com', '93.184.216.34',
+                                    '93.184.216.35')
+    assert db.get_last_address('example.com') == '93.184.216.35'
+
+
+def test_http_result(db):
+    assert db.insert_http_result(TIMESTAMP, UNIX_TIMESTAMP, 'https://example.com/', 5.0, 10.0, 20.0, 50.0,
+                                 80.0, 200, 1256, 'TLSv1.3', True, measurement_mode='warm')
+    rows = db.fetch_all("SELECT url, status_code, total_time_ms, measurement_mode FROM http_requests")
+    assert [(row['url'], row['status_code'], row['total_time_ms'], row['measurement_mode']) for row in rows] == [
+        ('https://example.com/', 200, 80.0, 'warm')]
+
+
+def test_rollup_upsert_adds_to_stored_bucket(db):
+    for ping_ms in (10.0, 20.0):
+        db.insert_ping_result(TIMESTAMP, UNIX_TIMESTAMP, 'example.com', None, ping_ms, ping_ms, ping_ms,
+                              0.0, 0.0, True, 'good')
+        # Each flush upserts (ON DUPLICATE KEY UPDATE -> ON CONFLICT DO UPDATE) into the same bucket
+        assert db.flush_rollups()
+    db.insert_http_result(TIMESTAMP, UNIX_TIMESTAMP, 'https://example.com/', None, None, None, None,
+                          None, None, None, None, False, error_message='timeout')
+    db.insert_dns_result(TIMESTAMP, UNIX_TIMESTAMP, 'example.com', '1.1.1.1', 'A', 20.0,
+                         ['93.184.216.34'], True)
+    assert db.flush_rollups()
+    
+    rows = db.fetch_all("SELECT bucket_start, sample_count, latency_sum, latency_min, latency_max, status_good "
+                        "FROM ping_rollup WHERE granularity = '1m'")
+    assert [tuple(row.values()) for row in rows] == [('2026-01-01 12:00:00.000', 2, 30.0, 10.0, 20.0, 2)]
+    rows = db.fetch_all("SELECT request_count, success_count, status_error FROM http_rollup WHERE granularity = '1h'")
+    assert [tuple(row.values()) for row in rows] == [(1, 0, 1)]
+    rows = db.fetch_all("SELECT query_count, resolution_sum FROM dns_rollup WHERE granularity = '1d'")
+    assert [tuple(row.values()) for row in rows] == [(1, 20.0)]
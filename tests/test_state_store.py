@@ -0,0 +1,63 @@
+from state_store import StateStore
+
+NOW = 1_800_000_000  # seconds
+NOW_MS = NOW * 1000
+
+
+def add_ping(store, unix_timestamp, ping_ms=10.0, target='example.com', agent=None):
+    store.add('ping', {
+        'unix_timestamp': unix_timestamp, 'target': target, 'ping_ms': ping_ms,
+        'jitter_ms': 1.0, 'packet_loss': 0.0, 'is_reachable': ping_ms is not None,
+        'connection_status': 'good' if ping_ms is not None else 'down', 'agent': agent
+    })
+
+
+def test_history_window_boundary():
+    store = StateStore({'samples': 100})
+    add_ping(store, NOW_MS - 7200 * 1000)        # 2h old
+    add_ping(store, NOW_MS - 3600 * 1000 - 1)    # just outside the hour
+    add_ping(store, NOW_MS - 3600 * 1000)        # exactly at the boundary
+    add_ping(store, NOW_MS - 60 * 1000, None)
+    add_ping(store, NOW_MS)
+    
+    history = store.history('ping', 'example.com', seconds=3600, now=NOW)
+    assert history['unix_timestamp'] == [NOW_MS - 3600 * 1000, NOW_MS - 60 * 1000, NOW_MS]
+    assert history['ping_ms'] == [10.0, None, 10.0]
+    assert history['connection_status'] == ['good', 'down', 'good']
+    assert history['is_reachable'] == [True, False, True]
+
+
+def test_history_after_wraparound():
+    store = StateStore({'samples': 5})
+    for i in range(12):
+        add_ping(store, NOW_MS - (11 - i) * 1000, float(i))
+    
+    history = store.history('ping', 'example.com', seconds=3, now=NOW)
+    assert history['ping_ms'] == [8.0, 9.0, 10.0, 11.0]
+    assert store.history('ping', 'example.com', seconds=3600, now=NOW)['ping_ms'] == [7.0, 8.0, 9.0, 10.0, 11.0]
+
+
+def test_latest_per_series_and_agent():
+    store = StateStore({})
+    add_ping(store, NOW_MS - 1000, 5.0)
+    add_ping(store, NOW_MS, 6.0)
+    add_ping(store, NOW_MS, 7.0, agent='site-a')
+    
+    latest = {(row['target'], row['agent']): row for row in store.latest('ping')}
+    assert latest[('example.com', None)]['ping_ms'] == 6.0
+    assert latest[('example.com', None)]['unix_timestamp'] == NOW_MS
+    assert latest[('example.com', 'site-a')]['ping_ms'] == 7.0
+    assert [row['agent'] for row in store.latest('ping', agent='site-a')] == ['site-a']
+    assert store.history('ping', 'missing.com') is None
+
+
+def test_latency_histogram_is_cumulative():
+    store = StateStore({'histogram_buckets_ms': (10, 100)})
+    for ping_ms in (5.0, 10.0, 50.0, 500.0, None):
+        add_ping(store, NOW_MS, ping_ms)
+    
+    [(series, bounds, cumulative, total, count)] = store.latency_histograms('ping')
+    assert series == {'target': 'example.com', 'agent': None}
+    assert bounds == (10, 100)
+    assert cumulative == [2, 3, 4]
+    assert (total, count) == (565.0, 4)
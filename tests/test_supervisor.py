@@ -0,0 +1,126 @@
+import os
+import time
+import multiprocessing
+from threading import Thread
+import pytest
+
+
+@pytest.fixture(scope='module')
+def supervisor(tmp_path_factory):
+    # network_monitor opens its log file in the working directory on import
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('supervisor'))
+    try:
+        import supervisor
+    finally:
+        os.chdir(cwd)
+    return supervisor
+
+
+CONFIG = {
+    'ping': {'enabled': True, 'targets': [f"host-{i}.example.com" for i in range(200)]},
+    'traceroute': {'enabled': True, 'targets': [{'target': f"host-{i}.example.com"} for i in range(50)]},
+    'dns': {'enabled': True},
+    'http': {'enabled': True, 'urls': [f"https://site-{i}.example.com/" for i in range(40)]},
+    'speedtest': {'enabled': True},
+}
+
+
+def test_hash_ring_moves_few_keys_when_a_worker_is_added(supervisor):
+    keys = [f"host-{i}.example.com" for i in range(2000)]
+    before = supervisor.HashRing([f"worker-{i}" for i in range(4)])
+    after = supervisor.HashRing([f"worker-{i}" for i in range(5)])
+    moved = [key for key in keys if before.node_for(key) != after.node_for(key)]
+    # Only keys taken over by the new worker move, about a fifth of them
+    assert all(after.node_for(key) == 'worker-4' for key in moved)
+    assert 0.1 < len(moved) / len(keys) < 0.3
+    assert supervisor.HashRing([f"worker-{i}" for i in range(4)]).node_for(keys[0]) == before.node_for(keys[0])
+
+
+def test_shard_config_gives_every_target_to_one_worker(supervisor):
+    nodes = [f"worker-{i}" for i in range(3)]
+    ring = supervisor.HashRing(nodes)
+    shards = [supervisor.shard_config(CONFIG, ring, node) for node in nodes]
+    
+    for section, key, _ in supervisor.SHARDED_LISTS:
+        if key not in CONFIG[section]:
+            continue
+        assigned = [item for shard in shards for item in shard[section][key]]
+        assert sorted(map(str, assigned)) == sorted(map(str, CONFIG[section][key]))
+    # Sections without a target list and the speed test run on exactly one worker
+    assert sum(shard['dns'].get('enabled', True) for shard in shards) == 1
+    assert sum(shard['speedtest']['enabled'] for shard in shards) == 1
+    assert all(shard['retention'] == {'enabled': False} for shard in shards)
+    assert CONFIG['ping']['enabled'] and len(CONFIG['ping']['targets']) == 200
+
+
+class _ExitedProcess:
+    exitcode = 1
+    pid = None
+    
+    def is_alive(self):
+        return False
+
+
+def test_restart_backoff_doubles_while_crashing(supervisor, monkeypatch):
+    instance = supervisor.Supervisor()
+    instance.restart_delay = 1
+    instance.max_restart_delay = 8
+    worker = supervisor._Worker('worker-0')
+    instance.workers = [worker]
+    
+    def start_worker(worker):
+        worker.process = _ExitedProcess()
+        worker.started = time.monotonic()
+        worker.restart_at = None
+    
+    monkeypatch.setattr(instance, 'start_worker', start_worker)
+    start_worker(worker)
+    delays = []
+    for _ in range(5):
+        instance.check_workers()
+        delays.append(round(worker.restart_at - time.monotonic()))
+        worker.restart_at = time.monotonic()
+        instance.check_workers()
+    assert delays == [1, 2, 4, 8, 8]
+    assert worker.restarts == 5
+    
+    # A worker that ran longer than the backoff cap starts over at the first delay
+    worker.started = time.monotonic() - 60
+    instance.check_workers()
+    assert round(worker.restart_at - time.monotonic()) == 1
+
+
+class _RecordingDatabase:
+    def __init__(self):
+        self.calls = []
+    
+    def insert_ping_result(self, **kwargs):
+        self.calls.append(kwargs['target'])
+        return True
+    
+    def get_last_ping_sample(self, target):
+        return (len(self.calls), None)
+
+
+def test_forwarded_inserts_are_batched(supervisor):
+    parent_end, child_end = multiprocessing.Pipe()
+    instance = supervisor.Supervisor()
+    instance.db_manager = _RecordingDatabase()
+    instance.connections[parent_end] = supervisor._Worker('worker-0')
+    writer = Thread(target=instance.writer_loop, daemon=True)
+    writer.start()
+    
+    forwarder = supervisor.ForwardingDatabaseManager(child_end, batch_size=3, flush_interval=60)
+    for i in range(4):
+        assert forwarder.insert_ping_result(target=f"host-{i}")
+    # The lookup follows the still buffered insert in the same message and sees it written
+    assert forwarder.get_last_ping_sample('host-0') == (4, None)
+    forwarder.insert_ping_result(target='host-4')
+    forwarder.disconnect()
+    instance.stop_event.set()
+    writer.join(timeout=5)
+    
+    assert instance.db_manager.calls == [f"host-{i}" for i in range(5)]
+    assert instance.calls == 6
+    assert instance.messages == 3
@@ -0,0 +1,18 @@
+import json
+import os
+import pytest
+from bench_traceroute_parser import CORPUS_DIR, load_corpus
+from traceroute_parser import parse_traceroute
+
+CORPUS = load_corpus()
+
+
+def test_corpus_is_not_empty():
+    assert CORPUS
+
+
+@pytest.mark.parametrize('name, output', CORPUS, ids=[name for name, _ in CORPUS])
+def test_fixture_parses_to_expected_hops(name, output):
+    with open(os.path.join(CORPUS_DIR, f"{name}.json")) as f:
+        expected = json.load(f)
+    assert parse_traceroute(output) == expected
@@ -0,0 +1,23 @@
+from db_utils import WriteBehindQueue
+from sqlite_db import SQLiteDatabaseManager
+
+INSERT_AGENT = "INSERT INTO agents (agent) VALUES (%s)"
+
+
+def test_rejected_item_is_dropped_alone(tmp_path):
+    db = SQLiteDatabaseManager({'path': str(tmp_path / 'write_behind.db')})
+    assert db.connect()
+    queue = WriteBehindQueue(db, {})
+    items = [
+        [(INSERT_AGENT, [('site-a',), ('site-b',)])],
+        [("INSERT INTO missing_table (agent) VALUES (%s)", [('site-c',)])],
+        [(INSERT_AGENT, [('site-d',)])],
+    ]
+    queue._flush(items, 4)
+    
+    agents = [row['agent'] for row in db.fetch_all("SELECT agent FROM agents ORDER BY agent")]
+    assert agents == ['site-a', 'site-b', 'site-d']
+    stats = queue.get_stats()
+    assert stats['rows_flushed'] == 3
+    assert stats['rows_failed'] == 1
+    db.disconnect()
@@ -4,169 +4,41 @@ Traceroute monitoring module
 import time
 import socket
 import subprocess
-import re
 import uuid
 import logging
 from datetime import datetime
-from threading import Thread, Event
+from threading import Event
 import platform
+from collections import Counter
+from db_utils import traceroute_path_id
+from icmp_engine import address_family
+from traceroute_parser import parse_traceroute
+from scheduler import target_entries
 
 logger = logging.getLogger(__name__)
 
 
 class TracerouteMonitor:
-    def __init__(self, db_manager, config):
+    def __init__(self, db_manager, config, scheduler, icmp_engine=None, resolver=None):
         self.db_manager = db_manager
         self.config = config
+        self.scheduler = scheduler
         self.stop_event = Event()
-        self.thread = None
         self.is_windows = platform.system().lower() == 'windows'
+        # Shared ICMP engine for in-process traceroutes; None means the traceroute command is used
+        self.engine = icmp_engine if config.get('engine', 'auto') == 'auto' else None
+        # Shared ResolutionCache; None means targets are resolved on every run
+        self.resolver = resolver
+        # Paths whose hops are already stored, and the last path seen per target
+        self.known_paths = set()
+        self.last_path = {}
     
     def parse_traceroute_output(self, output, target):
         """
         Parse traceroute output and extract hop information
         Returns list of hop dictionaries
         """
-        hops = []
-        lines = output.split('\n')
-        
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-            
-            # Windows tracert format: "  1    <1 ms    <1 ms    <1 ms  192.168.1.1"
-            # Linux traceroute format: " 1  192.168.1.1 (192.168.1.1)  0.123 ms  0.456 ms  0.789 ms"
-            
-            if self.is_windows:
-                hop_data = self.parse_windows_tracert(line)
-            else:
-                hop_data = self.parse_linux_traceroute(line)
-            
-            if hop_data:
-                hops.append(hop_data)
-        
-        return hops
-    
-    def parse_windows_tracert(self, line):
-        """Parse Windows tracert output line"""
-        # Match pattern like: "  1    <1 ms    <1 ms    <1 ms  192.168.1.1"
-        # Or: "  2     *        *        *     Request timed out."
-        
-        # Try to extract hop number first
-        hop_match = re.match(r'^\s*(\d+)\s+', line)
-        if not hop_match:
-            return None
-        
-        hop_number = int(hop_match.group(1))
-        
-        # Check for timeout
-        if 'timed out' in line.lower() or '*' in line:
-            return {
-                'hop_number': hop_number,
-                'hop_ip': None,
-                'hop_hostname': None,
-                'rtt_ms': None,
-                'packets_sent': 3,
-                'packets_received': 0,
-                'is_timeout': True
-            }
-        
-        # Extract IP and hostname
-        # Pattern: hop_num  time1  time2  time3  [hostname] ip
-        ip_pattern = r'(\d+\.\d+\.\d+\.\d+)'
-        hostname_pattern = r'([a-zA-Z0-9\-\.]+)\s+\[(\d+\.\d+\.\d+\.\d+)\]'
-        
-        hop_ip = None
-        hop_hostname = None
-        
-        # Try to match hostname with IP
-        hostname_match = re.search(hostname_pattern, line)
-        if hostname_match:
-            hop_hostname = hostname_match.group(1)
-            hop_ip = hostname_match.group(2)
-        else:
-            # Just IP address
-            ip_match = re.search(ip_pattern, line)
-            if ip_match:
-                hop_ip = ip_match.group(1)
-        
-        # Extract RTT times
-        rtt_times = []
-        rtt_pattern = r'<?(\d+)\s*ms'
-        for match in re.finditer(rtt_pattern, line):
-            rtt_times.append(float(match.group(1)))
-        
-        packets_received = len(rtt_times)
-        avg_rtt = sum(rtt_times) / len(rtt_times) if rtt_times else None
-        
-        return {
-            'hop_number': hop_number,
-            'hop_ip': hop_ip,
-            'hop_hostname': hop_hostname,
-            'rtt_ms': avg_rtt,
-            'packets_sent': 3,
-            'packets_received': packets_received,
-            'is_timeout': packets_received == 0
-        }
-    
-    def parse_linux_traceroute(self, line):
-        """Parse Linux traceroute output line"""
-        # Pattern: " 1  192.168.1.1 (192.168.1.1)  0.123 ms  0.456 ms  0.789 ms"
-        # Or: " 2  * * *"
-        
-        hop_match = re.match(r'^\s*(\d+)\s+', line)
-        if not hop_match:
-            return None
-        
-        hop_number = int(hop_match.group(1))
-        
-        # Check for timeout
-        if line.count('*') >= 3:
-            return {
-                'hop_number': hop_number,
-                'hop_ip': None,
-                'hop_hostname': None,
-                'rtt_ms': None,
-                'packets_sent': 3,
-                'packets_received': 0,
-                'is_timeout': True
-            }
-        
-        # Extract hostname and IP
-        hostname_ip_pattern = r'([a-zA-Z0-9\-\.]+)\s+\((\d+\.\d+\.\d+\.\d+)\)'
-        ip_only_pattern = r'(\d+\.\d+\.\d+\.\d+)'
-        
-        hop_ip = None
-        hop_hostname = None
-        
-        hostname_match = re.search(hostname_ip_pattern, line)
-        if hostname_match:
-            hop_hostname = hostname_match.group(1)
-            hop_ip = hostname_match.group(2)
-        else:
-            ip_match = re.search(ip_only_pattern, line)
-            if ip_match:
-                hop_ip = ip_match.group(1)
-        
-        # Extract RTT times
-        rtt_times = []
-        rtt_pattern = r'(\d+\.?\d*)\s*ms'
-        for match in re.finditer(rtt_pattern, line):
-            rtt_times.append(float(match.group(1)))
-        
-        packets_received = len(rtt_times)
-        avg_rtt = sum(rtt_times) / len(rtt_times) if rtt_times else None
-        
-        return {
-            'hop_number': hop_number,
-            'hop_ip': hop_ip,
-            'hop_hostname': hop_hostname,
-            'rtt_ms': avg_rtt,
-            'packets_sent': 3,
-            'packets_received': packets_received,
-            'is_timeout': packets_received == 0
-        }
+        return parse_traceroute(output)
     
     def perform_traceroute(self, target, max_hops=30, timeout=2):
         """
@@ -187,7 +59,7 @@ class TracerouteMonitor:
             
             hops = self.parse_traceroute_output(result.stdout, target)
             return hops
-            
+        
         except subprocess.TimeoutExpired:
             logger.error(f"Traceroute to {target} timed out")
             return []
@@ -195,70 +67,146 @@ class TracerouteMonitor:
             logger.error(f"Error performing traceroute to {target}: {e}")
             return []
     
+    def resolve_hostname(self, target):
+        """Resolve hostname to IP address (IPv4 preferred, IPv6 for v6-only names and literals)"""
+        if self.resolver:
+            return self.resolver.resolve(target)
+        try:
+            return socket.gethostbyname(target)
+        except socket.gaierror:
+            pass
+        try:
+            return socket.getaddrinfo(target, None, socket.AF_INET6)[0][4][0]
+        except socket.gaierror:
+            return None
+    
+    def perform_native_traceroute(self, target, address, max_hops=30, timeout=2):
+        """
+        Traceroute through the ICMP engine: all TTLs are probed at once
+        Returns the same hop dictionaries as the parsed traceroute output.
+        """
+        probes_per_hop = self.config.get('probes_per_hop', 3)
+        hops = []
+        for hop in self.engine.trace(address, max_hops, timeout, probes_per_hop):
+            responses = [response for response in hop['responses'] if response]
+            if not responses:
+                hops.append({
+                    'hop_number': hop['ttl'],
+                    'hop_ip': None,
+                    'hop_hostname': None,
+                    'rtt_ms': None,
+                    'packets_sent': probes_per_hop,
+                    'packets_received': 0,
+                    'is_timeout': True
+                })
+                continue
+            
+            # Several routers can answer for one TTL; the hop is the one answering most probes
+            responders = Counter(response['address'] for response in responses)
+            annotation = next((response['annotation'] for response in responses
+                               if response['annotation']), None)
+            hops.append({
+                'hop_number': hop['ttl'],
+                'hop_ip': responders.most_common(1)[0][0],
+                'hop_hostname': None,
+                'rtt_ms': sum(response['rtt_ms'] for response in responses) / len(responses),
+                'packets_sent': probes_per_hop,
+                'packets_received': len(responses),
+                'is_timeout': False,
+                'responders': sorted(responders),
+                'annotation': annotation
+            })
+            if annotation or any(response['reached'] for response in responses):
+                break
+        
+        return hops
+    
+    def resolve_hop_hostnames(self, hops):
+        """Reverse-resolve hop addresses that have no hostname yet"""
+        for hop in hops:
+            if hop['hop_ip'] and not hop['hop_hostname']:
+                try:
+                    hop['hop_hostname'] = socket.gethostbyaddr(hop['hop_ip'])[0]
+                except (socket.herror, socket.gaierror, OSError):
+                    pass
+    
     def store_traceroute_results(self, target, hops):
-        """Store traceroute results in database"""
+        """
+        Store traceroute results in database
+        Each run is one row referencing its path; hops are only written for new paths.
+        """
         if not hops:
             return
         
         trace_id = str(uuid.uuid4())
         now = datetime.now()
         unix_timestamp = int(time.time() * 1000)
+        path_id = traceroute_path_id(hops)
+        new_path = path_id not in self.known_paths
+        # Hostnames are only stored with new paths, so only those are reverse-resolved
+        if new_path and self.config.get('resolve_hostnames', True):
+            self.resolve_hop_hostnames(hops)
+        
+        if target not in self.last_path:
+            self.last_path[target] = self.db_manager.get_last_traceroute_path(target)
+        previous_path_id = self.last_path[target]
+        
+        success = self.db_manager.insert_traceroute_run(
+            trace_id=trace_id,
+            timestamp=now,
+            unix_timestamp=unix_timestamp,
+            target=target,
+            path_id=path_id,
+            hops=hops,
+            previous_path_id=previous_path_id,
+            new_path=new_path
+        )
+        
+        if not success:
+            logger.error(f"Failed to store traceroute to {target} ({len(hops)} hops)")
+            return
         
-        for hop in hops:
-            success = self.db_manager.insert_traceroute_hop(
-                trace_id=trace_id,
-                timestamp=now,
-                unix_timestamp=unix_timestamp,
-                target=target,
-                hop_number=hop['hop_number'],
-                hop_ip=hop['hop_ip'],
-                hop_hostname=hop['hop_hostname'],
-                rtt_ms=hop['rtt_ms'],
-                packets_sent=hop['packets_sent'],
-                packets_received=hop['packets_received'],
-                is_timeout=hop['is_timeout']
-            )
-            
-            if not success:
-                logger.error(f"Failed to store traceroute hop {hop['hop_number']} for {target}")
+        self.known_paths.add(path_id)
+        self.last_path[target] = path_id
         
-        logger.info(f"Traceroute to {target}: {len(hops)} hops stored (trace_id: {trace_id})")
+        if previous_path_id is not None and previous_path_id != path_id:
+            logger.warning(f"Route to {target} changed: path {previous_path_id} -> {path_id}")
+        logger.info(f"Traceroute to {target}: {len(hops)} hops, path {path_id}"
+                   f"{' (new)' if new_path else ''} (trace_id: {trace_id})")
     
-    def monitor_loop(self):
-        """Main monitoring loop"""
-        interval = self.config.get('interval_seconds', 60)
-        targets = self.config.get('targets', ['google.com'])
-        max_hops = self.config.get('max_hops', 30)
-        timeout = self.config.get('timeout_seconds', 2)
-        
-        logger.info(f"Starting traceroute monitor with {len(targets)} targets, "
-                   f"interval: {interval}s")
-        
-        while not self.stop_event.is_set():
-            for target in targets:
-                if self.stop_event.is_set():
-                    break
-                
-                hops = self.perform_traceroute(target, max_hops, timeout)
-                self.store_traceroute_results(target, hops)
-            
-            # Wait for next interval
-            self.stop_event.wait(interval)
+    def traceroute_job(self, target, max_hops, timeout):
+        """Scheduled job: trace one target and store the result"""
+        address = self.resolve_hostname(target) if self.engine else None
+        if address and self.engine.supports_trace(address_family(address)):
+            hops = self.perform_native_traceroute(target, address, max_hops, timeout)
+        else:
+            hops = self.perform_traceroute(target, max_hops, timeout)
+        self.store_traceroute_results(target, hops)
     
     def start(self):
-        """Start monitoring in a separate thread"""
+        """Register one traceroute job per target with the scheduler"""
         if not self.config.get('enabled', True):
             logger.info("Traceroute monitor is disabled")
             return
         
-        self.thread = Thread(target=self.monitor_loop, daemon=True)
-        self.thread.start()
-        logger.info("Traceroute monitor started")
+        interval = self.config.get('interval_seconds', 60)
+        targets = target_entries(self.config.get('targets', ['google.com']), 'target', interval)
+        max_hops = self.config.get('max_hops', 30)
+        timeout = self.config.get('timeout_seconds', 2)
+        
+        self.scheduler.configure_monitor('traceroute', self.config.get('workers', 2),
+                                         self.config.get('priority', 2))
+        self.scheduler.add_jobs('traceroute', [
+            (target, target_interval,
+             lambda target=target: self.traceroute_job(target, max_hops, timeout))
+            for target, target_interval in targets
+        ])
+        logger.info(f"Traceroute monitor started with {len(targets)} targets, "
+                   f"engine: {'icmp' if self.engine else 'subprocess'}")
     
     def stop(self):
         """Stop monitoring"""
         logger.info("Stopping traceroute monitor...")
         self.stop_event.set()
-        if self.thread:
-            self.thread.join(timeout=10)
+        self.scheduler.remove_jobs('traceroute')
         logger.info("Traceroute monitor stopped")
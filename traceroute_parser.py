@@ -0,0 +1,132 @@
+"""
+Single-pass parser for traceroute (Linux/BSD) and tracert (Windows) output
+HOP_LINE reads the hop number, then the rest of the line is scanned once by one
+precompiled tokenizer; handles multiple responders per hop, IPv6 addresses and
+!H/!N/!X style annotations
+"""
+import re
+
+# Hop number at the start of a line
+HOP_LINE = re.compile(r'\s*(\d+)\s+')
+
+TOKEN = re.compile(r"""
+      (?P<rtt><?(?P<value>\d+(?:\.\d+)?)\s*ms\b)
+    | (?P<star>\*)
+    | (?P<annotation>!(?:<\d+>|[A-Z]*(?:-?\d+)?))
+    | [(\[](?P<address>[0-9A-Fa-f:.]+)(?:%[\w.]+)?[)\]]
+    | (?P<word>[^\s()\[\]*!]+)
+""", re.VERBOSE)
+
+ADDRESS = re.compile(r'\d{1,3}(?:\.\d{1,3}){3}$|[0-9A-Fa-f]*:[0-9A-Fa-f:.]*(?:%[\w.]+)?$')
+
+# tracert prints unreachable destinations as text instead of !H / !N
+UNREACHABLE_WORDS = {'host': '!H', 'net': '!N', 'network': '!N', 'protocol': '!P'}
+
+
+class _Hop:
+    __slots__ = ('number', 'responders', 'probes', 'annotation', 'pending')
+    
+    def __init__(self, number):
+        self.number = number
+        # (hostname or None, address) in order of appearance
+        self.responders = []
+        # (responder index, -1 before any responder, or None for a lost probe; rtt_ms or None)
+        self.probes = []
+        self.annotation = None
+        self.pending = None
+    
+    def flush_word(self):
+        """A word not followed by (address) is a responder only if it is an address itself"""
+        word = self.pending
+        self.pending = None
+        if ADDRESS.match(word):
+            self.responders.append((None, word))
+    
+    def scan(self, text):
+        responders = self.responders
+        probes = self.probes
+        for match in TOKEN.finditer(text):
+            kind = match.lastgroup
+            if kind == 'word':
+                word = match.group('word')
+                if word.startswith(('unreachable', 'Unreachable')):
+                    self.annotation = self.annotation or UNREACHABLE_WORDS.get((self.pending or '').lower(), '!X')
+                    self.pending = None
+                    continue
+                if self.pending is not None:
+                    self.flush_word()
+                self.pending = word
+                continue
+            
+            if kind == 'address':
+                address = match.group('address')
+                # Without a PTR record traceroute prints the address as the name
+                pending = self.pending
+                responders.append((pending if pending != address else None, address))
+                self.pending = None
+                continue
+            
+            if self.pending is not None:
+                self.flush_word()
+            if kind == 'rtt':
+                probes.append((len(responders) - 1, float(match.group('value'))))
+            elif kind == 'star':
+                probes.append((None, None))
+            else:
+                self.annotation = self.annotation or match.group('annotation')
+        if self.pending is not None:
+            self.flush_word()
+    
+    def to_dict(self):
+        rtts = [rtt for _, rtt in self.probes if rtt is not None]
+        hop = {
+            'hop_number': self.number,
+            'hop_ip': None,
+            'hop_hostname': None,
+            'rtt_ms': sum(rtts) / len(rtts) if rtts else None,
+            'packets_sent': len(self.probes) or 3,
+            'packets_received': len(rtts),
+            'is_timeout': not self.responders
+        }
+        responders = self.responders
+        if len(responders) == 1:
+            hop['hop_hostname'], hop['hop_ip'] = responders[0]
+            hop['responders'] = [responders[0][1]]
+        elif responders:
+            # The hop is the responder answering most probes; tracert prints the
+            # responder after the RTTs, so replies seen before any responder belong to the last
+            last = len(responders) - 1
+            answered = [0] * len(responders)
+            for index, rtt in self.probes:
+                if rtt is not None:
+                    answered[last if index < 0 else index] += 1
+            best = answered.index(max(answered))
+            hop['hop_hostname'], hop['hop_ip'] = responders[best]
+            hop['responders'] = sorted({address for _, address in responders})
+        if self.annotation:
+            hop['annotation'] = self.annotation
+        return hop
+
+
+def parse_traceroute(output):
+    """
+    Parse traceroute or tracert output
+    Returns list of hop dictionaries
+    """
+    hops = []
+    # Hop being assembled by the tokenizer, kept open for continuation lines
+    hop = None
+    for line in output.splitlines():
+        match = HOP_LINE.match(line)
+        if match:
+            if hop:
+                hops.append(hop.to_dict())
+            hop = _Hop(int(match.group(1)))
+            hop.scan(line[match.end():])
+        elif hop and line[:1].isspace() and not line.isspace():
+            # BSD/macOS print extra responders of a hop on indented continuation lines
+            hop.scan(line)
+    
+    if hop:
+        hops.append(hop.to_dict())
+    return hops
@@ -1,8 +1,173 @@
 """
 Update existing database schema to add new fields
 """
+import re
+from datetime import date
 import mysql.connector
 from mysql.connector import Error
+from config_loader import load_config
+from retention import RAW_TABLES, period_start, period_length, partition_by_clause, split_pmax_query
+from dimensions import DIMENSIONS, FACT_TABLES, storage_table, conversion_statements
+
+# Columns added to the *_data storage tables after they were introduced
+ADDED_DATA_COLUMNS = {
+    'ping_data': ['agent_id SMALLINT UNSIGNED AFTER connection_status'],
+    'traceroute_runs_data': ['agent_id SMALLINT UNSIGNED AFTER rtt_ms'],
+    'speedtest_data': ['discovery_seconds FLOAT AFTER test_duration_seconds',
+                       'measurement_seconds FLOAT AFTER discovery_seconds',
+                       'latency_phases JSON AFTER measurement_seconds',
+                       'agent_id SMALLINT UNSIGNED AFTER error_message'],
+    'dns_queries_data': ['agent_id SMALLINT UNSIGNED AFTER error_message'],
+    'http_requests_data': ["measurement_mode ENUM('cold', 'warm') NOT NULL DEFAULT 'cold' AFTER error_message",
+                           'agent_id SMALLINT UNSIGNED AFTER measurement_mode'],
+}
+
+# Key columns of the rollup tables before agent_id was added to their primary keys
+ROLLUP_KEYS = [
+    ('ping_rollup', ['granularity', 'bucket_start', 'target']),
+    ('dns_rollup', ['granularity', 'bucket_start', 'domain', 'nameserver', 'record_type']),
+    ('http_rollup', ['granularity', 'bucket_start', 'url']),
+]
+
+
+def schema_table_statements(table_names, schema_path='schema.sql'):
+    """Return the CREATE TABLE / CREATE VIEW statements for the given tables from schema.sql"""
+    with open(schema_path, 'r') as f:
+        schema = f.read()
+    
+    statements = {}
+    for statement in schema.split(';'):
+        match = re.search(r'CREATE (?:TABLE IF NOT EXISTS|OR REPLACE VIEW) (\w+)', statement)
+        if match and match.group(1) in table_names:
+            statements[match.group(1)] = statement[match.start():].strip()
+    return [(name, statements[name]) for name in table_names if name in statements]
+
+
+def create_tables(cursor, table_names):
+    """Create missing tables using their definitions in schema.sql"""
+    for name, statement in schema_table_statements(table_names):
+        try:
+            cursor.execute(statement)
+            print(f"✓ Created {name} table")
+        except Error as e:
+            print(f"  Warning: {e}")
+
+
+def is_base_table(cursor, name):
+    """Whether name is a table (not a view) in the current database"""
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND TABLE_TYPE = 'BASE TABLE'
+    """, (name,))
+    return cursor.fetchone()[0] > 0
+
+
+def drop_ping_foreign_keys(cursor):
+    """Partitioned tables cannot be referenced by foreign keys"""
+    cursor.execute("""
+        SELECT CONSTRAINT_NAME FROM information_schema.REFERENTIAL_CONSTRAINTS
+        WHERE CONSTRAINT_SCHEMA = DATABASE() AND TABLE_NAME = 'network_anomalies'
+          AND REFERENCED_TABLE_NAME = 'ping'
+    """)
+    for (constraint,) in cursor.fetchall():
+        cursor.execute(f"ALTER TABLE network_anomalies DROP FOREIGN KEY {constraint}")
+        print(f"✓ Dropped foreign key {constraint} from network_anomalies")
+
+
+def convert_fact_tables(connection, cursor):
+    """
+    Move fact tables to their *_data tables with dimension ids
+    Rows of a pre-dimension table are copied across, then the table is replaced
+    by a view with the same name and columns. A {fact}_legacy table left by an
+    interrupted run is converted first; a failed copy renames it back.
+    """
+    for fact, (table, _) in FACT_TABLES.items():
+        create_tables(cursor, [table])
+        for column in ADDED_DATA_COLUMNS.get(table, []):
+            try:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column}")
+                print(f"✓ Added {column.split()[0]} column to {table} table")
+            except Error as e:
+                if 'Duplicate column name' not in str(e):
+                    print(f"  Warning: {e}")
+        
+        legacy_table = f"{fact}_legacy"
+        if is_base_table(cursor, fact):
+            try:
+                cursor.execute(f"RENAME TABLE {fact} TO {legacy_table}")
+            except Error as e:
+                print(f"  Warning: could not convert {fact}: {e}")
+                continue
+        if is_base_table(cursor, legacy_table):
+            try:
+                cursor.execute(f"SHOW COLUMNS FROM {table}")
+                data_columns = [row[0] for row in cursor.fetchall()]
+                cursor.execute(f"SHOW COLUMNS FROM {legacy_table}")
+                legacy_columns = {row[0] for row in cursor.fetchall()}
+                *dimension_statements, copy_statement = conversion_statements(
+                    fact, legacy_table, data_columns, legacy_columns)
+                for query in dimension_statements:
+                    cursor.execute(query)
+                cursor.execute(copy_statement)
+                copied = cursor.rowcount
+                connection.commit()
+            except Error as e:
+                # RENAME commits on its own; put the table back so no view hides its rows
+                print(f"  Warning: could not convert {fact}: {e}")
+                connection.rollback()
+                try:
+                    cursor.execute(f"RENAME TABLE {legacy_table} TO {fact}")
+                except Error as rename_error:
+                    print(f"  Warning: {legacy_table} is left for the next run: {rename_error}")
+                continue
+            try:
+                cursor.execute(f"DROP TABLE {legacy_table}")
+            except Error as e:
+                print(f"  Warning: rows are copied, drop {legacy_table} before the next run: {e}")
+            print(f"✓ Converted {fact} to {table} ({copied} rows)")
+        create_tables(cursor, [fact])
+
+
+def partition_raw_tables(cursor, granularity='daily', precreate=7):
+    """
+    Convert unpartitioned raw tables to RANGE partitions on TO_DAYS(timestamp)
+    Partitions cover the oldest row's period through precreate periods ahead.
+    """
+    today = date.today()
+    for table in map(storage_table, RAW_TABLES):
+        try:
+            cursor.execute(f"SELECT MIN(timestamp) FROM {table}")
+            oldest = cursor.fetchone()[0]
+            first_start = period_start(oldest.date() if oldest else today, granularity)
+            last_start = period_start(today, granularity) + period_length(granularity) * precreate
+            
+            cursor.execute("""
+                SELECT PARTITION_NAME FROM information_schema.PARTITIONS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL
+            """, (table,))
+            partitions = [row[0] for row in cursor.fetchall()]
+            if partitions == ['pmax'] and oldest:
+                # Rows copied into a freshly created table all landed in the catch-all partition
+                cursor.execute(split_pmax_query(table, first_start, last_start, granularity))
+                print(f"✓ Split {table} into {granularity} partitions ({first_start} to {last_start})")
+                continue
+            if partitions:
+                print(f"  Table {table} is already partitioned")
+                continue
+            
+            # The partitioning column must be part of the primary key
+            cursor.execute(f"""
+                ALTER TABLE {table}
+                MODIFY id BIGINT NOT NULL AUTO_INCREMENT,
+                DROP PRIMARY KEY,
+                ADD PRIMARY KEY (id, timestamp)
+            """)
+            cursor.execute(f"ALTER TABLE {table} " +
+                           partition_by_clause(first_start, last_start, granularity))
+            print(f"✓ Partitioned {table} ({granularity}, {first_start} to {last_start})")
+        except Error as e:
+            print(f"  Warning: could not partition {table}: {e}")
+
 
 def update_schema():
     """Update database schema with new fields"""
@@ -22,29 +187,47 @@ def update_schema():
             print("✓ Connected to database")
             cursor = connection.cursor()
             
+            drop_ping_foreign_keys(cursor)
+            
+            # Tables from before the dimension tables are brought up to date before conversion
+            legacy = {fact for fact in FACT_TABLES if is_base_table(cursor, fact)}
+            
             # Add connection_status column to ping table
-            try:
-                cursor.execute("""
-                    ALTER TABLE ping 
-                    ADD COLUMN connection_status ENUM('excellent', 'good', 'fair', 'poor', 'down') 
-                    NOT NULL DEFAULT 'down' AFTER is_reachable
-                """)
-                print("✓ Added connection_status column to ping table")
-            except Error as e:
-                if 'Duplicate column name' in str(e):
-                    print("  Column connection_status already exists")
-                else:
-                    print(f"  Warning: {e}")
+            if 'ping' in legacy:
+                try:
+                    cursor.execute("""
+                        ALTER TABLE ping 
+                        ADD COLUMN connection_status ENUM('excellent', 'good', 'fair', 'poor', 'down') 
+                        NOT NULL DEFAULT 'down' AFTER is_reachable
+                    """)
+                    print("✓ Added connection_status column to ping table")
+                except Error as e:
+                    if 'Duplicate column name' in str(e):
+                        print("  Column connection_status already exists")
+                    else:
+                        print(f"  Warning: {e}")
             
-            # Add index for connection_status
-            try:
-                cursor.execute("ALTER TABLE ping ADD INDEX idx_connection_status (connection_status)")
-                print("✓ Added index for connection_status")
-            except Error as e:
-                if 'Duplicate key name' in str(e):
-                    print("  Index already exists")
-                else:
-                    print(f"  Warning: {e}")
+            # Add columns written by the monitors that older schemas lack
+            for table, column in [
+                ('ping', 'min_ping_ms FLOAT AFTER ping_ms'),
+                ('ping', 'max_ping_ms FLOAT AFTER min_ping_ms'),
+                ('ping', 'jitter_ms FLOAT AFTER max_ping_ms'),
+                ('ping', 'delta_ms FLOAT AFTER jitter_ms'),
+                ('ping', 'ewma_jitter_ms FLOAT AFTER delta_ms'),
+                ('speedtest', 'idle_latency_ms FLOAT AFTER external_ip'),
+                ('speedtest', 'download_latency_ms FLOAT AFTER idle_latency_ms'),
+                ('speedtest', 'upload_latency_ms FLOAT AFTER download_latency_ms'),
+                ('speedtest', 'bufferbloat_rating VARCHAR(1) AFTER upload_latency_ms'),
+                ('dns_queries', 'answer_set_id BIGINT AFTER resolution_time_ms'),
+            ]:
+                if table not in legacy:
+                    continue
+                try:
+                    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column}")
+                    print(f"✓ Added {column.split()[0]} column to {table} table")
+                except Error as e:
+                    if 'Duplicate column name' not in str(e):
+                        print(f"  Warning: {e}")
             
             # Create network_anomalies table
             try:
@@ -59,46 +242,63 @@ def update_schema():
                         metric_value FLOAT,
                         threshold_value FLOAT,
                         description TEXT,
-                        ping_id INT,
+                        ping_id BIGINT,
                         trace_id VARCHAR(36),
                         INDEX idx_timestamp (timestamp),
                         INDEX idx_target (target),
                         INDEX idx_anomaly_type (anomaly_type),
                         INDEX idx_severity (severity),
-                        FOREIGN KEY (ping_id) REFERENCES ping(id) ON DELETE SET NULL
+                        INDEX idx_ping_id (ping_id)
                     ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
                 """)
                 print("✓ Created network_anomalies table")
             except Error as e:
                 print(f"  Warning: {e}")
             
-            # Create speedtest table
+            # Create dimension tables and move fact rows to the *_data tables behind views
+            create_tables(cursor, [table for table, _, _ in DIMENSIONS.values()])
+            
+            # Create the collector's per-agent delivery state
+            create_tables(cursor, ['agent_batches'])
+            convert_fact_tables(connection, cursor)
+            
+            # Create interned DNS answer set tables
+            create_tables(cursor, ['dns_answer_sets', 'dns_answer_changes'])
+            
+            # Create hostname address history table
+            create_tables(cursor, ['address_changes'])
             try:
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS speedtest (
-                        id INT AUTO_INCREMENT PRIMARY KEY,
-                        timestamp DATETIME(3) NOT NULL,
-                        unix_timestamp BIGINT NOT NULL,
-                        server_name VARCHAR(255),
-                        server_location VARCHAR(255),
-                        server_country VARCHAR(100),
-                        download_mbps FLOAT,
-                        upload_mbps FLOAT,
-                        ping_ms FLOAT,
-                        jitter_ms FLOAT,
-                        packet_loss FLOAT,
-                        isp VARCHAR(255),
-                        external_ip VARCHAR(45),
-                        test_duration_seconds FLOAT,
-                        is_successful BOOLEAN NOT NULL,
-                        error_message TEXT,
-                        INDEX idx_timestamp (timestamp),
-                        INDEX idx_unix_timestamp (unix_timestamp)
-                    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
-                """)
-                print("✓ Created speedtest table")
+                cursor.execute("ALTER TABLE address_changes ADD COLUMN agent VARCHAR(255) AFTER address")
+                print("✓ Added agent column to address_changes table")
             except Error as e:
-                print(f"  Warning: {e}")
+                if 'Duplicate column name' not in str(e):
+                    print(f"  Warning: {e}")
+            
+            # Create content-addressed traceroute path tables
+            create_tables(cursor, ['traceroute_paths', 'traceroute_path_hops'])
+            
+            # Create rollup tables
+            create_tables(cursor, ['ping_rollup', 'dns_rollup', 'http_rollup'])
+            for table, key_columns in ROLLUP_KEYS:
+                try:
+                    cursor.execute(f"""
+                        ALTER TABLE {table}
+                        ADD COLUMN agent_id SMALLINT UNSIGNED NOT NULL DEFAULT 0 AFTER {key_columns[-1]},
+                        DROP PRIMARY KEY,
+                        ADD PRIMARY KEY ({', '.join(key_columns)}, agent_id)
+                    """)
+                    print(f"✓ Added agent_id to the key of {table} table")
+                except Error as e:
+                    if 'Duplicate column name' not in str(e):
+                        print(f"  Warning: {e}")
+            
+            # Convert raw tables to daily/weekly partitions
+            retention = (load_config() or {}).get('retention', {})
+            partition_raw_tables(
+                cursor,
+                retention.get('partition_granularity', 'daily'),
+                retention.get('precreate_partitions', 7)
+            )
             
             connection.commit()
             cursor.close()
@@ -108,7 +308,7 @@ def update_schema():
             print("✓ Schema update completed!")
             print("=" * 60)
             return True
-            
+    
     except Error as e:
         print(f"Error: {e}")
         return False